@@ -1,16 +1,74 @@
+import threading
+import time
+
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
 from rest_framework.test import APIClient
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
-from core.models import Item, UserProfile, Address, Coupon
+from core.models import Item, Order, OrderItem, UserProfile, Address, Coupon, address_cache, coupon_cache
+from core.gateways import get_gateway
+from core.payments import customer_cache
 from django_countries.fields import Country
 
 User = get_user_model()
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--run-slow',
+        action='store_true',
+        default=False,
+        help='Run tests marked slow (benchmarks, large seeded datasets)'
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip slow tests unless --run-slow is given"""
+    if config.getoption('--run-slow'):
+        return
+    skip_slow = pytest.mark.skip(reason='needs --run-slow to run')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip_slow)
+
+
+@pytest.fixture(autouse=True)
+def clear_coupon_cache():
+    """Rolled back test data never sends delete signals, so start each test cold"""
+    coupon_cache.clear()
+    yield
+    coupon_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_customer_cache():
+    """Stripe customers cached by one test must not answer another"""
+    customer_cache.clear()
+    yield
+    customer_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_address_cache():
+    """Default addresses cached by one test must not answer another"""
+    address_cache.clear()
+    yield
+    address_cache.clear()
+
+
+@pytest.fixture
+def fake_gateway(settings):
+    """Checkouts charge the in-process FakeGateway instead of Stripe"""
+    settings.PAYMENT_GATEWAY = 'core.gateways.FakeGateway'
+    settings.PAYMENT_GATEWAY_OPTIONS = {}
+    return get_gateway()
+
+
 @pytest.fixture
 def api_client():
     """Fixture to provide DRF API client"""
@@ -47,7 +105,8 @@ def test_item(db):
         label='P',
         slug='test-product',
         description='This is a test product',
-        image='test.jpg'
+        image='test.jpg',
+        stock_quantity=100
     )
     return item
 
@@ -65,12 +124,115 @@ def test_items(db):
             label='P' if i % 3 == 0 else 'S',
             slug=f'test-product-{i+1}',
             description=f'Test product description {i+1}',
-            image=f'test{i+1}.jpg'
+            image=f'test{i+1}.jpg',
+            stock_quantity=100
         )
         items.append(item)
     return items
 
 
+@pytest.fixture
+def create_item(db):
+    """Factory fixture: create_item(slug, stock=100, **fields) makes an item
+
+    The title comes from the slug and the price is 10.00 unless given
+    in ``fields``, which override any column.
+    """
+    def create(slug, stock=100, **fields):
+        values = {
+            'title': slug.title(),
+            'price': 10.00,
+            'category': 'S',
+            'label': 'P',
+            'description': 'Test',
+            'image': 'test.jpg',
+        }
+        values.update(fields)
+        return Item.objects.create(slug=slug, stock_quantity=stock, **values)
+    return create
+
+
+@pytest.fixture
+def create_order(db):
+    """Factory fixture: create_order(user, lines=(), **fields) makes an order
+
+    ``lines`` are (item, quantity) pairs, each added as its own order
+    item without holding stock; ``fields`` (ordered, coupon, ...) are
+    set on the order.
+    """
+    def create(user, lines=(), **fields):
+        fields.setdefault('ordered_date', timezone.now())
+        order = Order.objects.create(user=user, **fields)
+        for item, quantity in lines:
+            order.items.add(OrderItem.objects.create(user=user, item=item, quantity=quantity))
+        return order
+    return create
+
+
+@pytest.fixture
+def create_cart(db):
+    """Factory fixture: create_cart(user, lines=()) fills the user's open order
+
+    ``lines`` are (item, quantity) pairs applied with
+    apply_cart_operations, so every line holds its stock as a real cart
+    does.
+    """
+    def create(user, lines=()):
+        order, _ = Order.objects.get_or_create_cart(user)
+        if lines:
+            order.apply_cart_operations([
+                {'slug': item.slug, 'quantity': quantity} for item, quantity in lines])
+        return order
+    return create
+
+
+@pytest.fixture
+def run_concurrently():
+    """run_concurrently(worker, thread_count) starts the threads together and waits"""
+    def run(worker, thread_count):
+        barrier = threading.Barrier(thread_count)
+        errors = []
+
+        def target():
+            barrier.wait()
+            try:
+                worker()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=target) for _ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+    return run
+
+
+@pytest.fixture
+def retry_locked():
+    """retry_locked(operation) retries while SQLite reports a lock conflict
+
+    Each attempt runs in its own transaction, so a conflict halfway
+    through rolls the attempt back before it is retried. Other errors,
+    and a lock that outlasts ``attempts`` tries, are raised. The shared
+    in-memory test database reports its lock conflicts per table.
+    """
+    def retry(operation, attempts=2000):
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    return operation()
+            except OperationalError as error:
+                locked = str(error).startswith(('database is locked', 'database table is locked'))
+                if not locked or attempt == attempts - 1:
+                    raise
+                time.sleep(0.001)
+    return retry
+
+
 @pytest.fixture
 def test_address(user, db):
     """Fixture to create a test address"""
@@ -2,7 +2,8 @@ from django.contrib import admin
 
 from .models import (
     Item, OrderItem, Order, Payment, Coupon, Refund,
-    Address, UserProfile, Variation, ItemVariation
+    Address, UserProfile, Variation, ItemVariation, StockReservation,
+    PaymentJob
 )
 
 
@@ -58,6 +59,19 @@ class AddressAdmin(admin.ModelAdmin):
     search_fields = ['user', 'street_address', 'apartment_address', 'zip']
 
 
+class PaymentJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'order',
+        'status',
+        'amount_cents',
+        'attempts',
+        'created_at'
+    ]
+    list_filter = ['status']
+    search_fields = ['user__username', 'stripe_charge_id']
+
+
 class ItemVariationAdmin(admin.ModelAdmin):
     list_display = ['variation',
                     'value',
@@ -89,3 +103,5 @@ admin.site.register(Coupon)
 admin.site.register(Refund)
 admin.site.register(Address, AddressAdmin)
 admin.site.register(UserProfile)
+admin.site.register(StockReservation)
+admin.site.register(PaymentJob, PaymentJobAdmin)
@@ -0,0 +1,29 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """Cursor pagination that only kicks in when the client asks for it.
+
+    Requests without a ``cursor`` or ``page_size`` query parameter keep
+    receiving the plain list response the React client already consumes.
+    Cursor pages never issue a COUNT query, so a page costs the same
+    number of queries whatever its size or position in the table.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (self.cursor_query_param not in params
+                and self.page_size_query_param not in params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class ItemCursorPagination(OptionalCursorPagination):
+    ordering = 'id'
+
+
+class AddressCursorPagination(OptionalCursorPagination):
+    ordering = 'id'
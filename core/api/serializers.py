@@ -2,7 +2,7 @@ from django_countries.serializer_fields import CountryField
 from rest_framework import serializers
 from core.models import (
     Address, Item, Order, OrderItem, Coupon, Variation, ItemVariation,
-    Payment
+    Payment, PaymentJob
 )
 
 
@@ -22,8 +22,9 @@ class CouponSerializer(serializers.ModelSerializer):
 
 
 class ItemSerializer(serializers.ModelSerializer):
-    category = serializers.SerializerMethodField()
-    label = serializers.SerializerMethodField()
+    category = serializers.CharField(
+        source='get_category_display', read_only=True)
+    label = serializers.CharField(source='get_label_display', read_only=True)
 
     class Meta:
         model = Item
@@ -39,11 +40,17 @@ class ItemSerializer(serializers.ModelSerializer):
             'image'
         )
 
-    def get_category(self, obj):
-        return obj.get_category_display()
 
-    def get_label(self, obj):
-        return obj.get_label_display()
+def get_item_payload(serializer, obj):
+    """Serialize ``obj.item`` once per response and reuse the payload
+
+    Every order line and every chosen variation value embeds its parent
+    item; the payloads are memoized in the serializer context by item id.
+    """
+    payloads = serializer.context.setdefault('item_payloads', {})
+    if obj.item_id not in payloads:
+        payloads[obj.item_id] = ItemSerializer(obj.item).data
+    return payloads[obj.item_id]
 
 
 class VariationDetailSerializer(serializers.ModelSerializer):
@@ -58,7 +65,7 @@ class VariationDetailSerializer(serializers.ModelSerializer):
         )
 
     def get_item(self, obj):
-        return ItemSerializer(obj.item).data
+        return get_item_payload(self, obj)
 
 
 class ItemVariationDetailSerializer(serializers.ModelSerializer):
@@ -74,7 +81,7 @@ class ItemVariationDetailSerializer(serializers.ModelSerializer):
         )
 
     def get_variation(self, obj):
-        return VariationDetailSerializer(obj.variation).data
+        return VariationDetailSerializer(obj.variation, context=self.context).data
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -93,10 +100,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
         )
 
     def get_item(self, obj):
-        return ItemSerializer(obj.item).data
+        return get_item_payload(self, obj)
 
     def get_item_variations(self, obj):
-        return ItemVariationDetailSerializer(obj.item_variations.all(), many=True).data
+        return ItemVariationDetailSerializer(
+            obj.item_variations.all(), many=True, context=self.context).data
 
     def get_final_price(self, obj):
         return obj.get_final_price()
@@ -117,7 +125,8 @@ class OrderSerializer(serializers.ModelSerializer):
         )
 
     def get_order_items(self, obj):
-        return OrderItemSerializer(obj.items.all(), many=True).data
+        return OrderItemSerializer(
+            obj.items.all(), many=True, context=self.context).data
 
     def get_total(self, obj):
         return obj.get_total()
@@ -139,7 +148,8 @@ class ItemVariationSerializer(serializers.ModelSerializer):
 
 
 class VariationSerializer(serializers.ModelSerializer):
-    item_variations = serializers.SerializerMethodField()
+    item_variations = ItemVariationSerializer(
+        source='itemvariation_set', many=True, read_only=True)
 
     class Meta:
         model = Variation
@@ -149,14 +159,13 @@ class VariationSerializer(serializers.ModelSerializer):
             'item_variations'
         )
 
-    def get_item_variations(self, obj):
-        return ItemVariationSerializer(obj.itemvariation_set.all(), many=True).data
-
 
 class ItemDetailSerializer(serializers.ModelSerializer):
-    category = serializers.SerializerMethodField()
-    label = serializers.SerializerMethodField()
-    variations = serializers.SerializerMethodField()
+    category = serializers.CharField(
+        source='get_category_display', read_only=True)
+    label = serializers.CharField(source='get_label_display', read_only=True)
+    variations = VariationSerializer(
+        source='variation_set', many=True, read_only=True)
 
     class Meta:
         model = Item
@@ -173,15 +182,6 @@ class ItemDetailSerializer(serializers.ModelSerializer):
             'variations'
         )
 
-    def get_category(self, obj):
-        return obj.get_category_display()
-
-    def get_label(self, obj):
-        return obj.get_label_display()
-
-    def get_variations(self, obj):
-        return VariationSerializer(obj.variation_set.all(), many=True).data
-
 
 class AddressSerializer(serializers.ModelSerializer):
     country = CountryField()
@@ -209,3 +209,37 @@ class PaymentSerializer(serializers.ModelSerializer):
             'timestamp',
             'stripe_charge_id'
         )
+
+
+class PaymentJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentJob
+        fields = (
+            'id',
+            'status',
+            'message'
+        )
+
+
+class CartOperationSerializer(serializers.Serializer):
+    slug = serializers.SlugField()
+    variations = serializers.ListField(
+        child=serializers.IntegerField(), required=False, default=list)
+    quantity = serializers.IntegerField(default=1)
+
+    def validate_quantity(self, value):
+        if value == 0:
+            raise serializers.ValidationError("Quantity cannot be zero")
+        return value
+
+
+class CartBatchSerializer(serializers.Serializer):
+    MAX_OPERATIONS = 100
+
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        if len(value) > self.MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f"At most {self.MAX_OPERATIONS} operations per request")
+        return value
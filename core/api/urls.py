@@ -4,7 +4,9 @@ from .views import (
     ItemListView,
     ItemDetailView,
     AddToCartView,
+    CartBatchView,
     OrderDetailView,
+    CartSummaryView,
     OrderQuantityUpdateView,
     PaymentView,
     AddCouponView,
@@ -14,7 +16,8 @@ from .views import (
     AddressUpdateView,
     AddressDeleteView,
     OrderItemDeleteView,
-    PaymentListView
+    PaymentListView,
+    PaymentJobDetailView
 )
 
 urlpatterns = [
@@ -29,7 +32,9 @@ urlpatterns = [
     path('products/', ItemListView.as_view(), name='product-list'),
     path('products/<pk>/', ItemDetailView.as_view(), name='product-detail'),
     path('add-to-cart/', AddToCartView.as_view(), name='add-to-cart'),
+    path('cart/batch/', CartBatchView.as_view(), name='cart-batch'),
     path('order-summary/', OrderDetailView.as_view(), name='order-summary'),
+    path('cart-summary/', CartSummaryView.as_view(), name='cart-summary'),
     path('checkout/', PaymentView.as_view(), name='checkout'),
     path('add-coupon/', AddCouponView.as_view(), name='add-coupon'),
     path('order-items/<pk>/delete/',
@@ -37,5 +42,6 @@ urlpatterns = [
     path('order-item/update-quantity/',
          OrderQuantityUpdateView.as_view(), name='order-item-update-quantity'),
     path('payments/', PaymentListView.as_view(), name='payment-list'),
+    path('payment-jobs/<pk>/', PaymentJobDetailView.as_view(), name='payment-job-detail'),
 
 ]
@@ -1,10 +1,17 @@
+import hashlib
+from functools import lru_cache
+
 from django_countries import countries
-from django.db.models import Q
 from django.conf import settings
+from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import render, get_object_or_404
-from django.utils import timezone
+from django.utils import translation
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
 from rest_framework.generics import (
     ListAPIView, RetrieveAPIView, CreateAPIView,
     UpdateAPIView, DestroyAPIView
@@ -12,18 +19,15 @@ from rest_framework.generics import (
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
+from rest_framework.status import HTTP_200_OK, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST, HTTP_409_CONFLICT
 from core.models import Item, OrderItem, Order
+from core.gateways import PaymentError, get_gateway
+from .pagination import AddressCursorPagination, ItemCursorPagination
 from .serializers import (
     ItemSerializer, OrderSerializer, ItemDetailSerializer, AddressSerializer,
-    PaymentSerializer
+    PaymentSerializer, CartBatchSerializer, PaymentJobSerializer
 )
-from core.models import Item, OrderItem, Order, Address, Payment, Coupon, Refund, UserProfile, Variation, ItemVariation
-
-
-import stripe
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from core.models import Item, OrderItem, Order, Address, Payment, Coupon, Refund, ItemVariation, PaymentJob, IdempotencyKey
 
 
 class UserIDView(APIView):
@@ -34,39 +38,44 @@ class UserIDView(APIView):
 class ItemListView(ListAPIView):
     permission_classes = (AllowAny,)
     serializer_class = ItemSerializer
+    pagination_class = ItemCursorPagination
     queryset = Item.objects.all()
 
 
 class ItemDetailView(RetrieveAPIView):
     permission_classes = (AllowAny,)
     serializer_class = ItemDetailSerializer
-    queryset = Item.objects.all()
+    # load Item -> Variation -> ItemVariation in three queries, however
+    # many variations and values the item has
+    queryset = Item.objects.prefetch_related('variation_set__itemvariation_set')
 
 
 class OrderQuantityUpdateView(APIView):
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         slug = request.data.get('slug', None)
+        variations = request.data.get('variations', [])
         if slug is None:
             return Response({"message": "Invalid data"}, status=HTTP_400_BAD_REQUEST)
         item = get_object_or_404(Item, slug=slug)
+        try:
+            signature = OrderItem.make_variation_signature(variations)
+        except (TypeError, ValueError):
+            return Response({"message": "Invalid data"}, status=HTTP_400_BAD_REQUEST)
         order_qs = Order.objects.filter(
             user=request.user,
             ordered=False
         )
         if order_qs.exists():
             order = order_qs[0]
-            # check if the order item is in the order
-            if order.items.filter(item__slug=item.slug).exists():
-                order_item = OrderItem.objects.filter(
-                    item=item,
-                    user=request.user,
-                    ordered=False
-                )[0]
-                if order_item.quantity > 1:
-                    order_item.quantity -= 1
-                    order_item.save()
-                else:
-                    order.items.remove(order_item)
+            # the line in this order with exactly these variations
+            order_item = order.items.filter(
+                item=item, variation_signature=signature).first()
+            if order_item is not None:
+                try:
+                    order.remove_single_from_cart(order_item)
+                except ValueError as e:
+                    return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
                 return Response(status=HTTP_200_OK)
             else:
                 return Response({"message": "This item was not in your cart"}, status=HTTP_400_BAD_REQUEST)
@@ -78,8 +87,16 @@ class OrderItemDeleteView(DestroyAPIView):
     permission_classes = (IsAuthenticated, )
     queryset = OrderItem.objects.all()
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        orders = list(instance.order_set.all())
+        instance.delete()
+        for order in orders:
+            order.update_summary()
+
 
 class AddToCartView(APIView):
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         slug = request.data.get('slug', None)
         variations = request.data.get('variations', [])
@@ -88,46 +105,38 @@ class AddToCartView(APIView):
 
         item = get_object_or_404(Item, slug=slug)
 
-        minimum_variation_count = Variation.objects.filter(item=item).count()
-        if len(variations) < minimum_variation_count:
-            return Response({"message": "Please specify the required variation types"}, status=HTTP_400_BAD_REQUEST)
+        try:
+            variations = {int(v) for v in variations}
+        except (TypeError, ValueError):
+            return Response({"message": "Invalid request"}, status=HTTP_400_BAD_REQUEST)
+        error = item.get_variation_error(variations)
+        if error is not None:
+            return Response({"message": error}, status=HTTP_400_BAD_REQUEST)
 
-        order_item_qs = OrderItem.objects.filter(
-            item=item,
-            user=request.user,
-            ordered=False
-        )
-        for v in variations:
-            order_item_qs = order_item_qs.filter(
-                Q(item_variations__exact=v)
-            )
-
-        if order_item_qs.exists():
-            order_item = order_item_qs.first()
-            order_item.quantity += 1
-            order_item.save()
-        else:
-            order_item = OrderItem.objects.create(
-                item=item,
-                user=request.user,
-                ordered=False
-            )
-            order_item.item_variations.add(*variations)
-            order_item.save()
-
-        order_qs = Order.objects.filter(user=request.user, ordered=False)
-        if order_qs.exists():
-            order = order_qs[0]
-            if not order.items.filter(item__id=order_item.id).exists():
-                order.items.add(order_item)
-                return Response(status=HTTP_200_OK)
+        # merges into the cart's line with these variations, holding the
+        # stock under the same item lock as the availability check
+        order, _ = Order.objects.get_or_create_cart(request.user)
+        try:
+            order.apply_cart_operations([
+                {'slug': slug, 'variations': variations, 'quantity': 1}])
+        except ValueError as e:
+            return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        return Response(status=HTTP_200_OK)
 
-        else:
-            ordered_date = timezone.now()
-            order = Order.objects.create(
-                user=request.user, ordered_date=ordered_date)
-            order.items.add(order_item)
-            return Response(status=HTTP_200_OK)
+
+class CartBatchView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order, _ = Order.objects.get_or_create_cart(request.user)
+        try:
+            order.apply_cart_operations(serializer.validated_data['operations'])
+        except ValueError as e:
+            return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+        return Response(order.get_summary(), status=HTTP_200_OK)
 
 
 class OrderDetailView(RetrieveAPIView):
@@ -136,106 +145,119 @@ class OrderDetailView(RetrieveAPIView):
 
     def get_object(self):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = Order.objects.with_cart_graph().get(
+                user=self.request.user, ordered=False)
             return order
         except ObjectDoesNotExist:
             raise Http404("You do not have an active order")
             # return Response({"message": "You do not have an active order"}, status=HTTP_400_BAD_REQUEST)
 
 
-class PaymentView(APIView):
+class CartSummaryView(APIView):
+    permission_classes = (IsAuthenticated,)
 
-    def post(self, request, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
-        userprofile = UserProfile.objects.get(user=self.request.user)
-        token = request.data.get('stripeToken')
-        billing_address_id = request.data.get('selectedBillingAddress')
-        shipping_address_id = request.data.get('selectedShippingAddress')
+    def get(self, request, *args, **kwargs):
+        return Response(Order.objects.cart_summary(request.user), status=HTTP_200_OK)
 
-        billing_address = Address.objects.get(id=billing_address_id)
-        shipping_address = Address.objects.get(id=shipping_address_id)
 
-        if userprofile.stripe_customer_id != '' and userprofile.stripe_customer_id is not None:
-            customer = stripe.Customer.retrieve(
-                userprofile.stripe_customer_id)
+class PaymentView(APIView):
 
-        else:
-            customer = stripe.Customer.create(
-                email=self.request.user.email,
-            )
-            userprofile.stripe_customer_id = customer['id']
-            userprofile.one_click_purchasing = True
-            userprofile.save()
+    def post(self, request, *args, **kwargs):
+        """Check out, once per Idempotency-Key header when one is sent
+
+        The first request with a key runs the checkout and stores its
+        response; retries with the same key get that response back
+        without charging or writing the order again.
+        """
+        key = request.headers.get('Idempotency-Key')
+        if not key or not request.user.is_authenticated:
+            return self.checkout(request)
+        if len(key) > IdempotencyKey.MAX_LENGTH:
+            return Response({"message": "Idempotency-Key is too long"}, status=HTTP_400_BAD_REQUEST)
+
+        request_hash = IdempotencyKey.hash_request(request.data)
+        record, created = IdempotencyKey.objects.claim(request.user, key, request_hash)
+        if not created:
+            if record.request_hash != request_hash:
+                return Response({"message": "Idempotency-Key was used for a different request"},
+                                status=HTTP_400_BAD_REQUEST)
+            if record.in_progress:
+                return Response({"message": "A request with this Idempotency-Key is in progress"},
+                                status=HTTP_409_CONFLICT)
+            return Response(record.response_body, status=record.status_code)
 
-        amount = int(order.get_total() * 100)
+        try:
+            response = self.checkout(request)
+        except Exception:
+            # nothing was stored, so let the client retry with the same key
+            record.delete()
+            raise
+        record.complete(response.status_code, response.data)
+        return response
+
+    def checkout(self, request):
+        order = Order.objects.with_totals().get(
+            user=self.request.user, ordered=False)
+        token = request.data.get('stripeToken')
+        try:
+            # either address may be left out to use the user's default
+            billing_address = Address.objects.get_for_checkout(
+                self.request.user, 'B', request.data.get('selectedBillingAddress'))
+            shipping_address = Address.objects.get_for_checkout(
+                self.request.user, 'S', request.data.get('selectedShippingAddress'))
+        except (Address.DoesNotExist, ValueError):
+            return Response({"message": "Please select a billing and shipping address"},
+                            status=HTTP_400_BAD_REQUEST)
+
+        if settings.PAYMENT_QUEUE_ENABLED:
+            try:
+                job = order.enqueue_payment(
+                    stripe_token=token or '',
+                    billing_address=billing_address,
+                    shipping_address=shipping_address)
+            except ValueError as e:
+                return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
+            return Response(PaymentJobSerializer(job).data, status=HTTP_202_ACCEPTED)
+
+        # the token is charged directly, so no gateway customer is needed
+        gateway = get_gateway()
+
+        total = order.get_total_money()
+        amount = total.cents
+
+        coupon = order.coupon
+        if coupon is not None and not coupon.redeem():
+            return Response({"message": "This coupon is no longer available"}, status=HTTP_400_BAD_REQUEST)
 
         try:
 
-                # charge once off on the token (simpler approach for modern Stripe API)
-            charge = stripe.Charge.create(
-                amount=amount,  # cents
-                currency="usd",
-                source=token,
-                description=f'Charge for {self.request.user.email}'
-            )
-            # charge once off on the token
-            # charge = stripe.Charge.create(
-            #     amount=amount,  # cents
-            #     currency="usd",
-            #     source=token
-            # )
-
-            # create the payment
-            payment = Payment()
-            payment.stripe_charge_id = charge['id']
-            payment.user = self.request.user
-            payment.amount = order.get_total()
-            payment.save()
-
-            # assign the payment to the order
-
-            order_items = order.items.all()
-            order_items.update(ordered=True)
-            for item in order_items:
-                item.save()
-
-            order.ordered = True
-            order.payment = payment
-            order.billing_address = billing_address
-            order.shipping_address = shipping_address
-            # order.ref_code = create_ref_code()
-            order.save()
+            try:
+                # charge once off on the token
+                charge_id = gateway.charge(
+                    amount, source=token,
+                    description=f'Charge for {self.request.user.email}')
+            except Exception:
+                # the customer was not charged, so the coupon was not used
+                if coupon is not None:
+                    coupon.release()
+                raise
+
+            try:
+                order.finalize(
+                    charge_id, total.to_decimal(),
+                    billing_address=billing_address,
+                    shipping_address=shipping_address)
+            except ValueError as e:
+                # stock ran out after the charge: pay back and keep the cart
+                gateway.refund(charge_id)
+                if coupon is not None:
+                    coupon.release()
+                return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
 
             return Response(status=HTTP_200_OK)
 
-        except stripe.error.CardError as e:
-            body = e.json_body
-            err = body.get('error', {})
-            return Response({"message": f"{err.get('message')}"}, status=HTTP_400_BAD_REQUEST)
-
-        except stripe.error.RateLimitError as e:
-            # Too many requests made to the API too quickly
-            messages.warning(self.request, "Rate limit error")
-            return Response({"message": "Rate limit error"}, status=HTTP_400_BAD_REQUEST)
-
-        except stripe.error.InvalidRequestError as e:
-            print(e)
-            # Invalid parameters were supplied to Stripe's API
-            return Response({"message": "Invalid parameters"}, status=HTTP_400_BAD_REQUEST)
-
-        except stripe.error.AuthenticationError as e:
-            # Authentication with Stripe's API failed
-            # (maybe you changed API keys recently)
-            return Response({"message": "Not authenticated"}, status=HTTP_400_BAD_REQUEST)
-
-        except stripe.error.APIConnectionError as e:
-            # Network communication with Stripe failed
-            return Response({"message": "Network error"}, status=HTTP_400_BAD_REQUEST)
-
-        except stripe.error.StripeError as e:
-            # Display a very generic error to the user, and maybe send
-            # yourself an email
-            return Response({"message": "Something went wrong. You were not charged. Please try again."}, status=HTTP_400_BAD_REQUEST)
+        except PaymentError as e:
+            return Response({"message": str(e)}, status=HTTP_400_BAD_REQUEST)
 
         except Exception as e:
             # send an email to ourselves
@@ -251,27 +273,86 @@ class AddCouponView(APIView):
             return Response({"message": "Invalid data received"}, status=HTTP_400_BAD_REQUEST)
         order = Order.objects.get(
             user=self.request.user, ordered=False)
-        coupon = get_object_or_404(Coupon, code=code)
-        order.coupon = coupon
-        order.save()
+        try:
+            coupon = Coupon.objects.get_by_code(code)
+        except Coupon.DoesNotExist:
+            raise Http404("This coupon does not exist")
+        error = coupon.get_validation_error(order.get_subtotal())
+        if error is not None:
+            return Response({"message": error}, status=HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            order.coupon = coupon
+            order.save(update_fields=['coupon'])
+            order.update_summary()
         return Response(status=HTTP_200_OK)
 
 
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip
+
+    A coding listed with q=0 is refused; gzip not listed at all falls
+    back to the ``*`` entry.
+    """
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, *params = part.split(';')
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+    return weights.get('gzip', weights.get('*', 0.0)) > 0
+
+
+@lru_cache(maxsize=None)
+def country_list_payloads(language):
+    """The country list as (body, ETag) pairs, plain and gzipped
+
+    The list only changes with a deploy, so each process renders and
+    compresses it once per language and serves the same bytes after.
+    """
+    with translation.override(language):
+        body = JSONRenderer().render(countries)
+    payloads = {}
+    for encoding, content in (('identity', body), ('gzip', compress_string(body))):
+        etag = '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+        payloads[encoding] = (content, etag)
+    return payloads
+
+
 class CountryListView(APIView):
     def get(self, request, *args, **kwargs):
-        return Response(countries, status=HTTP_200_OK)
+        payloads = country_list_payloads(translation.get_language())
+        gzipped = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        content, etag = payloads['gzip' if gzipped else 'identity']
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=%d' % settings.COUNTRY_LIST_MAX_AGE
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
 
 
 class AddressListView(ListAPIView):
     permission_classes = (IsAuthenticated, )
     serializer_class = AddressSerializer
+    pagination_class = AddressCursorPagination
 
     def get_queryset(self):
         address_type = self.request.query_params.get('address_type', None)
-        qs = Address.objects.all()
+        qs = Address.objects.filter(user=self.request.user).order_by('id')
         if address_type is None:
             return qs
-        return qs.filter(user=self.request.user, address_type=address_type)
+        return qs.filter(address_type=address_type)
 
 
 class AddressCreateView(CreateAPIView):
@@ -297,3 +378,11 @@ class PaymentListView(ListAPIView):
 
     def get_queryset(self):
         return Payment.objects.filter(user=self.request.user)
+
+
+class PaymentJobDetailView(RetrieveAPIView):
+    permission_classes = (IsAuthenticated, )
+    serializer_class = PaymentJobSerializer
+
+    def get_queryset(self):
+        return PaymentJob.objects.filter(user=self.request.user)
@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A small thread-safe in-process cache that evicts the least recently used key
+
+    Unlike ``functools.lru_cache`` single keys can be invalidated, so
+    entries can be dropped when the row they were built from changes.
+    With ``ttl`` set, entries also expire that many seconds after being
+    set, for data whose source cannot tell us when it changes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            value, expires_at = self._data[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            try:
+                _, expires_at = self._data[key]
+            except KeyError:
+                return False
+            return expires_at is None or expires_at > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
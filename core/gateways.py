@@ -0,0 +1,185 @@
+"""Card processors behind checkout
+
+The payment views and the payment worker only talk to ``get_gateway()``,
+which builds the class named by ``settings.PAYMENT_GATEWAY`` with
+``settings.PAYMENT_GATEWAY_OPTIONS``. ``StripeGateway`` is the real one;
+``FakeGateway`` runs in-process for load tests and offline development.
+"""
+import random
+import time
+from contextlib import contextmanager
+from itertools import count
+from threading import Lock
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+import stripe
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
+
+class PaymentError(Exception):
+    """A gateway call failed; the message can be shown to the customer"""
+
+
+def stripe_error_message(error):
+    """The message shown to the customer for a failed Stripe call"""
+    if isinstance(error, stripe.error.CardError):
+        body = error.json_body or {}
+        return body.get('error', {}).get('message') or 'Your card was declined'
+    if isinstance(error, stripe.error.RateLimitError):
+        return 'Rate limit error'
+    if isinstance(error, stripe.error.InvalidRequestError):
+        return 'Invalid parameters'
+    if isinstance(error, stripe.error.AuthenticationError):
+        return 'Not authenticated'
+    if isinstance(error, stripe.error.APIConnectionError):
+        return 'Network error'
+    return 'Something went wrong. You were not charged. Please try again.'
+
+
+@contextmanager
+def stripe_errors():
+    try:
+        yield
+    except stripe.error.StripeError as e:
+        raise PaymentError(stripe_error_message(e)) from e
+
+
+class StripeGateway:
+    """Charges cards through the Stripe API"""
+
+    def create_customer(self, email):
+        with stripe_errors():
+            return stripe.Customer.create(email=email)['id']
+
+    def retrieve_customer(self, customer_id):
+        with stripe_errors():
+            return stripe.Customer.retrieve(customer_id)
+
+    def save_card(self, customer_id, token):
+        with stripe_errors():
+            stripe.Customer.create_source(customer_id, source=token)
+
+    def list_cards(self, customer_id, limit=3):
+        with stripe_errors():
+            return stripe.Customer.list_sources(
+                customer_id, limit=limit, object='card')['data']
+
+    def charge(self, amount_cents, source=None, customer=None, description=None,
+               idempotency_key=None):
+        """Charge ``amount_cents`` to a token or a saved customer; returns the charge id
+
+        Calls repeated with the same ``idempotency_key`` return the first
+        charge instead of making another.
+        """
+        params = {'amount': amount_cents, 'currency': 'usd'}
+        if customer:
+            params['customer'] = customer
+        else:
+            params['source'] = source
+        if description:
+            params['description'] = description
+        if idempotency_key:
+            params['idempotency_key'] = idempotency_key
+        with stripe_errors():
+            return stripe.Charge.create(**params)['id']
+
+    def refund(self, charge_id):
+        with stripe_errors():
+            stripe.Refund.create(charge=charge_id)
+
+
+class FakeGateway:
+    """An in-process gateway with tunable latency and failure rate
+
+    Every call sleeps ``latency`` seconds, and each charge is declined
+    with probability ``failure_rate``, as is any charge on Stripe's
+    ``tok_chargeDeclined`` test token. Charges, refunds and customers
+    are kept in memory so tests can inspect them.
+    """
+    DECLINED_TOKEN = 'tok_chargeDeclined'
+
+    def __init__(self, latency=0, failure_rate=0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.charges = {}
+        self.refunds = []
+        self.customers = {}
+        self.idempotent_charges = {}
+        self._random = random.Random(seed)
+        self._ids = count(1)
+        self._lock = Lock()
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            return next(self._ids)
+
+    def create_customer(self, email):
+        customer = {'id': f'cus_fake_{self._call()}', 'email': email, 'cards': []}
+        self.customers[customer['id']] = customer
+        return customer['id']
+
+    def retrieve_customer(self, customer_id):
+        self._call()
+        try:
+            return self.customers[customer_id]
+        except KeyError:
+            raise PaymentError('Invalid parameters')
+
+    def save_card(self, customer_id, token):
+        self.retrieve_customer(customer_id)['cards'].append({
+            'id': f'card_fake_{self._call()}', 'brand': 'Visa', 'last4': '4242',
+            'exp_month': 12, 'exp_year': 2030, 'token': token})
+
+    def list_cards(self, customer_id, limit=3):
+        return self.retrieve_customer(customer_id)['cards'][:limit]
+
+    def charge(self, amount_cents, source=None, customer=None, description=None,
+               idempotency_key=None):
+        if idempotency_key in self.idempotent_charges:
+            return self.idempotent_charges[idempotency_key]
+        charge_id = f'ch_fake_{self._call()}'
+        with self._lock:
+            declined = self._random.random() < self.failure_rate
+        if declined or source == self.DECLINED_TOKEN:
+            raise PaymentError('Your card was declined')
+        if customer is not None:
+            self.retrieve_customer(customer)
+        self.charges[charge_id] = {
+            'amount': amount_cents, 'source': source, 'customer': customer,
+            'description': description}
+        if idempotency_key:
+            self.idempotent_charges[idempotency_key] = charge_id
+        return charge_id
+
+    def refund(self, charge_id):
+        self._call()
+        if charge_id not in self.charges:
+            raise PaymentError('Invalid parameters')
+        self.refunds.append(charge_id)
+
+
+_gateway = None
+
+
+def get_gateway():
+    """The configured gateway, built once per process"""
+    global _gateway
+    if _gateway is None:
+        _gateway = import_string(settings.PAYMENT_GATEWAY)(
+            **settings.PAYMENT_GATEWAY_OPTIONS)
+    return _gateway
+
+
+def reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting in ('PAYMENT_GATEWAY', 'PAYMENT_GATEWAY_OPTIONS'):
+        _gateway = None
+
+
+setting_changed.connect(reset_gateway)
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored checkout responses older than the retry window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help='Keep records created in the last N hours')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Records deleted per statement')
+
+    def handle(self, *args, **kwargs):
+        cutoff = timezone.now() - timedelta(hours=kwargs['hours'])
+        deleted = IdempotencyKey.objects.delete_older_than(
+            cutoff, batch_size=kwargs['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted %d idempotency keys' % deleted))
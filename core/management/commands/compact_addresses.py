@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Address
+
+
+class Command(BaseCommand):
+    help = 'Merges duplicate addresses into one row per user and content'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Duplicates merged per transaction')
+
+    def handle(self, *args, **kwargs):
+        merged = Address.objects.compact(batch_size=kwargs['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Merged %d duplicate addresses' % merged))
@@ -0,0 +1,83 @@
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.models import Coupon
+
+
+def parse_expiry(value):
+    """Accept an ISO date (valid through that day) or datetime"""
+    expiry = parse_datetime(value)
+    if expiry is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError('Invalid --expiry-date %r, use YYYY-MM-DD' % value)
+        expiry = datetime.combine(day, datetime.max.time())
+    if timezone.is_naive(expiry):
+        expiry = timezone.make_aware(expiry)
+    return expiry
+
+
+def parse_amount(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise CommandError('Invalid amount %r' % value)
+
+
+class Command(BaseCommand):
+    help = 'Generates a batch of coupons with random unique codes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Number of coupons to create')
+        parser.add_argument('--discount-type', choices=[c for c, _ in Coupon.DISCOUNT_TYPE_CHOICES],
+                            default='fixed')
+        parser.add_argument('--discount-value', type=parse_amount, required=True)
+        parser.add_argument('--minimum-order-amount', type=parse_amount, default=Decimal('0'))
+        parser.add_argument('--expiry-date', type=parse_expiry, default=None,
+                            help='YYYY-MM-DD or ISO datetime')
+        parser.add_argument('--max-uses', type=int, default=None,
+                            help='Uses allowed per code (default unlimited)')
+        parser.add_argument('--prefix', default='', help='Prefix for every code')
+        parser.add_argument('--length', type=int, default=10,
+                            help='Random characters per code')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Coupons inserted per statement')
+        parser.add_argument('--output', default=None,
+                            help='Write the generated codes to this file, one per line')
+
+    def handle(self, *args, **kwargs):
+        count = kwargs['count']
+        if count < 1:
+            raise CommandError('count must be positive')
+
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                codes = Coupon.objects.generate(
+                    count,
+                    prefix=kwargs['prefix'],
+                    length=kwargs['length'],
+                    batch_size=kwargs['batch_size'],
+                    discount_type=kwargs['discount_type'],
+                    discount_value=kwargs['discount_value'],
+                    minimum_order_amount=kwargs['minimum_order_amount'],
+                    expiry_date=kwargs['expiry_date'],
+                    max_uses=kwargs['max_uses'],
+                )
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as file:
+                file.write('\n'.join(codes) + '\n')
+
+        self.stdout.write(self.style.SUCCESS(
+            'Generated %d coupons in %.2fs (%d codes/sec)'
+            % (len(codes), elapsed, len(codes) / elapsed if elapsed else len(codes))))
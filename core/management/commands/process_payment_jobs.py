@@ -0,0 +1,44 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from core.models import PaymentJob
+from core.payments import process_job
+
+
+class Command(BaseCommand):
+    help = 'Charges queued checkouts and places their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Poll for new jobs every N seconds (0 drains the queue once)')
+        parser.add_argument('--limit', type=int, default=0,
+                            help='Stop after this many jobs (0 for no limit)')
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs['interval']
+        limit = kwargs['limit']
+        counts = Counter()
+
+        while not limit or sum(counts.values()) < limit:
+            job = PaymentJob.objects.claim_next()
+            if job is None:
+                if not interval:
+                    break
+                time.sleep(interval)
+                continue
+            try:
+                process_job(job)
+            except Exception as e:
+                # process_job settles the job and its charge before raising
+                self.stderr.write('Payment job %d failed: %r' % (job.pk, e))
+            if job.status == PaymentJob.RECONCILE:
+                self.stderr.write('Payment job %d needs reconciliation: charge %s' % (
+                    job.pk, job.stripe_charge_id))
+            counts[job.status] += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            'Processed %d payment jobs (%d succeeded, %d failed, %d to reconcile)' % (
+                sum(counts.values()), counts[PaymentJob.SUCCEEDED],
+                counts[PaymentJob.FAILED], counts[PaymentJob.RECONCILE])))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized cart summary columns on orders and fixes drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Check placed orders too, not only open carts')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Orders read and updated per statement')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without writing the fixes')
+
+    def handle(self, *args, **kwargs):
+        orders = Order.objects.all()
+        if not kwargs['all']:
+            orders = orders.filter(ordered=False)
+
+        started = time.perf_counter()
+        checked, drifted = orders.reconcile_summaries(
+            batch_size=kwargs['batch_size'], dry_run=kwargs['dry_run'])
+        elapsed = time.perf_counter() - started
+
+        action = 'found' if kwargs['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            'Checked %d orders in %.2fs, %s %d with drifted summaries'
+            % (checked, elapsed, action, drifted)))
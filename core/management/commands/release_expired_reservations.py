@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Releases stock held by expired cart reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Reservations deleted per statement')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep sweeping every N seconds (0 sweeps once)')
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs['batch_size']
+        interval = kwargs['interval']
+
+        while True:
+            released = StockReservation.objects.release_expired(batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                'Released %d expired reservations' % released))
+            if not interval:
+                return
+            time.sleep(interval)
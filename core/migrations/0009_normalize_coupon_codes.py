@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:42
+
+from django.db import migrations
+
+
+def normalize_coupon_codes(apps, schema_editor):
+    """Upper-case every code and fold duplicates into the oldest coupon
+
+    Duplicate codes could never be looked up (``get`` raised), so orders
+    pointing at a duplicate are moved to the surviving coupon, which also
+    takes over its uses, before the duplicate is deleted.
+    """
+    Coupon = apps.get_model('core', 'Coupon')
+    Order = apps.get_model('core', 'Order')
+    kept = {}
+    for coupon in Coupon.objects.order_by('pk').iterator():
+        code = (coupon.code or '').strip().upper()
+        survivor = kept.get(code)
+        if survivor is None:
+            kept[code] = coupon
+            if coupon.code != code:
+                coupon.code = code
+                coupon.save(update_fields=['code'])
+            continue
+        Order.objects.filter(coupon=coupon).update(coupon=survivor)
+        survivor.current_uses += coupon.current_uses
+        survivor.save(update_fields=['current_uses'])
+        coupon.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_stockreservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_coupon_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:47
+
+from django.db import migrations
+
+
+def merge_open_orders(apps, schema_editor):
+    """Fold every user's extra open orders into their oldest one
+
+    The cart views always picked the first open order, so its lines are
+    kept and the lines of later open orders are moved onto it before
+    those orders are deleted.
+    """
+    Order = apps.get_model('core', 'Order')
+    open_orders = Order.objects.filter(ordered=False).order_by('user_id', 'pk')
+    cart = None
+    for order in open_orders.iterator():
+        if cart is None or cart.user_id != order.user_id:
+            cart = order
+            continue
+        cart.items.add(*order.items.all())
+        if cart.coupon_id is None and order.coupon_id is not None:
+            cart.coupon_id = order.coupon_id
+            cart.save(update_fields=['coupon'])
+        order.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_coupon_code_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_open_orders, migrations.RunPython.noop),
+    ]
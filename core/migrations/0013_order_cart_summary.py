@@ -0,0 +1,79 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:53
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount or 0)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def discount_cents(coupon, subtotal_cents):
+    """Same as core.models.coupon_discount, in cents"""
+    if coupon is None:
+        return 0
+    if coupon.discount_type == 'percentage':
+        discount = int((subtotal_cents * Decimal(str(coupon.discount_value)) / 100).quantize(
+            Decimal('1'), rounding=ROUND_HALF_UP))
+    else:
+        discount = to_cents(coupon.discount_value)
+    return min(discount, subtotal_cents)
+
+
+def backfill_summaries(apps, schema_editor):
+    """Fill the new columns of existing orders, as Order.compute_summary does
+
+    Orders are read in primary key batches annotated with their line
+    count and subtotal, and written back with one bulk UPDATE per batch.
+    A zero discount price counts as no discount.
+    """
+    Order = apps.get_model('core', 'Order')
+    money_field = models.DecimalField(max_digits=12, decimal_places=2)
+    unit_price = Coalesce(
+        NullIf(F('items__item__discount_price'), Value(0), output_field=money_field),
+        F('items__item__price')
+    )
+    line_total = ExpressionWrapper(unit_price * F('items__quantity'), output_field=money_field)
+    fields = ['item_count', 'subtotal_cents', 'discount_cents']
+    last_pk = 0
+    while True:
+        batch = list(
+            Order.objects.filter(pk__gt=last_pk).order_by('pk').select_related('coupon')
+            .annotate(line_count=Count('items'), subtotal=Sum(line_total))[:1000])
+        if not batch:
+            return
+        for order in batch:
+            order.item_count = order.line_count
+            order.subtotal_cents = to_cents(order.subtotal)
+            order.discount_cents = discount_cents(order.coupon, order.subtotal_cents)
+        Order.objects.bulk_update(batch, fields)
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_cart_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.25 on 2026-10-17 07:55
+
+import hashlib
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def backfill_variation_signatures(apps, schema_editor):
+    """Store the signature of every line that has variations
+
+    Same hash as OrderItem.make_variation_signature: SHA-256 of the
+    comma-joined sorted ItemVariation ids. Lines without variations keep
+    the '' default.
+    """
+    OrderItem = apps.get_model('core', 'OrderItem')
+    Through = OrderItem.item_variations.through
+    rows = Through.objects.order_by('orderitem_id', 'itemvariation_id').values_list(
+        'orderitem_id', 'itemvariation_id')
+    batch = []
+    for order_item_id, group in groupby(rows.iterator(), key=lambda row: row[0]):
+        variation_ids = ','.join(str(variation_id) for _, variation_id in group)
+        batch.append(OrderItem(
+            pk=order_item_id,
+            variation_signature=hashlib.sha256(variation_ids.encode()).hexdigest()))
+        if len(batch) >= 1000:
+            OrderItem.objects.bulk_update(batch, ['variation_signature'])
+            batch = []
+    if batch:
+        OrderItem.objects.bulk_update(batch, ['variation_signature'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_order_cart_summary'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='orderitem',
+            name='orderitem_user_open_item_idx',
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='variation_signature',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(backfill_variation_signatures, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['user', 'item', 'variation_signature', 'ordered'], name='orderitem_user_open_line_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-17 08:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0016_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='address',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'address_type', 'default'], name='address_user_type_default_idx'),
+        ),
+    ]
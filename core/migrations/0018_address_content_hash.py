@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-17 08:26
+
+import hashlib
+
+from django.db import migrations, models
+
+CONTENT_FIELDS = ('street_address', 'apartment_address', 'country', 'zip')
+
+
+def backfill_content_hashes(apps, schema_editor):
+    """Same hash as Address.make_content_hash"""
+    Address = apps.get_model('core', 'Address')
+    batch = []
+    for address in Address.objects.only('address_type', *CONTENT_FIELDS).iterator():
+        parts = [address.address_type] + [str(getattr(address, name) or '') for name in CONTENT_FIELDS]
+        normalized = '\x1f'.join(' '.join(part.split()).casefold() for part in parts)
+        address.content_hash = hashlib.sha256(normalized.encode()).hexdigest()
+        batch.append(address)
+        if len(batch) >= 1000:
+            Address.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        Address.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_address_user_type_default_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'content_hash'], name='address_user_content_idx'),
+        ),
+    ]
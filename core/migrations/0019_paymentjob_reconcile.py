@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_address_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('reconcile', 'Needs reconciliation')], default='pending', max_length=10),
+        ),
+    ]
@@ -1,10 +1,22 @@
-from django.db.models.signals import post_save
+import hashlib
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models.signals import post_delete, post_save
 from django.conf import settings
-from django.db import models
-from django.db.models import Sum
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Case, Count, Exists, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce, NullIf
 from django.shortcuts import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django_countries.fields import CountryField
 
+from .cache import LRUCache
+from .money import Money
+
 
 CATEGORY_CHOICES = (
     ('S', 'Shirt'),
@@ -23,6 +35,48 @@ ADDRESS_CHOICES = (
     ('S', 'Shipping'),
 )
 
+def final_price_expression(prefix=''):
+    """Database counterpart of OrderItem.get_final_price
+
+    ``prefix`` is the lookup path from the queried model to OrderItem,
+    e.g. ``'items__'`` from Order. A zero discount price counts as no
+    discount, like the truthiness test in Python.
+    """
+    money_field = models.DecimalField(max_digits=12, decimal_places=2)
+    unit_price = Coalesce(
+        NullIf(F(prefix + 'item__discount_price'), Value(0),
+               output_field=money_field),
+        F(prefix + 'item__price')
+    )
+    return ExpressionWrapper(
+        unit_price * F(prefix + 'quantity'), output_field=money_field)
+
+
+def coupon_discount(coupon, order_total):
+    """The Money ``coupon`` takes off ``order_total``, at most the total"""
+    order_total = Money.from_amount(order_total)
+    if coupon is None:
+        return Money()
+    if hasattr(coupon, 'discount_type'):
+        if coupon.discount_type == 'percentage':
+            discount = order_total.percentage(coupon.discount_value)
+        else:  # fixed
+            discount = Money.from_amount(coupon.discount_value)
+    else:
+        # Fallback to old amount field
+        discount = Money.from_amount(coupon.amount)
+    return min(discount, order_total)
+
+
+def summarize_cart(item_count, subtotal, coupon):
+    """Order summary column values for ``item_count`` lines worth ``subtotal``"""
+    subtotal = Money.from_amount(subtotal)
+    return {
+        'item_count': item_count,
+        'subtotal_cents': subtotal.cents,
+        'discount_cents': coupon_discount(coupon, subtotal).cents,
+    }
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(
@@ -36,8 +90,9 @@ class UserProfile(models.Model):
 
 class Item(models.Model):
     title = models.CharField(max_length=100)
-    price = models.FloatField()
-    discount_price = models.FloatField(blank=True, null=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True)
     category = models.CharField(choices=CATEGORY_CHOICES, max_length=2)
     label = models.CharField(choices=LABEL_CHOICES, max_length=1)
     slug = models.SlugField()
@@ -79,23 +134,66 @@ class Item(models.Model):
         TDD: test_can_fulfill_quantity_method
         """
         return self.stock_quantity >= quantity
+
+    def get_available_quantity(self):
+        """Stock not held by an unexpired cart reservation"""
+        reserved = StockReservation.objects.active().filter(
+            item=self).aggregate(total=Sum('quantity'))['total']
+        return self.stock_quantity - (reserved or 0)
+
+    @staticmethod
+    def get_variation_options(item_ids):
+        """The variations of each item and their values, in one query
+
+        Returns ``{item_id: {variation_id: {item_variation_id, ...}}}``.
+        """
+        options = {item_id: {} for item_id in item_ids}
+        rows = Variation.objects.filter(item__in=item_ids).values_list(
+            'item_id', 'pk', 'itemvariation__pk')
+        for item_id, variation_id, value_id in rows:
+            values = options[item_id].setdefault(variation_id, set())
+            if value_id is not None:
+                values.add(value_id)
+        return options
+
+    def get_variation_error(self, variation_ids, options=None):
+        """Why ``variation_ids`` is not one value for each variation, or None
+
+        ``options`` are this item's entry from get_variation_options();
+        they are loaded with one query when not given.
+        """
+        if options is None:
+            options = Item.get_variation_options([self.pk])[self.pk]
+        variation_ids = set(variation_ids)
+        picked = [len(values & variation_ids) for values in options.values()]
+        if 0 in picked:
+            return "Please specify the required variation types"
+        if sum(picked) != len(variation_ids) or any(count > 1 for count in picked):
+            return "Invalid variations for this item"
+        return None
     
     def reduce_stock(self, quantity):
         """Reduce stock by quantity
         TDD: test_reduce_stock_method, test_cannot_reduce_stock_below_zero
         Raises ValueError if insufficient stock
+
+        A single conditional UPDATE (stock = stock - n WHERE stock >= n),
+        so concurrent checkouts can never take the same units twice.
         """
-        if quantity > self.stock_quantity:
+        updated = Item.objects.filter(
+            pk=self.pk, stock_quantity__gte=quantity
+        ).update(stock_quantity=F('stock_quantity') - quantity)
+        if not updated:
             raise ValueError("Insufficient stock available")
-        self.stock_quantity -= quantity
-        self.save()
+        self.refresh_from_db(fields=['stock_quantity'])
     
     def increase_stock(self, quantity):
         """Increase stock by quantity (restocking)
         TDD: test_increase_stock_restocking
         """
-        self.stock_quantity += quantity
-        self.save()
+        Item.objects.filter(pk=self.pk).update(
+            stock_quantity=F('stock_quantity') + quantity)
+        self.refresh_from_db(fields=['stock_quantity'])
     
     def get_stock_status(self):
         """Get stock status category
@@ -138,15 +236,38 @@ class ItemVariation(models.Model):
 
 class OrderItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     ordered = models.BooleanField(default=False)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     item_variations = models.ManyToManyField(ItemVariation)
+    # canonical hash of the chosen item_variations, see set_variations()
+    variation_signature = models.CharField(max_length=64, blank=True, default='')
     quantity = models.IntegerField(default=1)
 
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
 
+    @staticmethod
+    def make_variation_signature(variation_ids):
+        """SHA-256 of the sorted ItemVariation ids, '' when there are none
+
+        Lines of the same item with the same choices share a signature,
+        so finding the line to merge into is one equality lookup
+        whatever the number of variation dimensions.
+        """
+        variation_ids = sorted({int(pk) for pk in variation_ids})
+        if not variation_ids:
+            return ''
+        return hashlib.sha256(
+            ','.join(map(str, variation_ids)).encode()).hexdigest()
+
+    def set_variations(self, variation_ids):
+        """Replace the chosen variations and store their signature"""
+        self.item_variations.set(variation_ids)
+        self.variation_signature = self.make_variation_signature(variation_ids)
+        OrderItem.objects.filter(pk=self.pk).update(
+            variation_signature=self.variation_signature)
+
     def get_total_item_price(self):
         return self.quantity * self.item.price
 
@@ -161,10 +282,213 @@ class OrderItem(models.Model):
             return self.get_total_discount_item_price()
         return self.get_total_item_price()
 
+    def get_line_total(self):
+        """Final price of the line as Money, in integer cents"""
+        unit_price = self.item.discount_price or self.item.price
+        return Money.from_amount(unit_price) * self.quantity
+
+    class Meta:
+        indexes = [
+            # the open cart lines of a user, optionally for one item and
+            # one set of variations; it leads with user, so the user
+            # foreign key has no index of its own. ordered comes last as
+            # Django filters it as NOT "ordered", which SQLite cannot seek
+            # on; it is still checked from the index without the table.
+            models.Index(fields=['user', 'item', 'variation_signature', 'ordered'],
+                         name='orderitem_user_open_line_idx'),
+        ]
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def active(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+    def hold(self, order_item):
+        """Hold stock for the whole quantity of a cart line
+
+        Creates the line's reservation or resizes it, and pushes its
+        expiry STOCK_RESERVATION_TTL seconds into the future.
+        """
+        expires_at = timezone.now() + timedelta(
+            seconds=settings.STOCK_RESERVATION_TTL)
+        reservation, _ = self.update_or_create(
+            order_item=order_item,
+            defaults={
+                'item_id': order_item.item_id,
+                'quantity': order_item.quantity,
+                'expires_at': expires_at
+            }
+        )
+        return reservation
+
+    def hold_many(self, order_items):
+        """hold() for many lines: one DELETE and one bulk INSERT"""
+        expires_at = timezone.now() + timedelta(
+            seconds=settings.STOCK_RESERVATION_TTL)
+        self.filter(order_item__in=[line.pk for line in order_items]).delete()
+        self.bulk_create([
+            StockReservation(order_item=line, item_id=line.item_id,
+                             quantity=line.quantity, expires_at=expires_at)
+            for line in order_items
+        ])
+
+    def release_expired(self, batch_size=1000, now=None):
+        """Delete expired reservations ``batch_size`` rows at a time
+
+        Each batch is a short indexed range scan and one DELETE, so the
+        sweeper never holds long locks on a large table. Returns the
+        number of reservations released.
+        """
+        now = now or timezone.now()
+        released = 0
+        while True:
+            batch = list(self.expired(now).order_by(
+                'expires_at').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return released
+            released += len(batch)
+            self.filter(pk__in=batch).delete()
+
+
+class StockReservation(models.Model):
+    """Units of an item held for a cart line until ``expires_at``"""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    order_item = models.OneToOneField(
+        OrderItem, on_delete=models.CASCADE, related_name='reservation')
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # covers "sum of active holds for an item" without the table
+            models.Index(fields=['item', 'expires_at', 'quantity'],
+                         name='reservation_item_active_idx'),
+            models.Index(fields=['expires_at'],
+                         name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of {self.item_id} until {self.expires_at}"
+
+
+# Bumped by every Order.update_summary() in this process; cart summaries
+# memoized under an older version are stale
+cart_summary_version = 0
+
+
+def forget_cart_summaries():
+    """Make every memoized cart summary in this process stale"""
+    global cart_summary_version
+    cart_summary_version += 1
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate each order with its ``subtotal``, summed by the database
+
+        Order.get_subtotal and Order.get_total use the annotation instead
+        of querying the order items again.
+        """
+        return self.annotate(subtotal=Coalesce(
+            Sum(final_price_expression('items__')), Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)))
+
+    def open_cart(self, user):
+        """The user's open order (their cart), or None"""
+        return self.filter(user=user, ordered=False).first()
+
+    def get_or_create_cart(self, user):
+        """The user's open order, created if they have none
+
+        At most one open order per user is enforced by a partial unique
+        constraint, so two requests racing to create the cart end up
+        sharing the one that won. Returns ``(order, created)``.
+        """
+        return self.get_or_create(
+            user=user, ordered=False, defaults={'ordered_date': timezone.now()})
+
+    def cart_summary(self, user):
+        """Line count, subtotal and total of the user's open order
+
+        One single-row query for the order's summary columns, found
+        through the open order index. The result is memoized on
+        ``user``; Django builds request.user afresh for every request, so
+        all the page header, template and API uses within one request
+        share a single query. Any update_summary() in this process makes
+        the memo stale, so a cart changed earlier in the same request, or
+        through a user instance that outlives a request, is read again.
+        """
+        version = cart_summary_version
+        memo = getattr(user, '_cart_summary', None)
+        if memo is not None and memo[0] == version:
+            return memo[1]
+        summary = {'item_count': 0, 'subtotal': Decimal('0.00'), 'total': Decimal('0.00')}
+        if user.is_authenticated:
+            order = self.filter(user=user, ordered=False).only(
+                'item_count', 'subtotal_cents', 'discount_cents').first()
+            if order is not None:
+                summary = order.get_summary()
+        user._cart_summary = (version, summary)
+        return summary
+
+    def reconcile_summaries(self, batch_size=1000, dry_run=False):
+        """Recompute the summary columns of these orders and fix any drift
+
+        Orders are read in primary key batches, each annotated with its
+        line count and subtotal in one query, and drifted rows are written
+        back with one bulk UPDATE per batch. Returns ``(checked, drifted)``.
+        """
+        fields = ['item_count', 'subtotal_cents', 'discount_cents']
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                self.filter(pk__gt=last_pk).order_by('pk').with_totals()
+                .annotate(line_count=Count('items')).select_related('coupon')[:batch_size])
+            if not batch:
+                return checked, drifted
+            stale = []
+            for order in batch:
+                summary = order.compute_summary(order.line_count, order.subtotal)
+                if any(getattr(order, field) != summary[field] for field in fields):
+                    for field, value in summary.items():
+                        setattr(order, field, value)
+                    stale.append(order)
+            if stale and not dry_run:
+                self.model.objects.bulk_update(stale, fields)
+            checked += len(batch)
+            drifted += len(stale)
+            last_pk = batch[-1].pk
+
+    def with_cart_graph(self):
+        """Load coupon, order items, items and chosen variations up front
+
+        Three queries whatever the number of lines: the orders (with their
+        coupon), the order items (with their item) and the item variations
+        (with their variation and its item).
+        """
+        return self.select_related('coupon').prefetch_related(
+            models.Prefetch(
+                'items',
+                queryset=OrderItem.objects.select_related('item').prefetch_related(
+                    models.Prefetch(
+                        'item_variations',
+                        queryset=ItemVariation.objects.select_related(
+                            'variation__item')
+                    )
+                )
+            )
+        )
+
 
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     ref_code = models.CharField(max_length=20, blank=True, null=True)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
@@ -182,6 +506,23 @@ class Order(models.Model):
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
+    # cart summary, kept in step with the lines by update_summary()
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal_cents = models.BigIntegerField(default=0)
+    discount_cents = models.BigIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # also serves every per-user lookup in place of a user FK index
+            models.Index(fields=['user', 'ordered'], name='order_user_ordered_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'], condition=Q(ordered=False),
+                name='order_one_open_per_user'),
+        ]
 
     '''
     1. Item added to cart
@@ -205,35 +546,64 @@ class Order(models.Model):
     def get_subtotal(self):
         """Get order subtotal before discounts
         TDD: test_order_total_with_percentage_coupon, test_order_total_with_fixed_coupon
+
+        Uses the with_totals() annotation or prefetched items when present,
+        otherwise sums the lines in a single aggregate query.
         """
-        from decimal import Decimal
-        total = Decimal('0')
-        for order_item in self.items.all():
-            total += Decimal(str(order_item.get_final_price()))
-        return total
+        return self.get_subtotal_money().to_decimal()
+
+    def get_subtotal_money(self):
+        if hasattr(self, 'subtotal'):
+            return Money.from_amount(self.subtotal)
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum(
+                (order_item.get_line_total() for order_item in self.items.all()),
+                Money())
+        return Money.from_amount(self.items.aggregate(
+            subtotal=Sum(final_price_expression()))['subtotal'])
 
     def get_total(self):
         """Get order total with coupon discount applied
         TDD: test_order_total_with_percentage_coupon, test_coupon_cannot_exceed_order_total
         """
-        from decimal import Decimal
-        total = self.get_subtotal()
-        
-        if self.coupon:
-            # Use new coupon system if available
-            if hasattr(self.coupon, 'discount_type'):
-                discount = self.coupon.calculate_discount(total)
-                total -= discount
-            else:
-                # Fallback to old amount field
-                total -= Decimal(str(self.coupon.amount))
-        
-        # Ensure total is not negative
-        if total < Decimal('0'):
-            total = Decimal('0')
-        
-        return total
+        return self.get_total_money().to_decimal()
+
+    def get_total_money(self):
+        return self.apply_coupon(self.get_subtotal_money())
+
+    def apply_coupon(self, subtotal):
+        """``subtotal`` as Money with the coupon discount taken off"""
+        subtotal = Money.from_amount(subtotal)
+        return subtotal - coupon_discount(self.coupon, subtotal)
     
+    def get_summary(self):
+        """Line count, subtotal and total read from the summary columns"""
+        return {
+            'item_count': self.item_count,
+            'subtotal': Money(self.subtotal_cents).to_decimal(),
+            'total': Money(self.subtotal_cents - self.discount_cents).to_decimal(),
+        }
+
+    def compute_summary(self, item_count, subtotal):
+        """Summary column values for ``item_count`` lines worth ``subtotal``"""
+        return summarize_cart(item_count, subtotal, self.coupon)
+
+    def update_summary(self):
+        """Recompute the summary columns from the order's lines
+
+        One aggregate over the lines and one UPDATE of the three summary
+        columns. Called by every path that changes the lines or the
+        coupon, inside the same transaction as the change. Cart summaries
+        memoized by Order.objects.cart_summary are made stale.
+        """
+        totals = self.items.aggregate(
+            item_count=Count('pk'), subtotal=Sum(final_price_expression()))
+        summary = self.compute_summary(totals['item_count'], totals['subtotal'])
+        Order.objects.filter(pk=self.pk).update(**summary)
+        for field, value in summary.items():
+            setattr(self, field, value)
+        forget_cart_summaries()
+
     # =============================================================================
     # TDD GREEN CYCLE - Feature 3: Smart Cart Item Merging
     # Tests: test_tdd_feature3_cart.py & test_tdd_feature3_refactor.py
@@ -242,28 +612,181 @@ class Order(models.Model):
     def add_to_cart(self, item, quantity=1):
         """Add item to cart or update quantity if exists
         TDD: test_adding_same_item_increases_quantity, test_cart_prevents_negative_quantities
+
+        The added units are held by the line's StockReservation, so other
+        carts cannot claim them until the hold expires.
         """
         if quantity <= 0:
             raise ValueError("Quantity must be positive")
         
-        if not item.can_fulfill(quantity):
-            raise ValueError(f"Insufficient stock available. Only {item.stock_quantity} in stock.")
-        
-        # Check if item already in cart
-        order_item_qs = self.items.filter(item=item, ordered=False)
-        if order_item_qs.exists():
-            order_item = order_item_qs.first()
-            order_item.quantity += quantity
-            order_item.save()
-        else:
-            order_item = OrderItem.objects.create(
-                user=self.user,
-                item=item,
-                quantity=quantity,
-                ordered=False
-            )
-            self.items.add(order_item)
+        with transaction.atomic():
+            # lock the item row so two carts cannot hold the same units
+            locked_item = Item.objects.select_for_update().get(pk=item.pk)
+            
+            # Check if item already in cart, without variations
+            order_item = self.items.filter(
+                item=item, ordered=False, variation_signature='').first()
+            current = order_item.quantity if order_item is not None else 0
+            self._check_line_stock(locked_item, order_item, current + quantity)
+            if order_item is not None:
+                order_item.quantity += quantity
+                order_item.save()
+            else:
+                order_item = OrderItem.objects.create(
+                    user=self.user,
+                    item=item,
+                    quantity=quantity,
+                    ordered=False
+                )
+                self.items.add(order_item)
+            StockReservation.objects.hold(order_item)
+            self.update_summary()
     
+    def remove_single_from_cart(self, order_item):
+        """Take one unit off a line of this cart
+
+        The line is held again for its smaller quantity, or deleted, and
+        its hold with it, when it reaches zero.
+        """
+        with transaction.atomic():
+            if order_item.quantity > 1:
+                locked_item = Item.objects.select_for_update().get(pk=order_item.item_id)
+                self._check_line_stock(locked_item, order_item, order_item.quantity - 1)
+                order_item.quantity -= 1
+                order_item.save()
+                StockReservation.objects.hold(order_item)
+            else:
+                order_item.delete()
+            self.update_summary()
+
+    @staticmethod
+    def _check_line_stock(locked_item, order_item, quantity):
+        """Raise ValueError unless the line can be held for ``quantity``
+
+        The line's own active hold already covers part of it; the rest
+        must fit in the stock no active hold claims.
+        """
+        available = locked_item.get_available_quantity()
+        held = 0
+        if order_item is not None:
+            held = StockReservation.objects.active().filter(
+                order_item=order_item).values_list('quantity', flat=True).first() or 0
+        if quantity - held > available:
+            raise ValueError(f"Insufficient stock available. Only {available} in stock.")
+
+    def apply_cart_operations(self, operations):
+        """Apply many cart changes at once, in one transaction
+
+        ``operations`` are dicts with a ``slug``, optional ``variations``
+        (ItemVariation ids) and a ``quantity`` to add, or to take off when
+        negative; a line that drops to zero is removed. Operations on the
+        same line are combined first. Lines of this order are matched by
+        variation signature and written with bulk INSERT / UPDATE / DELETE,
+        the order's M2M rows with one bulk insert, and stock holds for
+        every touched line are renewed, so the number of queries does not
+        grow with the number of operations. Raises ValueError, leaving the
+        cart untouched, for unknown items, invalid variations or short stock.
+        """
+        with transaction.atomic():
+            slugs = {operation['slug'] for operation in operations}
+            # lock the items in a fixed order so concurrent batches cannot deadlock
+            items = {
+                item.slug: item
+                for item in Item.objects.select_for_update().filter(slug__in=slugs).order_by('pk')
+            }
+            missing = slugs - set(items)
+            if missing:
+                raise ValueError(f"Unknown items: {', '.join(sorted(missing))}")
+            item_ids = [item.pk for item in items.values()]
+            options = Item.get_variation_options(item_ids)
+
+            changes = {}
+            variations_of = {}
+            for operation in operations:
+                item = items[operation['slug']]
+                variation_ids = set(operation.get('variations') or [])
+                error = item.get_variation_error(variation_ids, options[item.pk])
+                if error is not None:
+                    raise ValueError(f"{error}: {item.title}")
+                key = (item.pk, OrderItem.make_variation_signature(variation_ids))
+                changes[key] = changes.get(key, 0) + operation['quantity']
+                variations_of[key] = variation_ids
+
+            # only lines on this order are changed; open lines of the user
+            # that are not on it are fetched too so that the lines created
+            # below can be told apart from them
+            in_order = Order.items.through.objects.filter(
+                order_id=self.pk, orderitem_id=OuterRef('pk'))
+            existing = list(OrderItem.objects.filter(
+                user_id=self.user_id, ordered=False, item__in=item_ids).annotate(
+                in_order=Exists(in_order)))
+            lines = {
+                (line.item_id, line.variation_signature): line
+                for line in existing if line.in_order
+            }
+            # every touched line is held again for its whole new quantity,
+            # of which only what its own active hold covers is not new
+            wanted, touched = {}, []
+            for key, quantity in changes.items():
+                line = lines.get(key)
+                if line is not None:
+                    quantity += line.quantity
+                    touched.append(line.pk)
+                wanted[key[0]] = wanted.get(key[0], 0) + max(quantity, 0)
+
+            reserved = {
+                item_id: (total, own)
+                for item_id, total, own in StockReservation.objects.active().filter(
+                    item__in=item_ids).values('item').annotate(
+                    total=Sum('quantity'),
+                    own=Coalesce(Sum('quantity', filter=Q(order_item__in=touched)), 0)
+                ).values_list('item', 'total', 'own')
+            }
+            for item in items.values():
+                total, own = reserved.get(item.pk, (0, 0))
+                available = item.stock_quantity - total
+                if wanted.get(item.pk, 0) - own > available:
+                    raise ValueError(
+                        f"Insufficient stock available for {item.title}. "
+                        f"Only {available} in stock.")
+
+            to_create, to_update, to_delete = [], [], []
+            for key, quantity in changes.items():
+                line = lines.get(key)
+                if line is None:
+                    if quantity > 0:
+                        to_create.append(OrderItem(
+                            user_id=self.user_id, item_id=key[0], variation_signature=key[1],
+                            quantity=quantity, ordered=False))
+                elif line.quantity + quantity > 0:
+                    line.quantity += quantity
+                    to_update.append(line)
+                else:
+                    to_delete.append(line.pk)
+
+            if to_delete:
+                OrderItem.objects.filter(pk__in=to_delete).delete()
+            if to_update:
+                OrderItem.objects.bulk_update(to_update, ['quantity'])
+            if to_create:
+                OrderItem.objects.bulk_create(to_create)
+                # not every backend returns primary keys from a bulk
+                # INSERT; the open line per (item, signature) is unique
+                created = list(OrderItem.objects.filter(
+                    user_id=self.user_id, ordered=False, item__in=item_ids).exclude(
+                    pk__in=[line.pk for line in existing]))
+                Through = OrderItem.item_variations.through
+                Through.objects.bulk_create([
+                    Through(orderitem_id=line.pk, itemvariation_id=variation_id)
+                    for line in created
+                    for variation_id in variations_of[(line.item_id, line.variation_signature)]
+                ])
+                to_update += created
+            if to_update:
+                self.items.add(*to_update)
+                StockReservation.objects.hold_many(to_update)
+            self.update_summary()
+
     def remove_from_cart(self, item):
         """Remove item completely from cart
         TDD: test_order_has_remove_from_cart_method
@@ -271,94 +794,567 @@ class Order(models.Model):
         order_item_qs = self.items.filter(item=item, ordered=False)
         if order_item_qs.exists():
             order_item = order_item_qs.first()
-            self.items.remove(order_item)
-            order_item.delete()
+            with transaction.atomic():
+                self.items.remove(order_item)
+                order_item.delete()
+                self.update_summary()
     
+    def reduce_stock(self):
+        """Take the stock for every line of the order at once
+
+        Quantities are summed per item and applied by one conditional
+        UPDATE. If any item is short, fewer rows match than there are
+        items: nothing is changed and ValueError is raised.
+        """
+        wanted = {}
+        for item_id, quantity in self.items.values_list('item_id', 'quantity'):
+            wanted[item_id] = wanted.get(item_id, 0) + quantity
+        if not wanted:
+            return
+
+        needed = Case(
+            *[When(pk=item_id, then=Value(quantity))
+              for item_id, quantity in wanted.items()],
+            output_field=models.IntegerField()
+        )
+        with transaction.atomic():
+            updated = Item.objects.filter(
+                pk__in=wanted, stock_quantity__gte=needed
+            ).update(stock_quantity=F('stock_quantity') - needed)
+            if updated != len(wanted):
+                raise ValueError("Insufficient stock available")
+
+    def finalize(self, charge_id, amount, billing_address=None,
+                 shipping_address=None, ref_code=None):
+        """Turn the paid cart into a placed order and return its Payment
+
+        Takes the stock, records the payment, marks the lines and the
+        order ordered and drops the lines' stock holds in one transaction
+        and a fixed number of statements, however many lines there are.
+        Raises ValueError, changing nothing, if an item is out of stock.
+        """
+        lines = self.items.through.objects.filter(
+            order=self).values('orderitem_id')
+        fields = {'billing_address': billing_address,
+                  'shipping_address': shipping_address,
+                  'ref_code': ref_code}
+        fields = {name: value for name, value in fields.items()
+                  if value is not None}
+        with transaction.atomic():
+            self.reduce_stock()
+            payment = Payment.objects.create(
+                stripe_charge_id=charge_id, user_id=self.user_id, amount=amount)
+            OrderItem.objects.filter(pk__in=lines).update(ordered=True)
+            StockReservation.objects.filter(order_item__in=lines).delete()
+            fields.update(ordered=True, payment=payment)
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.save(update_fields=list(fields))
+        return payment
+
+    def enqueue_payment(self, **fields):
+        """Queue a PaymentJob for the payment worker to charge this order
+
+        The coupon is redeemed now, as the synchronous payment views do
+        before charging, and given back by the worker if the charge
+        fails. Raises ValueError if the coupon has run out or the order
+        already has a payment in progress.
+        """
+        coupon = self.coupon
+        if coupon is not None and not coupon.redeem():
+            raise ValueError("This coupon is no longer available")
+        try:
+            with transaction.atomic():
+                return PaymentJob.objects.create(
+                    order=self, user_id=self.user_id,
+                    amount_cents=self.get_total_money().cents, **fields)
+        except IntegrityError:
+            if coupon is not None:
+                coupon.release()
+            raise ValueError("A payment for this order is already in progress")
+
     def clear_cart(self):
         """Remove all items from cart
         TDD: test_clear_cart_removes_all_items
+
+        Set-based: the open line ids are read once, and the deletion
+        collector removes their stock holds, variation links and order
+        links with one DELETE each before the lines themselves, which go
+        in one DELETE per hundred lines.
+        """
+        with transaction.atomic():
+            lines = list(self.items.through.objects.filter(
+                order=self, orderitem__ordered=False).values_list('orderitem_id', flat=True))
+            OrderItem.objects.filter(pk__in=lines).delete()
+            self.update_summary()
+
+
+address_cache = LRUCache(maxsize=settings.ADDRESS_CACHE_SIZE, ttl=settings.ADDRESS_CACHE_TTL)
+
+
+class AddressManager(models.Manager):
+
+    def get_defaults(self, user):
+        """The user's default addresses keyed by address type
+
+        Both defaults come from one query on the (user, address_type,
+        default) index and are then served from the in-process LRU cache
+        until one of the user's addresses is saved or deleted in this
+        process, or for at most ADDRESS_CACHE_TTL seconds. A type
+        without a default is left out; if several are flagged the oldest
+        wins. Each call returns fresh instances.
+        """
+        fields = self.model._meta.concrete_fields
+        attnames = [f.attname for f in fields]
+        rows = address_cache.get(user.pk)
+        if rows is None:
+            addresses = self.filter(
+                user=user, default=True,
+                address_type__in=[choice for choice, _ in ADDRESS_CHOICES],
+            ).order_by('id')
+            rows = tuple(tuple(getattr(a, name) for name in attnames) for a in addresses)
+            address_cache.set(user.pk, rows)
+        defaults = {}
+        for values in rows:
+            address = self.model.from_db(self.db, attnames, values)
+            defaults.setdefault(address.address_type, address)
+        return defaults
+
+    def get_for_checkout(self, user, address_type, pk=None):
+        """The user's address ``pk``, or their default of ``address_type`` without one
+
+        Picking the default, as the checkout forms do, is answered by
+        get_defaults. Raises Address.DoesNotExist for addresses that are
+        missing or belong to someone else.
+        """
+        default = self.get_defaults(user).get(address_type)
+        if pk in (None, '') or (default is not None and str(default.pk) == str(pk)):
+            if default is None:
+                raise self.model.DoesNotExist('No default address')
+            return default
+        return self.get(user=user, pk=pk)
+
+    def get_or_create_by_content(self, user, address_type, **fields):
+        """The user's stored address with this content, created if there is none
+
+        Matches on the content hash, so the same address entered again at
+        checkout reuses its row instead of adding one per order. Returns
+        (address, created).
+        """
+        content_hash = self.model.make_content_hash(address_type, **fields)
+        address = self.filter(user=user, content_hash=content_hash).order_by('id').first()
+        if address is not None:
+            return address, False
+        return self.create(user=user, address_type=address_type, **fields), True
+
+    def compact(self, batch_size=500):
+        """Merge duplicate addresses into the oldest row with the same content
+
+        Orders and payment jobs are pointed at the kept row, which stays
+        a default if any of its duplicates was, and the duplicates are
+        deleted, ``batch_size`` at a time with one UPDATE per foreign key
+        per batch. Rows written without save(), e.g. by bulk_create, are
+        hashed first. Returns the number of rows deleted.
         """
-        for order_item in self.items.filter(ordered=False):
-            order_item.delete()
-        self.items.clear()
+        self.fill_content_hashes(batch_size)
+        keeper = self.filter(
+            user=OuterRef('user'), content_hash=OuterRef('content_hash'),
+        ).order_by('id').values('id')[:1]
+        duplicates = self.annotate(keep_id=Subquery(keeper)).exclude(
+            keep_id=F('pk')).order_by('id').values_list('pk', 'keep_id', 'default')
+        merged = 0
+        while True:
+            batch = list(duplicates[:batch_size])
+            if not batch:
+                return merged
+            keep = {pk: keep_id for pk, keep_id, _ in batch}
+            with transaction.atomic():
+                for model, field in ((Order, 'shipping_address'), (Order, 'billing_address'),
+                                     (PaymentJob, 'shipping_address'), (PaymentJob, 'billing_address')):
+                    model.objects.filter(**{f'{field}__in': keep}).update(**{field: Case(
+                        *[When(**{field: pk}, then=Value(keep_id)) for pk, keep_id in keep.items()])})
+                self.filter(pk__in={keep_id for _, keep_id, default in batch if default}).update(default=True)
+                # the post_delete signal drops the owners' cached defaults
+                self.filter(pk__in=keep).delete()
+            merged += len(batch)
+
+    def fill_content_hashes(self, batch_size=500):
+        """Hash addresses saved without one"""
+        while True:
+            batch = list(self.filter(content_hash='')[:batch_size])
+            if not batch:
+                return
+            for address in batch:
+                address.content_hash = address.get_content_hash()
+            self.bulk_update(batch, ['content_hash'])
 
 
 class Address(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
-                             on_delete=models.CASCADE)
+                             on_delete=models.CASCADE, db_index=False)
     street_address = models.CharField(max_length=100)
     apartment_address = models.CharField(max_length=100)
     country = CountryField(multiple=False)
     zip = models.CharField(max_length=100)
     address_type = models.CharField(max_length=1, choices=ADDRESS_CHOICES)
     default = models.BooleanField(default=False)
+    # hash of address_type and the address lines, see make_content_hash()
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+
+    objects = AddressManager()
+
+    CONTENT_FIELDS = ('street_address', 'apartment_address', 'country', 'zip')
 
     def __str__(self):
         return self.user.username
 
+    @staticmethod
+    def make_content_hash(address_type, **fields):
+        """SHA-256 of the address type and lines, ignoring case and spacing
+
+        The same address typed twice gets the same hash, so finding its
+        stored row is one equality lookup on the user's index.
+        """
+        parts = [address_type] + [str(fields.get(name) or '') for name in Address.CONTENT_FIELDS]
+        normalized = '\x1f'.join(' '.join(part.split()).casefold() for part in parts)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def get_content(self):
+        """The address lines, as keyword arguments for another address"""
+        return {name: getattr(self, name) for name in self.CONTENT_FIELDS}
+
+    def get_content_hash(self):
+        return self.make_content_hash(self.address_type, **self.get_content())
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.get_content_hash()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'content_hash'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name_plural = 'Addresses'
+        indexes = [
+            # also serves every per-user lookup in place of a user FK index
+            models.Index(fields=['user', 'address_type', 'default'],
+                         name='address_user_type_default_idx'),
+            models.Index(fields=['user', 'content_hash'],
+                         name='address_user_content_idx'),
+        ]
 
 
 class Payment(models.Model):
     stripe_charge_id = models.CharField(max_length=50)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.SET_NULL, blank=True, null=True)
-    amount = models.FloatField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.user.username
 
 
+class PaymentJobQuerySet(models.QuerySet):
+    def claim_next(self):
+        """Move the oldest pending job to processing and return it
+
+        The claim is a conditional UPDATE, so several workers can share
+        the queue: a job another worker took first matches no row and
+        the next one is tried. A job left processing for longer than
+        PAYMENT_JOB_LEASE seconds, by a worker that died, is claimed
+        again. Returns None when nothing is pending.
+        """
+        while True:
+            now = timezone.now()
+            claimable = Q(status=PaymentJob.PENDING) | Q(
+                status=PaymentJob.PROCESSING,
+                updated_at__lt=now - timedelta(seconds=settings.PAYMENT_JOB_LEASE))
+            pk = self.filter(claimable).order_by(
+                'created_at', 'pk').values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            claimed = self.filter(claimable, pk=pk).update(
+                status=PaymentJob.PROCESSING, attempts=F('attempts') + 1,
+                updated_at=now)
+            if claimed:
+                return self.select_related('order', 'user').get(pk=pk)
+
+
+class PaymentJob(models.Model):
+    """A checkout waiting for the payment worker to charge the card"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    # charged, but neither placed nor refunded: settle it by hand
+    RECONCILE = 'reconcile'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (RECONCILE, 'Needs reconciliation'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE,
+                              related_name='payment_jobs')
+    stripe_token = models.CharField(max_length=100, blank=True)
+    save_card = models.BooleanField(default=False)
+    use_saved_card = models.BooleanField(default=False)
+    billing_address = models.ForeignKey(
+        'Address', related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    shipping_address = models.ForeignKey(
+        'Address', related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    ref_code = models.CharField(max_length=20, blank=True, null=True)
+    amount_cents = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING)
+    message = models.CharField(max_length=255, blank=True)
+    stripe_charge_id = models.CharField(max_length=50, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PaymentJobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='paymentjob_queue_idx'),
+        ]
+        constraints = [
+            # an order is charged by at most one job at a time
+            models.UniqueConstraint(
+                fields=['order'],
+                condition=Q(status__in=['pending', 'processing']),
+                name='paymentjob_one_active_per_order'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} {self.status}'
+
+    def get_amount(self):
+        return Money(self.amount_cents).to_decimal()
+
+    def record_charge(self, stripe_charge_id):
+        """Store the charge before the order is placed, so it is never lost"""
+        self.stripe_charge_id = stripe_charge_id
+        self.save(update_fields=['stripe_charge_id', 'updated_at'])
+
+    def finish(self, status, message='', stripe_charge_id=''):
+        self.status = status
+        self.message = message
+        self.stripe_charge_id = stripe_charge_id
+        self.save(update_fields=['status', 'message', 'stripe_charge_id', 'updated_at'])
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def claim(self, user, key, request_hash):
+        """Return ``(record, created)`` for the user's ``key``
+
+        A key seen before is answered by one lookup on the unique
+        (user, key) index. A new key is recorded as in progress; if
+        another request records it first, theirs is returned.
+        """
+        record = self.filter(user=user, key=key).first()
+        if record is not None:
+            return record, False
+        try:
+            with transaction.atomic():
+                return self.create(user=user, key=key,
+                                   request_hash=request_hash), True
+        except IntegrityError:
+            return self.get(user=user, key=key), False
+
+    def delete_older_than(self, cutoff, batch_size=1000):
+        """Delete records created before ``cutoff``, ``batch_size`` at a time
+
+        Returns the number deleted. Retries sent after this will run
+        again, so keep records well past the clients' retry window.
+        """
+        deleted = 0
+        while True:
+            batch = list(self.filter(created_at__lt=cutoff).order_by(
+                'created_at').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            deleted += len(batch)
+            self.filter(pk__in=batch).delete()
+
+
+class IdempotencyKey(models.Model):
+    """The stored outcome of a request sent with an Idempotency-Key header"""
+    MAX_LENGTH = 255
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, db_index=False)
+    key = models.CharField(max_length=MAX_LENGTH)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='idempotencykey_user_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} {self.key}'
+
+    @staticmethod
+    def hash_request(data):
+        """A digest of the request body, to spot a key reused for another request"""
+        body = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(body.encode()).hexdigest()
+
+    @property
+    def in_progress(self):
+        return self.status_code is None
+
+    def complete(self, status_code, response_body):
+        self.status_code = status_code
+        self.response_body = response_body
+        self.save(update_fields=['status_code', 'response_body'])
+
+
 # =============================================================================
 # TDD GREEN CYCLE - Feature 2: Enhanced Coupon System
 # Tests: test_tdd_feature2_coupons.py & test_tdd_feature2_refactor.py
 # =============================================================================
 
+coupon_cache = LRUCache(maxsize=settings.COUPON_CACHE_SIZE, ttl=settings.COUPON_CACHE_TTL)
+
+# Generated codes avoid 0/O, 1/I/L so they can be typed in from print
+COUPON_CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+
+
+class CouponManager(models.Manager):
+
+    def get_by_code(self, code):
+        """Look a coupon up by its code, case-insensitively
+
+        Hits the unique code index once, then serves the coupon from the
+        in-process LRU cache until the row is saved, redeemed or deleted in
+        this process, or for at most COUPON_CACHE_TTL seconds. Usage counts
+        read from the cache may lag other processes, so checkout still
+        relies on the conditional UPDATE in redeem(). Raises
+        Coupon.DoesNotExist for unknown codes.
+        """
+        code = Coupon.normalize_code(code)
+        fields = self.model._meta.concrete_fields
+        values = coupon_cache.get(code)
+        if values is not None:
+            return self.model.from_db(self.db, [f.attname for f in fields], values)
+        coupon = self.get(code=code)
+        coupon_cache.set(code, tuple(getattr(coupon, f.attname) for f in fields))
+        return coupon
+
+    def generate(self, count, prefix='', length=10, batch_size=5000, **fields):
+        """Create ``count`` coupons with random unique codes in chunked INSERTs
+
+        Codes are ``prefix`` followed by ``length`` characters drawn from
+        an alphabet without look-alike characters. Each chunk is checked
+        against codes already drawn in this run and against the unique
+        index in one query, and redrawn codes fill the gaps, so the
+        INSERT never collides. ``fields`` (discount_type,
+        discount_value, expiry_date, max_uses, ...) apply to every coupon.
+        Returns the list of codes created.
+        """
+        prefix = Coupon.normalize_code(prefix)
+        max_length = self.model._meta.get_field('code').max_length
+        if len(prefix) + length > max_length:
+            raise ValueError(
+                f"Codes are limited to {max_length} characters, "
+                f"got a {len(prefix)} character prefix and {length} random characters")
+        if len(COUPON_CODE_ALPHABET) ** length < count * 100:
+            raise ValueError(
+                f"{length} random characters are too few for {count} unique codes")
+        fields.setdefault('amount', 0)
+
+        codes = []
+        seen = set()
+        while len(codes) < count:
+            size = min(batch_size, count - len(codes))
+            chunk = set()
+            while len(chunk) < size:
+                wanted = size - len(chunk)
+                drawn = {
+                    prefix + get_random_string(length, COUPON_CODE_ALPHABET)
+                    for _ in range(wanted)
+                } - seen
+                drawn -= set(self.filter(code__in=drawn).values_list('code', flat=True))
+                chunk |= drawn
+                seen |= drawn
+            chunk = sorted(chunk)
+            self.bulk_create([self.model(code=code, **fields) for code in chunk])
+            codes.extend(chunk)
+        return codes
+
+
 class Coupon(models.Model):
     DISCOUNT_TYPE_CHOICES = (
         ('fixed', 'Fixed Amount'),
         ('percentage', 'Percentage'),
     )
     
-    code = models.CharField(max_length=15)
-    amount = models.FloatField()  # Keep for backwards compatibility
+    code = models.CharField(max_length=15, unique=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)  # Keep for backwards compatibility
     discount_type = models.CharField(max_length=10, choices=DISCOUNT_TYPE_CHOICES, default='fixed')
-    discount_value = models.FloatField(default=0)
-    minimum_order_amount = models.FloatField(default=0.0)
+    discount_value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    minimum_order_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     expiry_date = models.DateTimeField(blank=True, null=True)
     max_uses = models.IntegerField(blank=True, null=True)
     current_uses = models.IntegerField(default=0)
 
+    objects = CouponManager()
+
     def __str__(self):
         return self.code
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        coupon = super().from_db(db, field_names, values)
+        if 'code' in field_names:
+            coupon._loaded_code = coupon.code
+        return coupon
+
+    def save(self, *args, **kwargs):
+        self.code = self.normalize_code(self.code)
+        super().save(*args, **kwargs)
+        self._loaded_code = self.code
+
+    @staticmethod
+    def normalize_code(code):
+        """Codes are stored upper-cased without surrounding whitespace"""
+        return (code or '').strip().upper()
+
+    def invalidate_cache(self):
+        coupon_cache.delete(self.code)
+        loaded_code = getattr(self, '_loaded_code', None)
+        if loaded_code is not None and loaded_code != self.code:
+            coupon_cache.delete(loaded_code)
     
     def calculate_discount(self, order_total):
         """Calculate discount amount based on type
         TDD: test_percentage_coupon_calculation, test_fixed_amount_coupon_calculation
         Supports both percentage and fixed amount discounts
         """
-        from decimal import Decimal
-        order_total = Decimal(str(order_total))
-        
-        if self.discount_type == 'percentage':
-            discount = order_total * (Decimal(str(self.discount_value)) / Decimal('100'))
-        else:  # fixed
-            discount = Decimal(str(self.discount_value))
-        
-        # Ensure discount doesn't exceed order total
-        if discount > order_total:
-            discount = order_total
-        
-        return discount
+        return self.calculate_discount_money(order_total).to_decimal()
+
+    def calculate_discount_money(self, order_total):
+        return coupon_discount(self, order_total)
     
     def is_valid_for_amount(self, amount):
         """Check if order amount meets minimum requirement
         TDD: test_coupon_minimum_order_requirement
         """
-        from decimal import Decimal
-        return Decimal(str(amount)) >= Decimal(str(self.minimum_order_amount))
+        return Money.from_amount(amount) >= Money.from_amount(self.minimum_order_amount)
     
     def is_active(self):
         """Check if coupon is active (not expired)
@@ -377,12 +1373,46 @@ class Coupon(models.Model):
             return True
         return self.current_uses < self.max_uses
     
+    def get_validation_error(self, order_total):
+        """Why this coupon cannot be applied to ``order_total``, or None"""
+        if not self.is_active():
+            return "Coupon has expired"
+        if not self.can_be_used():
+            return "Coupon has reached maximum uses"
+        if not self.is_valid_for_amount(order_total):
+            return "Order does not meet minimum amount"
+        return None
+
     def increment_usage(self):
         """Increment usage counter
         TDD: test_coupon_usage_tracking_and_limits
         """
-        self.current_uses += 1
-        self.save()
+        Coupon.objects.filter(pk=self.pk).update(current_uses=F('current_uses') + 1)
+        self.invalidate_cache()
+        self.refresh_from_db(fields=['current_uses'])
+
+    def redeem(self):
+        """Use up one redemption if the coupon still has one
+
+        A single conditional UPDATE (uses = uses + 1 WHERE uses < max_uses
+        AND not expired), so concurrent checkouts can never redeem past
+        the limit. Returns True when the redemption was taken.
+        """
+        redeemable = Q(max_uses__isnull=True) | Q(current_uses__lt=F('max_uses'))
+        active = Q(expiry_date__isnull=True) | Q(expiry_date__gte=timezone.now())
+        updated = Coupon.objects.filter(redeemable, active, pk=self.pk).update(
+            current_uses=F('current_uses') + 1)
+        if updated:
+            self.invalidate_cache()
+            self.refresh_from_db(fields=['current_uses'])
+        return bool(updated)
+
+    def release(self):
+        """Give back a redemption taken by a checkout that did not complete"""
+        Coupon.objects.filter(pk=self.pk, current_uses__gt=0).update(
+            current_uses=F('current_uses') - 1)
+        self.invalidate_cache()
+        self.refresh_from_db(fields=['current_uses'])
 
 
 class Refund(models.Model):
@@ -401,3 +1431,21 @@ def userprofile_receiver(sender, instance, created, *args, **kwargs):
 
 
 post_save.connect(userprofile_receiver, sender=settings.AUTH_USER_MODEL)
+
+
+def coupon_cache_receiver(sender, instance, *args, **kwargs):
+    instance.invalidate_cache()
+
+
+post_save.connect(coupon_cache_receiver, sender=Coupon)
+post_delete.connect(coupon_cache_receiver, sender=Coupon)
+
+
+def address_cache_receiver(sender, instance, *args, **kwargs):
+    # queryset update() sends no signal; callers changing defaults that
+    # way must delete the user's entry themselves
+    address_cache.delete(instance.user_id)
+
+
+post_save.connect(address_cache_receiver, sender=Address)
+post_delete.connect(address_cache_receiver, sender=Address)
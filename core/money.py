@@ -0,0 +1,80 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import total_ordering
+
+
+CENTS = Decimal('0.01')
+
+
+@total_ordering
+class Money:
+    """An amount of money held as a whole number of cents
+
+    Pricing adds, subtracts and multiplies plain integers; amounts only
+    become Decimals again at the edges (model fields, API payloads).
+    """
+    __slots__ = ('cents',)
+
+    def __init__(self, cents=0):
+        self.cents = int(cents)
+
+    @classmethod
+    def from_amount(cls, amount):
+        """Build from a Decimal, float, int or string amount in currency units
+
+        Floats go through ``str`` so 24.99 is read as written, and any
+        fraction of a cent is rounded half up.
+        """
+        if isinstance(amount, Money):
+            return amount
+        if amount is None:
+            return cls(0)
+        cents = (Decimal(str(amount)) * 100).quantize(
+            Decimal('1'), rounding=ROUND_HALF_UP)
+        return cls(cents)
+
+    def to_decimal(self):
+        return (Decimal(self.cents) / 100).quantize(CENTS)
+
+    def percentage(self, percent):
+        """``percent`` percent of this amount, rounded half up to the cent"""
+        cents = (self.cents * Decimal(str(percent)) / 100).quantize(
+            Decimal('1'), rounding=ROUND_HALF_UP)
+        return Money(cents)
+
+    def __add__(self, other):
+        return Money(self.cents + Money.from_amount(other).cents)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.cents - Money.from_amount(other).cents)
+
+    def __mul__(self, quantity):
+        return Money(self.cents * int(quantity))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents == other.cents
+
+    def __lt__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.cents < other.cents
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __repr__(self):
+        return f"Money('{self.to_decimal()}')"
+
+    def __str__(self):
+        return str(self.to_decimal())
@@ -0,0 +1,144 @@
+"""Gateway customers, saved cards and the charges run by the payment worker"""
+from django.conf import settings
+
+from .cache import LRUCache
+from .gateways import PaymentError, get_gateway
+from .models import PaymentJob, UserProfile
+
+# Customer objects and default card metadata, keyed on
+# UserProfile.stripe_customer_id. Cards added through save_card drop the
+# entries at once; changes made elsewhere show after the TTL.
+customer_cache = LRUCache(maxsize=settings.STRIPE_CUSTOMER_CACHE_SIZE,
+                          ttl=settings.STRIPE_CUSTOMER_CACHE_TTL)
+
+CARD_FIELDS = ('id', 'brand', 'last4', 'exp_month', 'exp_year')
+
+_missing = object()
+
+
+def get_customer(customer_id):
+    """The gateway's customer object, answered from the cache while fresh"""
+    key = ('customer', customer_id)
+    customer = customer_cache.get(key)
+    if customer is None:
+        customer = get_gateway().retrieve_customer(customer_id)
+        customer_cache.set(key, customer)
+    return customer
+
+
+def get_default_card(customer_id):
+    """Display fields of the customer's first saved card, or None"""
+    key = ('card', customer_id)
+    card = customer_cache.get(key, _missing)
+    if card is _missing:
+        cards = get_gateway().list_cards(customer_id, limit=3)
+        card = {field: cards[0].get(field) for field in CARD_FIELDS} if cards else None
+        customer_cache.set(key, card)
+    return card
+
+
+def save_card(customer_id, token):
+    """Attach the card behind ``token`` to the customer"""
+    get_gateway().save_card(customer_id, token)
+    invalidate_customer(customer_id)
+
+
+def invalidate_customer(customer_id):
+    customer_cache.delete(('customer', customer_id))
+    customer_cache.delete(('card', customer_id))
+
+
+def ensure_customer(userprofile, email):
+    """The profile's gateway customer id, creating the customer on first use"""
+    if userprofile.stripe_customer_id:
+        get_customer(userprofile.stripe_customer_id)
+    else:
+        userprofile.stripe_customer_id = get_gateway().create_customer(email)
+        userprofile.one_click_purchasing = True
+        userprofile.save()
+    return userprofile.stripe_customer_id
+
+
+SERIOUS_ERROR = 'A serious error occurred. We have been notifed.'
+CART_CHANGED = 'Your cart changed after checkout. Please check out again.'
+
+
+def process_job(job):
+    """Charge a claimed job's card and place its order
+
+    Mirrors the synchronous payment views: a failed charge gives the
+    coupon back, and a charge whose order cannot be placed is refunded,
+    or left for reconciliation if the refund fails too. A reclaimed job
+    with a stored charge is settled from it. A job claimed more than
+    PAYMENT_JOB_MAX_ATTEMPTS times, or whose cart no longer matches the
+    amount taken at checkout, fails without charging. Unexpected errors
+    are raised again once the job is settled.
+    """
+    gateway = get_gateway()
+    order = job.order
+    coupon = order.coupon
+    if job.stripe_charge_id:
+        # an earlier attempt charged the card, then its worker died
+        status = PaymentJob.SUCCEEDED if order.ordered else PaymentJob.RECONCILE
+        job.finish(status, '' if order.ordered else SERIOUS_ERROR, job.stripe_charge_id)
+        return job
+    if job.attempts > settings.PAYMENT_JOB_MAX_ATTEMPTS:
+        if coupon is not None:
+            coupon.release()
+        job.finish(PaymentJob.FAILED, SERIOUS_ERROR)
+        return job
+    if order.get_total_money().cents != job.amount_cents:
+        # the cart changed after checkout: charge nothing rather than the old total
+        if coupon is not None:
+            coupon.release()
+        job.finish(PaymentJob.FAILED, CART_CHANGED)
+        return job
+    # a retried job must not charge the card twice
+    idempotency_key = f'payment-job-{job.pk}'
+    try:
+        if job.save_card or job.use_saved_card:
+            # charge the customer because we cannot charge the token more than once
+            userprofile = UserProfile.objects.get(user=job.user)
+            customer_id = ensure_customer(userprofile, job.user.email)
+            if job.save_card:
+                save_card(customer_id, job.stripe_token)
+            charge_id = gateway.charge(job.amount_cents, customer=customer_id,
+                                       idempotency_key=idempotency_key)
+        else:
+            charge_id = gateway.charge(
+                job.amount_cents, source=job.stripe_token,
+                description=f'Charge for {job.user.email}',
+                idempotency_key=idempotency_key)
+    except Exception as e:
+        # the customer was not charged, so the coupon was not used
+        if coupon is not None:
+            coupon.release()
+        if isinstance(e, PaymentError):
+            job.finish(PaymentJob.FAILED, str(e))
+            return job
+        job.finish(PaymentJob.FAILED, SERIOUS_ERROR)
+        raise
+
+    try:
+        job.record_charge(charge_id)
+        order.finalize(
+            charge_id, job.get_amount(),
+            billing_address=job.billing_address,
+            shipping_address=job.shipping_address,
+            ref_code=job.ref_code)
+    except Exception as e:
+        message = str(e) if isinstance(e, ValueError) else SERIOUS_ERROR
+        try:
+            gateway.refund(charge_id)
+        except Exception:
+            job.finish(PaymentJob.RECONCILE, SERIOUS_ERROR, charge_id)
+            raise
+        if coupon is not None:
+            coupon.release()
+        job.finish(PaymentJob.FAILED, message, charge_id)
+        if isinstance(e, ValueError):
+            return job
+        raise
+
+    job.finish(PaymentJob.SUCCEEDED, stripe_charge_id=charge_id)
+    return job
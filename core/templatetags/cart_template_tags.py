@@ -6,8 +6,9 @@ register = template.Library()
 
 @register.filter
 def cart_item_count(user):
-    if user.is_authenticated:
-        qs = Order.objects.filter(user=user, ordered=False)
-        if qs.exists():
-            return qs[0].items.count()
-    return 0
+    return Order.objects.cart_summary(user)['item_count']
+
+
+@register.filter
+def cart_total(user):
+    return Order.objects.cart_summary(user)['total']
@@ -3,17 +3,17 @@ from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import ListView, DetailView, View
 from django.shortcuts import redirect
-from django.utils import timezone
 from .forms import CheckoutForm, CouponForm, RefundForm, PaymentForm
-from .models import Item, OrderItem, Order, Address, Payment, Coupon, Refund, UserProfile
+from .models import Item, Order, Address, Coupon, Refund, UserProfile
+from .gateways import PaymentError, get_gateway
+from .payments import ensure_customer, get_default_card, save_card
 
 import random
 import string
-import stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
 def create_ref_code():
@@ -47,23 +47,13 @@ class CheckoutView(View):
                 'DISPLAY_COUPON_FORM': True
             }
 
-            shipping_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='S',
-                default=True
-            )
-            if shipping_address_qs.exists():
+            defaults = Address.objects.get_defaults(self.request.user)
+            if 'S' in defaults:
                 context.update(
-                    {'default_shipping_address': shipping_address_qs[0]})
-
-            billing_address_qs = Address.objects.filter(
-                user=self.request.user,
-                address_type='B',
-                default=True
-            )
-            if billing_address_qs.exists():
+                    {'default_shipping_address': defaults['S']})
+            if 'B' in defaults:
                 context.update(
-                    {'default_billing_address': billing_address_qs[0]})
+                    {'default_billing_address': defaults['B']})
 
             return render(self.request, "checkout.html", context)
         except ObjectDoesNotExist:
@@ -80,15 +70,11 @@ class CheckoutView(View):
                     'use_default_shipping')
                 if use_default_shipping:
                     print("Using the defualt shipping address")
-                    address_qs = Address.objects.filter(
-                        user=self.request.user,
-                        address_type='S',
-                        default=True
-                    )
-                    if address_qs.exists():
-                        shipping_address = address_qs[0]
+                    shipping_address = Address.objects.get_defaults(
+                        self.request.user).get('S')
+                    if shipping_address is not None:
                         order.shipping_address = shipping_address
-                        order.save()
+                        order.save(update_fields=['shipping_address'])
                     else:
                         messages.info(
                             self.request, "No default shipping address available")
@@ -104,24 +90,22 @@ class CheckoutView(View):
                     shipping_zip = form.cleaned_data.get('shipping_zip')
 
                     if is_valid_form([shipping_address1, shipping_country, shipping_zip]):
-                        shipping_address = Address(
-                            user=self.request.user,
+                        shipping_address, _ = Address.objects.get_or_create_by_content(
+                            self.request.user, 'S',
                             street_address=shipping_address1,
                             apartment_address=shipping_address2,
                             country=shipping_country,
-                            zip=shipping_zip,
-                            address_type='S'
+                            zip=shipping_zip
                         )
-                        shipping_address.save()
 
                         order.shipping_address = shipping_address
-                        order.save()
+                        order.save(update_fields=['shipping_address'])
 
                         set_default_shipping = form.cleaned_data.get(
                             'set_default_shipping')
-                        if set_default_shipping:
+                        if set_default_shipping and not shipping_address.default:
                             shipping_address.default = True
-                            shipping_address.save()
+                            shipping_address.save(update_fields=['default'])
 
                     else:
                         messages.info(
@@ -133,25 +117,18 @@ class CheckoutView(View):
                     'same_billing_address')
 
                 if same_billing_address:
-                    billing_address = shipping_address
-                    billing_address.pk = None
-                    billing_address.save()
-                    billing_address.address_type = 'B'
-                    billing_address.save()
+                    billing_address, _ = Address.objects.get_or_create_by_content(
+                        self.request.user, 'B', **shipping_address.get_content())
                     order.billing_address = billing_address
-                    order.save()
+                    order.save(update_fields=['billing_address'])
 
                 elif use_default_billing:
                     print("Using the defualt billing address")
-                    address_qs = Address.objects.filter(
-                        user=self.request.user,
-                        address_type='B',
-                        default=True
-                    )
-                    if address_qs.exists():
-                        billing_address = address_qs[0]
+                    billing_address = Address.objects.get_defaults(
+                        self.request.user).get('B')
+                    if billing_address is not None:
                         order.billing_address = billing_address
-                        order.save()
+                        order.save(update_fields=['billing_address'])
                     else:
                         messages.info(
                             self.request, "No default billing address available")
@@ -167,24 +144,22 @@ class CheckoutView(View):
                     billing_zip = form.cleaned_data.get('billing_zip')
 
                     if is_valid_form([billing_address1, billing_country, billing_zip]):
-                        billing_address = Address(
-                            user=self.request.user,
+                        billing_address, _ = Address.objects.get_or_create_by_content(
+                            self.request.user, 'B',
                             street_address=billing_address1,
                             apartment_address=billing_address2,
                             country=billing_country,
-                            zip=billing_zip,
-                            address_type='B'
+                            zip=billing_zip
                         )
-                        billing_address.save()
 
                         order.billing_address = billing_address
-                        order.save()
+                        order.save(update_fields=['billing_address'])
 
                         set_default_billing = form.cleaned_data.get(
                             'set_default_billing')
-                        if set_default_billing:
+                        if set_default_billing and not billing_address.default:
                             billing_address.default = True
-                            billing_address.save()
+                            billing_address.save(update_fields=['default'])
 
                     else:
                         messages.info(
@@ -215,17 +190,11 @@ class PaymentView(View):
             }
             userprofile = self.request.user.userprofile
             if userprofile.one_click_purchasing:
-                # fetch the users card list
-                cards = stripe.Customer.list_sources(
-                    userprofile.stripe_customer_id,
-                    limit=3,
-                    object='card'
-                )
-                card_list = cards['data']
-                if len(card_list) > 0:
-                    # update the context with the default card
+                # the default card, cached between page views
+                card = get_default_card(userprofile.stripe_customer_id)
+                if card is not None:
                     context.update({
-                        'card': card_list[0]
+                        'card': card
                     })
             return render(self.request, "payment.html", context)
         else:
@@ -234,7 +203,8 @@ class PaymentView(View):
             return redirect("core:checkout")
 
     def post(self, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        order = Order.objects.with_totals().get(
+            user=self.request.user, ordered=False)
         form = PaymentForm(self.request.POST)
         userprofile = UserProfile.objects.get(user=self.request.user)
         if form.is_valid():
@@ -242,94 +212,62 @@ class PaymentView(View):
             save = form.cleaned_data.get('save')
             use_default = form.cleaned_data.get('use_default')
 
-            if save:
-                if userprofile.stripe_customer_id != '' and userprofile.stripe_customer_id is not None:
-                    customer = stripe.Customer.retrieve(
-                        userprofile.stripe_customer_id)
-                    customer.sources.create(source=token)
+            if settings.PAYMENT_QUEUE_ENABLED:
+                try:
+                    order.enqueue_payment(
+                        stripe_token=token or '', save_card=bool(save),
+                        use_saved_card=bool(use_default),
+                        ref_code=create_ref_code())
+                except ValueError as e:
+                    messages.warning(self.request, str(e))
+                    return redirect("core:checkout")
+                messages.info(self.request, "Your payment is being processed")
+                return redirect("/")
+
+            gateway = get_gateway()
 
-                else:
-                    customer = stripe.Customer.create(
-                        email=self.request.user.email,
-                    )
-                    customer.sources.create(source=token)
-                    userprofile.stripe_customer_id = customer['id']
-                    userprofile.one_click_purchasing = True
-                    userprofile.save()
+            total = order.get_total_money()
+            amount = total.cents
 
-            amount = int(order.get_total() * 100)
+            coupon = order.coupon
+            if coupon is not None and not coupon.redeem():
+                messages.warning(self.request, "This coupon is no longer available")
+                return redirect("core:checkout")
 
             try:
 
-                if use_default or save:
-                    # charge the customer because we cannot charge the token more than once
-                    charge = stripe.Charge.create(
-                        amount=amount,  # cents
-                        currency="usd",
-                        customer=userprofile.stripe_customer_id
-                    )
-                else:
-                    # charge once off on the token
-                    charge = stripe.Charge.create(
-                        amount=amount,  # cents
-                        currency="usd",
-                        source=token
-                    )
-
-                # create the payment
-                payment = Payment()
-                payment.stripe_charge_id = charge['id']
-                payment.user = self.request.user
-                payment.amount = order.get_total()
-                payment.save()
-
-                # assign the payment to the order
-
-                order_items = order.items.all()
-                order_items.update(ordered=True)
-                for item in order_items:
-                    item.save()
-
-                order.ordered = True
-                order.payment = payment
-                order.ref_code = create_ref_code()
-                order.save()
+                try:
+                    if save:
+                        save_card(ensure_customer(userprofile, self.request.user.email), token)
+                    if use_default or save:
+                        # charge the customer because we cannot charge the token more than once
+                        charge_id = gateway.charge(
+                            amount, customer=userprofile.stripe_customer_id)
+                    else:
+                        # charge once off on the token
+                        charge_id = gateway.charge(amount, source=token)
+                except Exception:
+                    # the customer was not charged, so the coupon was not used
+                    if coupon is not None:
+                        coupon.release()
+                    raise
+
+                try:
+                    order.finalize(charge_id, total.to_decimal(),
+                                   ref_code=create_ref_code())
+                except ValueError as e:
+                    # stock ran out after the charge: pay back and keep the cart
+                    gateway.refund(charge_id)
+                    if coupon is not None:
+                        coupon.release()
+                    messages.warning(self.request, str(e))
+                    return redirect("core:order-summary")
 
                 messages.success(self.request, "Your order was successful!")
                 return redirect("/")
 
-            except stripe.error.CardError as e:
-                body = e.json_body
-                err = body.get('error', {})
-                messages.warning(self.request, f"{err.get('message')}")
-                return redirect("/")
-
-            except stripe.error.RateLimitError as e:
-                # Too many requests made to the API too quickly
-                messages.warning(self.request, "Rate limit error")
-                return redirect("/")
-
-            except stripe.error.InvalidRequestError as e:
-                # Invalid parameters were supplied to Stripe's API
-                messages.warning(self.request, "Invalid parameters")
-                return redirect("/")
-
-            except stripe.error.AuthenticationError as e:
-                # Authentication with Stripe's API failed
-                # (maybe you changed API keys recently)
-                messages.warning(self.request, "Not authenticated")
-                return redirect("/")
-
-            except stripe.error.APIConnectionError as e:
-                # Network communication with Stripe failed
-                messages.warning(self.request, "Network error")
-                return redirect("/")
-
-            except stripe.error.StripeError as e:
-                # Display a very generic error to the user, and maybe send
-                # yourself an email
-                messages.warning(
-                    self.request, "Something went wrong. You were not charged. Please try again.")
+            except PaymentError as e:
+                messages.warning(self.request, str(e))
                 return redirect("/")
 
             except Exception as e:
@@ -351,7 +289,8 @@ class HomeView(ListView):
 class OrderSummaryView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = Order.objects.with_cart_graph().get(
+                user=self.request.user, ordered=False)
             context = {
                 'object': order
             }
@@ -367,36 +306,26 @@ class ItemDetailView(DetailView):
 
 
 @login_required
+@transaction.atomic
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-        item=item,
-        user=request.user,
-        ordered=False
-    )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request, "This item quantity was updated.")
-            return redirect("core:order-summary")
-        else:
-            order.items.add(order_item)
-            messages.info(request, "This item was added to your cart.")
-            return redirect("core:order-summary")
+    order, _ = Order.objects.get_or_create_cart(request.user)
+    # the line without variations, as added by add_to_cart
+    in_cart = order.items.filter(item=item, variation_signature='').exists()
+    try:
+        order.add_to_cart(item)
+    except ValueError as e:
+        messages.warning(request, str(e))
+        return redirect("core:product", slug=slug)
+    if in_cart:
+        messages.info(request, "This item quantity was updated.")
     else:
-        ordered_date = timezone.now()
-        order = Order.objects.create(
-            user=request.user, ordered_date=ordered_date)
-        order.items.add(order_item)
         messages.info(request, "This item was added to your cart.")
-        return redirect("core:order-summary")
+    return redirect("core:order-summary")
 
 
 @login_required
+@transaction.atomic
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
     order_qs = Order.objects.filter(
@@ -405,14 +334,13 @@ def remove_from_cart(request, slug):
     )
     if order_qs.exists():
         order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            order.items.remove(order_item)
+        # the line without variations, as added by add_to_cart
+        order_item = order.items.filter(
+            item=item, variation_signature='').first()
+        if order_item is not None:
+            # deleting the line drops its stock hold too
+            order_item.delete()
+            order.update_summary()
             messages.info(request, "This item was removed from your cart.")
             return redirect("core:order-summary")
         else:
@@ -424,6 +352,7 @@ def remove_from_cart(request, slug):
 
 
 @login_required
+@transaction.atomic
 def remove_single_item_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
     order_qs = Order.objects.filter(
@@ -432,18 +361,15 @@ def remove_single_item_from_cart(request, slug):
     )
     if order_qs.exists():
         order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-            else:
-                order.items.remove(order_item)
+        # the line without variations, as added by add_to_cart
+        order_item = order.items.filter(
+            item=item, variation_signature='').first()
+        if order_item is not None:
+            try:
+                order.remove_single_from_cart(order_item)
+            except ValueError as e:
+                messages.warning(request, str(e))
+                return redirect("core:order-summary")
             messages.info(request, "This item quantity was updated.")
             return redirect("core:order-summary")
         else:
@@ -456,11 +382,11 @@ def remove_single_item_from_cart(request, slug):
 
 def get_coupon(request, code):
     try:
-        coupon = Coupon.objects.get(code=code)
+        coupon = Coupon.objects.get_by_code(code)
         return coupon
     except ObjectDoesNotExist:
         messages.info(request, "This coupon does not exist")
-        return redirect("core:checkout")
+        return None
 
 
 class AddCouponView(View):
@@ -471,8 +397,17 @@ class AddCouponView(View):
                 code = form.cleaned_data.get('code')
                 order = Order.objects.get(
                     user=self.request.user, ordered=False)
-                order.coupon = get_coupon(self.request, code)
-                order.save()
+                coupon = get_coupon(self.request, code)
+                if coupon is None:
+                    return redirect("core:checkout")
+                error = coupon.get_validation_error(order.get_subtotal())
+                if error is not None:
+                    messages.info(self.request, error)
+                    return redirect("core:checkout")
+                with transaction.atomic():
+                    order.coupon = coupon
+                    order.save(update_fields=['coupon'])
+                    order.update_summary()
                 messages.success(self.request, "Successfully added coupon")
                 return redirect("core:checkout")
             except ObjectDoesNotExist:
@@ -498,7 +433,7 @@ class RequestRefundView(View):
             try:
                 order = Order.objects.get(ref_code=ref_code)
                 order.refund_requested = True
-                order.save()
+                order.save(update_fields=['refund_requested'])
 
                 # store the refund
                 refund = Refund()
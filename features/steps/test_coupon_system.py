@@ -128,29 +128,32 @@ def create_coupon_max_uses(code, max_uses, current_uses, context, db):
 @given(parsers.parse('a coupon "{code}" with discount {discount:f} is applied to my order'))
 def coupon_already_applied(code, discount, context, customer_user, db):
     """Create order with coupon already applied"""
-    order = Order.objects.create(
-        user=customer_user,
-        ordered=False,
-        ordered_date=timezone.now()
-    )
-    
-    item = Item.objects.create(
-        title='Test Product',
-        price=100.0,
-        category='S',
-        label='P',
-        slug='test-product',
-        description='Test',
-        stock_quantity=10
-    )
-    
-    order_item = OrderItem.objects.create(
-        user=customer_user,
-        item=item,
-        quantity=1,
-        ordered=False
-    )
-    order.items.add(order_item)
+    # a customer has a single open order, reuse the cart if there is one
+    order = context.get('order')
+    if order is None:
+        order = Order.objects.create(
+            user=customer_user,
+            ordered=False,
+            ordered_date=timezone.now()
+        )
+        
+        item = Item.objects.create(
+            title='Test Product',
+            price=100.0,
+            category='S',
+            label='P',
+            slug='test-product',
+            description='Test',
+            stock_quantity=10
+        )
+        
+        order_item = OrderItem.objects.create(
+            user=customer_user,
+            item=item,
+            quantity=1,
+            ordered=False
+        )
+        order.items.add(order_item)
     
     coupon = Coupon.objects.create(
         code=code,
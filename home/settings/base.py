@@ -78,8 +78,49 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
     ),
+    # prices are DecimalFields; keep sending them to the client as numbers
+    'COERCE_DECIMAL_TO_STRING': False,
 }
 
+# How long items added to a cart stay reserved, in seconds
+STOCK_RESERVATION_TTL = 15 * 60
+
+# How many coupons, and for how many seconds, each process keeps in its code
+# lookup cache; changes made elsewhere, including queryset updates, are only
+# seen once the entry expires
+COUPON_CACHE_SIZE = 10000
+COUPON_CACHE_TTL = 60
+
+# How many users' default addresses, and for how many seconds, each process
+# keeps cached for checkout; saves and deletes in other processes only reach
+# this cache once the entry expires
+ADDRESS_CACHE_SIZE = 10000
+ADDRESS_CACHE_TTL = 60
+
+# Seconds clients and proxies may reuse /api/countries/ before revalidating
+# it; the ETag makes each revalidation a 304 until the list changes
+COUNTRY_LIST_MAX_AGE = 60 * 60
+
+# The card processor behind checkout, and keyword arguments for it. Use
+# 'core.gateways.FakeGateway' with {'latency': ..., 'failure_rate': ...}
+# to run checkouts without Stripe
+PAYMENT_GATEWAY = 'core.gateways.StripeGateway'
+PAYMENT_GATEWAY_OPTIONS = {}
+
+# How many Stripe customers, and for how many seconds, each process keeps
+# cached for one-click purchasing
+STRIPE_CUSTOMER_CACHE_SIZE = 10000
+STRIPE_CUSTOMER_CACHE_TTL = 5 * 60
+
+# Queue checkouts for the process_payment_jobs worker instead of charging
+# the card inside the request
+PAYMENT_QUEUE_ENABLED = False
+
+# Seconds a worker may hold a payment job before another worker takes it
+# over, and how many times a job is claimed before it fails for good
+PAYMENT_JOB_LEASE = 5 * 60
+PAYMENT_JOB_MAX_ATTEMPTS = 3
+
 ACCOUNT_EMAIL_REQUIRED = False
 ACCOUNT_AUTHENTICATION_METHOD = 'username'
 ACCOUNT_EMAIL_VERIFICATION = 'none'
@@ -1,5 +1,7 @@
 '''Use this for development'''
 
+from corsheaders.defaults import default_headers
+
 from .base import *
 
 ALLOWED_HOSTS += ['127.0.0.1']
@@ -21,6 +23,9 @@ CORS_ORIGIN_WHITELIST = (
 # Ajout de la configuration pour CORS - MA
 CORS_ALLOW_CREDENTIALS = True
 
+# checkout retries send the same Idempotency-Key
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
+
 # Stripe
 
 STRIPE_PUBLIC_KEY = config('STRIPE_TEST_PUBLIC_KEY')
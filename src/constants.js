@@ -7,6 +7,7 @@ export const endpoint = `${localhost}${apiURL}`;
 export const productListURL = `${endpoint}/products/`;
 export const productDetailURL = id => `${endpoint}/products/${id}/`;
 export const addToCartURL = `${endpoint}/add-to-cart/`;
+export const cartBatchURL = `${endpoint}/cart/batch/`;
 export const orderSummaryURL = `${endpoint}/order-summary/`;
 export const checkoutURL = `${endpoint}/checkout/`;
 export const addCouponURL = `${endpoint}/add-coupon/`;
@@ -20,6 +21,7 @@ export const addressDeleteURL = id => `${endpoint}/addresses/${id}/delete/`;
 export const orderItemDeleteURL = id => `${endpoint}/order-items/${id}/delete/`;
 export const orderItemUpdateQuantityURL = `${endpoint}/order-item/update-quantity/`;
 export const paymentListURL = `${endpoint}/payments/`;
+export const paymentJobURL = id => `${endpoint}/payment-jobs/${id}/`;
 
 // Stripe Configuration
 export const STRIPE_PUBLISHABLE_KEY = "pk_test_51SmABDAdZOH9W0hoehmf8qu7snJnpmpFyngKhvmmYrEtP7N7VVtZKyI4zblSzBtJN6VcfaDzeRgOVTUT55LWKz3U00TiIz2JZm";
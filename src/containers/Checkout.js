@@ -24,12 +24,20 @@ import { Link, withRouter } from "react-router-dom";
 import { authAxios } from "../utils";
 import {
   checkoutURL,
+  paymentJobURL,
   orderSummaryURL,
   addCouponURL,
   addressListURL,
   STRIPE_PUBLISHABLE_KEY
 } from "../constants";
 
+const CHECKOUT_RETRIES = 2;
+
+const newIdempotencyKey = () =>
+  `${Date.now().toString(36)}-${Math.random()
+    .toString(36)
+    .slice(2)}`;
+
 const OrderPreview = props => {
   const { data } = props;
   return (
@@ -219,6 +227,37 @@ class CheckoutForm extends Component {
     this.setState({ [name]: value });
   };
 
+  postCheckout = (payload, idempotencyKey, retries) =>
+    authAxios
+      .post(checkoutURL, payload, {
+        headers: { "Idempotency-Key": idempotencyKey }
+      })
+      .catch(err => {
+        // no response (timeout, dropped connection): the server may have
+        // charged already, so resend under the same key
+        if (!err.response && retries > 0) {
+          return this.postCheckout(payload, idempotencyKey, retries - 1);
+        }
+        throw err;
+      });
+
+  pollPayment = id => {
+    authAxios
+      .get(paymentJobURL(id))
+      .then(res => {
+        if (res.data.status === "succeeded") {
+          this.setState({ loading: false, success: true });
+        } else if (["failed", "reconcile"].includes(res.data.status)) {
+          this.setState({ loading: false, error: res.data.message });
+        } else {
+          setTimeout(() => this.pollPayment(id), 1000);
+        }
+      })
+      .catch(err => {
+        this.setState({ loading: false, error: err });
+      });
+  };
+
   submit = ev => {
     ev.preventDefault();
     this.setState({ loading: true });
@@ -232,14 +271,18 @@ class CheckoutForm extends Component {
             selectedBillingAddress,
             selectedShippingAddress
           } = this.state;
-          authAxios
-            .post(checkoutURL, {
-              stripeToken: result.token.id,
-              selectedBillingAddress,
-              selectedShippingAddress
-            })
+          const payload = {
+            stripeToken: result.token.id,
+            selectedBillingAddress,
+            selectedShippingAddress
+          };
+          this.postCheckout(payload, newIdempotencyKey(), CHECKOUT_RETRIES)
             .then(res => {
-              this.setState({ loading: false, success: true });
+              if (res.status === 202) {
+                this.pollPayment(res.data.id);
+              } else {
+                this.setState({ loading: false, success: true });
+              }
             })
             .catch(err => {
               this.setState({ loading: false, error: err });
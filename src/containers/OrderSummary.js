@@ -15,8 +15,8 @@ import {
 import { connect } from "react-redux";
 import { Link, Redirect } from "react-router-dom";
 import { authAxios } from "../utils";
+import { updateCart } from "../store/actions/cart";
 import {
-  addToCartURL,
   orderSummaryURL,
   orderItemDeleteURL,
   orderItemUpdateQuantityURL
@@ -70,8 +70,8 @@ class OrderSummary extends React.Component {
   handleAddToCart = (slug, itemVariations) => {
     this.setState({ loading: true });
     const variations = this.handleFormatData(itemVariations);
-    authAxios
-      .post(addToCartURL, { slug, variations })
+    this.props
+      .updateCart([{ slug, variations, quantity: 1 }])
       .then(res => {
         this.handleFetchOrder();
         this.setState({ loading: false });
@@ -81,9 +81,10 @@ class OrderSummary extends React.Component {
       });
   };
 
-  handleRemoveQuantityFromCart = slug => {
+  handleRemoveQuantityFromCart = (slug, itemVariations) => {
+    const variations = this.handleFormatData(itemVariations);
     authAxios
-      .post(orderItemUpdateQuantityURL, { slug })
+      .post(orderItemUpdateQuantityURL, { slug, variations })
       .then(res => {
         this.handleFetchOrder();
       })
@@ -157,7 +158,10 @@ class OrderSummary extends React.Component {
                         name="minus"
                         style={{ float: "left", cursor: "pointer" }}
                         onClick={() =>
-                          this.handleRemoveQuantityFromCart(orderItem.item.slug)
+                          this.handleRemoveQuantityFromCart(
+                            orderItem.item.slug,
+                            orderItem.item_variations
+                          )
                         }
                       />
                       {orderItem.quantity}
@@ -223,4 +227,13 @@ const mapStateToProps = state => {
   };
 };
 
-export default connect(mapStateToProps)(OrderSummary);
+const mapDispatchToProps = dispatch => {
+  return {
+    updateCart: operations => dispatch(updateCart(operations))
+  };
+};
+
+export default connect(
+  mapStateToProps,
+  mapDispatchToProps
+)(OrderSummary);
@@ -20,9 +20,8 @@ import {
   Select,
   Divider
 } from "semantic-ui-react";
-import { productDetailURL, addToCartURL } from "../constants";
-import { fetchCart } from "../store/actions/cart";
-import { authAxios } from "../utils";
+import { productDetailURL } from "../constants";
+import { updateCart } from "../store/actions/cart";
 
 class ProductDetail extends React.Component {
   state = {
@@ -70,10 +69,9 @@ class ProductDetail extends React.Component {
     this.setState({ loading: true });
     const { formData } = this.state;
     const variations = this.handleFormatData(formData);
-    authAxios
-      .post(addToCartURL, { slug, variations })
+    this.props
+      .updateCart([{ slug, variations, quantity: 1 }])
       .then(res => {
-        this.props.refreshCart();
         this.setState({ loading: false });
       })
       .catch(err => {
@@ -220,7 +218,7 @@ class ProductDetail extends React.Component {
 
 const mapDispatchToProps = dispatch => {
   return {
-    refreshCart: () => dispatch(fetchCart())
+    updateCart: operations => dispatch(updateCart(operations))
   };
 };
 
@@ -11,9 +11,8 @@ import {
   Message,
   Segment
 } from "semantic-ui-react";
-import { productListURL, addToCartURL } from "../constants";
-import { fetchCart } from "../store/actions/cart";
-import { authAxios } from "../utils";
+import { productListURL } from "../constants";
+import { updateCart } from "../store/actions/cart";
 
 class ProductList extends React.Component {
   state = {
@@ -36,10 +35,9 @@ class ProductList extends React.Component {
 
   handleAddToCart = slug => {
     this.setState({ loading: true });
-    authAxios
-      .post(addToCartURL, { slug })
+    this.props
+      .updateCart([{ slug, quantity: 1 }])
       .then(res => {
-        this.props.refreshCart();
         this.setState({ loading: false });
       })
       .catch(err => {
@@ -122,7 +120,7 @@ class ProductList extends React.Component {
 
 const mapDispatchToProps = dispatch => {
   return {
-    refreshCart: () => dispatch(fetchCart())
+    updateCart: operations => dispatch(updateCart(operations))
   };
 };
 
@@ -1,6 +1,6 @@
 import { CART_START, CART_SUCCESS, CART_FAIL } from "./actionTypes";
 import { authAxios } from "../../utils";
-import { orderSummaryURL } from "../../constants";
+import { orderSummaryURL, cartBatchURL } from "../../constants";
 
 export const cartStart = () => {
   return {
@@ -35,3 +35,21 @@ export const fetchCart = () => {
       });
   };
 };
+
+// operations: [{ slug, variations, quantity }], applied in one request;
+// returns the request so callers can wait on it or handle its error
+export const updateCart = operations => {
+  return dispatch => {
+    dispatch(cartStart());
+    return authAxios
+      .post(cartBatchURL, { operations })
+      .then(res => {
+        dispatch(fetchCart());
+        return res;
+      })
+      .catch(err => {
+        dispatch(cartFail(err));
+        throw err;
+      });
+  };
+};
@@ -0,0 +1,140 @@
+"""Tests for content-hashed address reuse and the compact_addresses command"""
+from io import StringIO
+
+import pytest
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import call_command
+from django.urls import include, path
+from core.models import Address, Order, PaymentJob
+from core.views import CheckoutView
+
+# core.urls is not mounted in home.urls; the checkout view redirects into it
+urlpatterns = [path('', include('core.urls'))]
+
+LINES = {'street_address': '1 Main Street', 'apartment_address': 'Flat 2',
+         'country': 'US', 'zip': '10001'}
+
+
+def post_checkout(rf, user, **data):
+    request = rf.post('/checkout/', {'payment_option': 'S', **data})
+    request.user = user
+    request.session = {}
+    request._messages = FallbackStorage(request)
+    return CheckoutView.as_view()(request)
+
+
+@pytest.fixture
+def cart(user, test_item, create_order):
+    return create_order(user, [(test_item, 1)])
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestContentHash:
+    """Identical addresses of one type share a content hash"""
+
+    def test_ignores_case_and_spacing(self):
+        assert Address.make_content_hash('S', **LINES) == Address.make_content_hash(
+            'S', street_address=' 1  main STREET', apartment_address='flat 2',
+            country='us', zip='10001 ')
+
+    def test_type_and_lines_change_the_hash(self):
+        shipping = Address.make_content_hash('S', **LINES)
+
+        assert shipping != Address.make_content_hash('B', **LINES)
+        assert shipping != Address.make_content_hash('S', **{**LINES, 'zip': '10002'})
+
+    def test_save_stores_the_hash(self, user):
+        address = Address.objects.create(user=user, address_type='S', **LINES)
+        address.zip = '10002'
+        address.save(update_fields=['zip'])
+
+        address.refresh_from_db()
+        assert address.content_hash == Address.make_content_hash('S', **{**LINES, 'zip': '10002'})
+
+    def test_get_or_create_by_content(self, user, django_user_model):
+        first, created = Address.objects.get_or_create_by_content(user, 'S', **LINES)
+        again, created_again = Address.objects.get_or_create_by_content(
+            user, 'S', **{**LINES, 'street_address': '1 MAIN STREET'})
+        other = django_user_model.objects.create_user(username='dedup-other', password='x')
+
+        assert (created, created_again) == (True, False)
+        assert again == first
+        assert Address.objects.get_or_create_by_content(other, 'S', **LINES)[1]
+
+    def test_lookup_uses_index(self, user):
+        plan = Address.objects.filter(user=user, content_hash='x').explain()
+
+        assert 'address_user_content_idx' in plan, plan
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+@pytest.mark.urls(__name__)
+class TestCheckoutReusesAddresses:
+    """Repeated checkouts with the same address add no rows"""
+
+    def test_same_billing_address_is_stored_once(self, rf, user, cart):
+        data = {'shipping_address': LINES['street_address'], 'shipping_address2': LINES['apartment_address'],
+                'shipping_country': 'US', 'shipping_zip': LINES['zip'], 'same_billing_address': 'on'}
+
+        post_checkout(rf, user, **data)
+        post_checkout(rf, user, **data)
+
+        assert sorted(Address.objects.values_list('address_type', flat=True)) == ['B', 'S']
+        order = Order.objects.get(pk=cart.pk)
+        assert order.shipping_address.address_type == 'S'
+        assert order.billing_address.address_type == 'B'
+        assert order.billing_address.get_content() == order.shipping_address.get_content()
+
+    def test_set_default_on_a_reused_address(self, rf, user, cart):
+        existing = Address.objects.create(user=user, address_type='B', **LINES)
+
+        post_checkout(rf, user, use_default_shipping='', billing_address=LINES['street_address'],
+                      billing_address2=LINES['apartment_address'], billing_country='US',
+                      billing_zip=LINES['zip'], set_default_billing='on',
+                      shipping_address='9 Side Road', shipping_country='US', shipping_zip='1')
+
+        existing.refresh_from_db()
+        assert existing.default
+        assert Order.objects.get(pk=cart.pk).billing_address == existing
+        assert Address.objects.filter(address_type='B').count() == 1
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCompactAddresses:
+    """compact_addresses merges duplicates into the oldest row"""
+
+    def test_merges_and_repoints(self, user, cart, django_user_model):
+        keep = Address.objects.create(user=user, address_type='B', **LINES)
+        copies = [Address.objects.create(user=user, address_type='B', **LINES) for _ in range(3)]
+        copies[-1].default = True
+        copies[-1].save()
+        shipping = Address.objects.create(user=user, address_type='S', **LINES)
+        other = django_user_model.objects.create_user(username='compact-other', password='x')
+        theirs = Address.objects.create(user=other, address_type='B', **LINES)
+        cart.billing_address = copies[0]
+        cart.shipping_address = shipping
+        cart.save()
+        job = PaymentJob.objects.create(order=cart, user=user, amount_cents=100,
+                                        billing_address=copies[1])
+        out = StringIO()
+
+        call_command('compact_addresses', '--batch-size', '2', stdout=out)
+
+        assert 'Merged 3 duplicate addresses' in out.getvalue()
+        assert set(Address.objects.all()) == {keep, shipping, theirs}
+        cart.refresh_from_db()
+        job.refresh_from_db()
+        assert (cart.billing_address, cart.shipping_address) == (keep, shipping)
+        assert job.billing_address == keep
+        keep.refresh_from_db()
+        assert keep.default
+        assert Address.objects.get_defaults(user)['B'] == keep
+
+    def test_rows_without_a_hash_are_hashed_first(self, user):
+        Address.objects.bulk_create([Address(user=user, address_type='S', **LINES) for _ in range(3)])
+
+        assert Address.objects.compact() == 2
+        assert Address.objects.get().content_hash == Address.make_content_hash('S', **LINES)
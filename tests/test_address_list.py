@@ -0,0 +1,95 @@
+"""Tests for the user-scoped address list"""
+import os
+import time
+
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework import status
+from core.models import Address
+
+
+def add_addresses(users, per_user, address_type='S'):
+    Address.objects.bulk_create([
+        Address(user=user, street_address=f'{n} Bench Street', apartment_address='',
+                country='US', zip='12345', address_type=address_type, default=n == 0)
+        for user in users
+        for n in range(per_user)
+    ], batch_size=5000)
+
+
+def make_users(count, prefix):
+    User = get_user_model()
+    User.objects.bulk_create(
+        [User(username=f'{prefix}-{n}') for n in range(count)], batch_size=5000)
+    return list(User.objects.filter(username__startswith=f'{prefix}-'))
+
+
+def time_listing(client, rounds=20):
+    """Median milliseconds to list the client user's shipping addresses"""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        response = client.get('/api/addresses/?address_type=S')
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == status.HTTP_200_OK
+    return sorted(timings)[rounds // 2]
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestAddressList:
+    """Addresses are only ever listed for the requesting user"""
+
+    def test_without_type_lists_own_addresses(self, authenticated_client, test_address,
+                                              test_billing_address, django_user_model):
+        other = django_user_model.objects.create_user(username='address-other', password='x')
+        add_addresses([other], 2)
+
+        response = authenticated_client.get('/api/addresses/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [a['id'] for a in response.data] == [test_address.id, test_billing_address.id]
+
+    def test_filters_by_type(self, authenticated_client, test_address, test_billing_address):
+        response = authenticated_client.get('/api/addresses/?address_type=B')
+
+        assert [a['id'] for a in response.data] == [test_billing_address.id]
+
+    def test_requires_authentication(self, api_client):
+        response = api_client.get('/api/addresses/')
+
+        assert response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+
+    def test_cursor_pages(self, authenticated_client, user):
+        add_addresses([user], 5)
+        ids = list(Address.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+
+        first = authenticated_client.get('/api/addresses/?page_size=3')
+        second = authenticated_client.get(first.data['next'])
+
+        assert [a['id'] for a in first.data['results']] == ids[:3]
+        assert [a['id'] for a in second.data['results']] == ids[3:]
+        assert second.data['next'] is None
+
+    def test_lookup_uses_index(self, user):
+        plan = Address.objects.filter(user=user, address_type='S', default=True).explain()
+
+        assert 'address_user_type_default_idx' in plan, plan
+
+    @pytest.mark.slow
+    def test_latency_independent_of_table_size(self, api_client):
+        """Time one user's listing against a small table and a full one"""
+        rows = int(os.environ.get('ADDRESS_BENCHMARK_ROWS', 1_000_000))
+        per_user = 10
+        users = make_users(rows // per_user, 'bench')
+        api_client.force_authenticate(users[0])
+
+        add_addresses(users[:len(users) // 100], per_user)
+        small = time_listing(api_client)
+        add_addresses(users[len(users) // 100:], per_user)
+        large = time_listing(api_client)
+
+        assert Address.objects.count() == rows
+        print(f'\naddress list for one user: {small:.2f} ms with {rows // 100} rows, '
+              f'{large:.2f} ms with {rows} rows')
+        assert large < small * 3
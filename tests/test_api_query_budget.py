@@ -0,0 +1,212 @@
+"""Query budget tests: the number of SQL queries per endpoint must not grow with the data"""
+import time
+
+import pytest
+from rest_framework import status
+from core.api.serializers import ItemSerializer
+from core.models import Item, Variation, ItemVariation
+
+
+def create_items(count):
+    return Item.objects.bulk_create([
+        Item(
+            title=f'Budget Product {i}',
+            price=10.00 + i,
+            discount_price=8.00 + i if i % 2 else None,
+            category='S' if i % 2 else 'OW',
+            label='P' if i % 3 else 'D',
+            slug=f'budget-product-{i}',
+            description=f'Budget product {i}',
+            image=f'budget{i}.jpg'
+        )
+        for i in range(count)
+    ])
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestProductListQueryBudget:
+    """/api/products/ runs a constant number of queries"""
+
+    PRODUCT_LIST_BUDGET = 1
+
+    @pytest.mark.parametrize('count', [1, 10, 100])
+    def test_plain_list_budget(self, api_client, django_assert_max_num_queries, count):
+        """Unpaginated list costs one query whatever the catalog size"""
+        create_items(count)
+
+        with django_assert_max_num_queries(self.PRODUCT_LIST_BUDGET):
+            response = api_client.get('/api/products/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == count
+
+    @pytest.mark.parametrize('page_size', [1, 10, 100])
+    def test_cursor_page_budget(self, api_client, django_assert_max_num_queries, page_size):
+        """A cursor page costs one query whatever the page size"""
+        create_items(150)
+
+        with django_assert_max_num_queries(self.PRODUCT_LIST_BUDGET):
+            response = api_client.get('/api/products/', {'page_size': page_size})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == page_size
+        assert response.data['next'] is not None
+
+    def test_cursor_pages_walk_whole_catalog(self, api_client, django_assert_max_num_queries):
+        """Following next links visits every product once, in id order"""
+        create_items(25)
+
+        seen = []
+        url = '/api/products/?page_size=10'
+        while url:
+            with django_assert_max_num_queries(self.PRODUCT_LIST_BUDGET):
+                response = api_client.get(url)
+            seen.extend(product['id'] for product in response.data['results'])
+            url = response.data['next']
+
+        assert seen == sorted(Item.objects.values_list('id', flat=True))
+
+    def test_display_values_in_payload(self, api_client):
+        """Category and label are still rendered as display names"""
+        create_items(2)
+
+        response = api_client.get('/api/products/', {'page_size': 2})
+
+        product = response.data['results'][0]
+        assert product['category'] == 'Outwear'
+        assert product['label'] == 'danger'
+
+
+def create_variation_tree(item, variation_count, value_count):
+    Variation.objects.bulk_create([
+        Variation(item=item, name=f'Dimension {v}')
+        for v in range(variation_count)
+    ])
+    ItemVariation.objects.bulk_create([
+        ItemVariation(variation=variation, value=f'Value {n}')
+        for variation in Variation.objects.filter(item=item)
+        for n in range(value_count)
+    ])
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestProductDetailQueryBudget:
+    """/api/products/<pk>/ loads the whole variation tree in fixed queries"""
+
+    # item, variations, item variations
+    PRODUCT_DETAIL_BUDGET = 3
+
+    @pytest.mark.parametrize('variation_count,value_count', [(0, 0), (1, 3), (12, 12)])
+    def test_detail_budget(self, api_client, test_item, django_assert_max_num_queries,
+                           variation_count, value_count):
+        """Query count does not depend on the number of variations or values"""
+        create_variation_tree(test_item, variation_count, value_count)
+
+        with django_assert_max_num_queries(self.PRODUCT_DETAIL_BUDGET):
+            response = api_client.get(f'/api/products/{test_item.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['variations']) == variation_count
+        for variation in response.data['variations']:
+            assert len(variation['item_variations']) == value_count
+
+    def test_detail_payload_shape(self, api_client, test_item):
+        """Nested variation payload keeps its original fields"""
+        size = Variation.objects.create(item=test_item, name='Size')
+        small = ItemVariation.objects.create(variation=size, value='Small')
+
+        response = api_client.get(f'/api/products/{test_item.id}/')
+
+        assert response.data['category'] == 'Shirt'
+        assert response.data['label'] == 'primary'
+        variation = response.data['variations'][0]
+        assert variation['id'] == size.id
+        assert variation['name'] == 'Size'
+        assert variation['item_variations'][0]['id'] == small.id
+        assert variation['item_variations'][0]['value'] == 'Small'
+        assert 'attachment' in variation['item_variations'][0]
+
+    @pytest.mark.slow
+    @pytest.mark.parametrize('variation_count,value_count', [(10, 10), (40, 25), (80, 50)])
+    def test_detail_latency_benchmark(self, api_client, test_item, variation_count, value_count):
+        """Report detail latency for items with dozens of variations and values"""
+        create_variation_tree(test_item, variation_count, value_count)
+        url = f'/api/products/{test_item.id}/'
+        api_client.get(url)
+
+        rounds = 20
+        started = time.perf_counter()
+        for _ in range(rounds):
+            response = api_client.get(url)
+        elapsed = (time.perf_counter() - started) / rounds
+
+        assert response.status_code == status.HTTP_200_OK
+        print(f'\n{variation_count} variations x {value_count} values: '
+              f'{elapsed * 1000:.2f} ms per request')
+
+
+@pytest.fixture
+def variation_cart(user, create_item, create_order):
+    """variation_cart(line_count, item_count=3) makes an order whose lines each pick two variations"""
+    def create(line_count, item_count=3):
+        items = []
+        for i in range(item_count):
+            item = create_item(
+                f'cart-product-{i}',
+                title=f'Cart Product {i}',
+                price=20.00 + i,
+                discount_price=15.00 + i if i % 2 else None,
+                description=f'Cart product {i}',
+                image=f'cart{i}.jpg'
+            )
+            create_variation_tree(item, 2, line_count)
+            items.append(item)
+
+        order = create_order(user, [(items[n % item_count], n + 1) for n in range(line_count)])
+        for n, order_item in enumerate(order.items.order_by('pk')):
+            order_item.item_variations.add(*(
+                variation.itemvariation_set.all()[n] for variation in order_item.item.variation_set.all()
+            ))
+        return order
+    return create
+
+
+@pytest.mark.api
+class TestOrderSummaryQueryBudget:
+    """/api/order-summary/ loads the cart graph in fixed queries"""
+
+    # order + coupon, order items + items, item variations + variations
+    ORDER_SUMMARY_BUDGET = 3
+
+    @pytest.mark.parametrize('line_count', [1, 5, 25])
+    def test_order_summary_budget(self, authenticated_client, variation_cart, test_coupon,
+                                  django_assert_max_num_queries, line_count):
+        """Query count does not depend on the number of cart lines"""
+        order = variation_cart(line_count)
+        order.coupon = test_coupon
+        order.save()
+
+        with django_assert_max_num_queries(self.ORDER_SUMMARY_BUDGET):
+            response = authenticated_client.get('/api/order-summary/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['order_items']) == line_count
+        assert response.data['total'] == order.get_total()
+        assert response.data['coupon']['code'] == 'TESTCODE'
+
+    def test_order_summary_payload(self, authenticated_client, variation_cart):
+        """Embedded item payloads match the item serializer output"""
+        order = variation_cart(4, item_count=2)
+
+        response = authenticated_client.get('/api/order-summary/')
+
+        for line, order_item in zip(response.data['order_items'], order.items.all()):
+            expected_item = ItemSerializer(order_item.item).data
+            assert line['item'] == expected_item
+            assert line['quantity'] == order_item.quantity
+            assert line['final_price'] == order_item.get_final_price()
+            assert len(line['item_variations']) == 2
+            for value in line['item_variations']:
+                assert value['variation']['item'] == expected_item
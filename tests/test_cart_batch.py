@@ -0,0 +1,160 @@
+"""Tests for the batch cart mutation endpoint"""
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework import status
+from core.models import Item, ItemVariation, Order, OrderItem, StockReservation, Variation
+
+URL = '/api/cart/batch/'
+
+
+@pytest.fixture
+def create_items(create_item):
+    """create_items(count) makes items batch-0, batch-1, ... priced 10, 11, ..."""
+    def create(count, stock=50):
+        return [create_item(f'batch-{n}', stock, title=f'Batch {n}', price=10 + n)
+                for n in range(count)]
+    return create
+
+
+def post(client, *operations):
+    return client.post(URL, {'operations': list(operations)}, format='json')
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCartBatch:
+    """POST /api/cart/batch/ applies many changes in one request"""
+
+    def test_fills_cart_and_returns_summary(self, create_items, authenticated_client, user):
+        items = create_items(3)
+
+        response = post(
+            authenticated_client,
+            {'slug': 'batch-0', 'quantity': 2},
+            {'slug': 'batch-1'},
+            {'slug': 'batch-2', 'quantity': 3},
+            {'slug': 'batch-0', 'quantity': 1},
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['item_count'] == 3
+        assert str(response.data['subtotal']) == '77.00'
+        order = Order.objects.get(user=user, ordered=False)
+        quantities = dict(order.items.values_list('item__slug', 'quantity'))
+        assert quantities == {'batch-0': 3, 'batch-1': 1, 'batch-2': 3}
+        assert dict(StockReservation.objects.values_list('item_id', 'quantity')) == {
+            items[0].pk: 3, items[1].pk: 1, items[2].pk: 3}
+
+    def test_updates_and_removes_existing_lines(self, create_items, authenticated_client, user):
+        create_items(2)
+        post(authenticated_client, {'slug': 'batch-0', 'quantity': 4}, {'slug': 'batch-1'})
+
+        response = post(
+            authenticated_client,
+            {'slug': 'batch-0', 'quantity': -1},
+            {'slug': 'batch-1', 'quantity': -1},
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        line = OrderItem.objects.get(user=user, ordered=False)
+        assert (line.item.slug, line.quantity) == ('batch-0', 3)
+        assert StockReservation.objects.get().quantity == 3
+        assert response.data['item_count'] == 1
+
+    def test_variations_get_their_own_lines(self, create_items, authenticated_client, user):
+        item = create_items(1)[0]
+        size = Variation.objects.create(item=item, name='Size')
+        small = ItemVariation.objects.create(variation=size, value='S').pk
+        large = ItemVariation.objects.create(variation=size, value='L').pk
+
+        post(
+            authenticated_client,
+            {'slug': 'batch-0', 'variations': [small], 'quantity': 2},
+            {'slug': 'batch-0', 'variations': [large]},
+        )
+        post(authenticated_client, {'slug': 'batch-0', 'variations': [small]})
+
+        lines = {
+            tuple(line.item_variations.values_list('pk', flat=True)): line.quantity
+            for line in OrderItem.objects.filter(user=user, ordered=False)
+        }
+        assert lines == {(small,): 3, (large,): 1}
+
+    def test_leaves_lines_outside_the_cart_alone(self, create_items, authenticated_client, user):
+        create_items(1)
+        orphan = OrderItem.objects.create(user=user, item=Item.objects.get(), quantity=5)
+
+        response = post(authenticated_client, {'slug': 'batch-0', 'quantity': 2})
+
+        assert response.status_code == status.HTTP_200_OK
+        order = Order.objects.get(user=user, ordered=False)
+        line = order.items.get()
+        assert line != orphan
+        assert line.quantity == 2
+        orphan.refresh_from_db()
+        assert orphan.quantity == 5
+        assert StockReservation.objects.get().quantity == 2
+
+    @pytest.mark.parametrize('operation,message', [
+        ({'slug': 'missing'}, 'Unknown items: missing'),
+        ({'slug': 'batch-0', 'quantity': 51}, 'Insufficient stock available for Batch 0. Only 50 in stock.'),
+    ])
+    def test_failure_leaves_cart_untouched(self, create_items, authenticated_client, user, operation, message):
+        create_items(2)
+        post(authenticated_client, {'slug': 'batch-1'})
+
+        response = post(authenticated_client, {'slug': 'batch-1', 'quantity': 5}, operation)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == message
+        assert OrderItem.objects.get(user=user).quantity == 1
+
+    @pytest.mark.parametrize('expired,taken,status_code', [
+        (False, 2, status.HTTP_200_OK),
+        (True, 4, status.HTTP_400_BAD_REQUEST),
+    ])
+    def test_decrement_holds_only_what_is_left(self, create_items, create_cart, authenticated_client,
+                                               expired, taken, status_code):
+        """A line is held again for its whole new quantity, less its own active hold"""
+        item = create_items(1, stock=6)[0]
+        post(authenticated_client, {'slug': 'batch-0', 'quantity': 4})
+        if expired:
+            StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        create_cart(get_user_model().objects.create_user(username='other'), [(item, taken)])
+
+        response = post(authenticated_client, {'slug': 'batch-0', 'quantity': -1})
+
+        assert response.status_code == status_code
+        assert sum(StockReservation.objects.active().values_list('quantity', flat=True)) <= 6
+        if expired:
+            assert response.data['message'] == 'Insufficient stock available for Batch 0. Only 2 in stock.'
+
+    def test_rejects_malformed_operations(self, create_items, authenticated_client):
+        create_items(1)
+
+        assert post(authenticated_client).status_code == status.HTTP_400_BAD_REQUEST
+        assert post(authenticated_client, {'slug': 'batch-0', 'quantity': 0}).status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_query_count_does_not_grow_with_cart(self, create_items, authenticated_client, django_assert_max_num_queries):
+        """Filling 10 or 40 lines costs the same number of queries"""
+        create_items(40)
+        budget = 22
+
+        with django_assert_max_num_queries(budget):
+            response = post(authenticated_client, *[
+                {'slug': f'batch-{n}', 'quantity': 2} for n in range(10)])
+        assert response.status_code == status.HTTP_200_OK
+
+        with django_assert_max_num_queries(budget):
+            response = post(authenticated_client, *[
+                {'slug': f'batch-{n}', 'quantity': 1} for n in range(40)])
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['item_count'] == 40
+
+    def test_requires_login(self, api_client):
+        response = post(api_client, {'slug': 'batch-0'})
+
+        assert response.status_code in [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN]
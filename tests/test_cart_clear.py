@@ -0,0 +1,85 @@
+"""Tests for the set-based Order.clear_cart"""
+import math
+import os
+import time
+
+import pytest
+from django.utils import timezone
+from core.models import Item, ItemVariation, Order, OrderItem, StockReservation, Variation
+
+
+def fill_cart(order, lines):
+    """An order with ``lines`` lines, each with a variation and a stock hold"""
+    Item.objects.bulk_create([
+        Item(title=f'Clear {n}', price=5, category='S', label='P',
+             slug=f'clear-{n}', description='Test', image='test.jpg',
+             stock_quantity=10)
+        for n in range(lines)
+    ])
+    items = list(Item.objects.filter(slug__startswith='clear-'))
+    Variation.objects.bulk_create([Variation(item=item, name='Size') for item in items])
+    ItemVariation.objects.bulk_create([
+        ItemVariation(variation=variation, value='M')
+        for variation in Variation.objects.filter(item__in=items)
+    ])
+    values = dict(ItemVariation.objects.values_list('variation__item_id', 'pk'))
+    order.apply_cart_operations([
+        {'slug': item.slug, 'variations': [values[item.pk]], 'quantity': 1}
+        for item in items
+    ])
+    return items
+
+
+@pytest.fixture
+def order(user):
+    return Order.objects.create(user=user, ordered_date=timezone.now())
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestClearCart:
+    """clear_cart removes lines and everything hanging off them"""
+
+    def test_removes_lines_links_and_holds(self, order):
+        fill_cart(order, 3)
+        Through = OrderItem.item_variations.through
+        assert Through.objects.count() == 3
+
+        order.clear_cart()
+
+        assert not OrderItem.objects.exists()
+        assert not Through.objects.exists()
+        assert not StockReservation.objects.exists()
+        assert not order.items.exists()
+        assert (order.item_count, order.subtotal_cents) == (0, 0)
+
+    def test_placed_orders_are_untouched(self, order, user, test_item):
+        placed = Order.objects.create(user=user, ordered=True, ordered_date=timezone.now())
+        placed.items.add(OrderItem.objects.create(user=user, item=test_item, ordered=True))
+        fill_cart(order, 2)
+
+        order.clear_cart()
+
+        assert list(OrderItem.objects.all()) == list(placed.items.all())
+
+    @pytest.mark.parametrize('lines', [1, 300])
+    def test_set_based_statements(self, order, lines, django_assert_num_queries):
+        """The line reads, three link DELETEs, the summary aggregate and
+        UPDATE and a savepoint, plus one DELETE per hundred lines"""
+        fill_cart(order, lines)
+
+        with django_assert_num_queries(9 + math.ceil(lines / 100)):
+            order.clear_cart()
+
+    @pytest.mark.slow
+    def test_clear_large_carts(self, order):
+        """Time clearing carts of hundreds of variation lines"""
+        lines = int(os.environ.get('CART_CLEAR_LINES', 500))
+        fill_cart(order, lines)
+
+        started = time.perf_counter()
+        order.clear_cart()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        assert not OrderItem.objects.exists()
+        print(f'\nclear_cart of {lines} lines: {elapsed_ms:.1f} ms')
@@ -0,0 +1,107 @@
+"""Tests for the open cart indexes and the one-open-order constraint"""
+import os
+import time
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from core.models import Item, Order, OrderItem
+
+User = get_user_model()
+
+CART_INDEXES = ('order_user_ordered_idx', 'order_one_open_per_user')
+
+
+def open_order_plan(user):
+    return Order.objects.filter(user=user, ordered=False).explain()
+
+
+def open_line_plan(user, item):
+    return OrderItem.objects.filter(user=user, ordered=False, item=item).explain()
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestOneOpenOrderPerUser:
+    """A user has at most one open order"""
+
+    def test_second_open_order_is_refused(self, user):
+        """The partial unique constraint rejects a second cart"""
+        Order.objects.create(user=user, ordered_date=timezone.now())
+
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=user, ordered_date=timezone.now())
+
+    def test_completed_orders_are_unrestricted(self, user):
+        """Any number of placed orders can sit next to the cart"""
+        for _ in range(3):
+            Order.objects.create(user=user, ordered=True, ordered_date=timezone.now())
+        Order.objects.create(user=user, ordered_date=timezone.now())
+
+        assert Order.objects.filter(user=user).count() == 4
+
+    def test_get_or_create_cart_reuses_open_order(self, user):
+        """The cart is created once and then returned"""
+        order, created = Order.objects.get_or_create_cart(user)
+        again, created_again = Order.objects.get_or_create_cart(user)
+
+        assert created and not created_again
+        assert again == order
+        assert Order.objects.open_cart(user) == order
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCartIndexes:
+    """Cart lookups are answered from the composite indexes"""
+
+    def test_open_order_lookup_uses_index(self, user):
+        """(user, ordered) lookups do not scan the order table"""
+        plan = open_order_plan(user)
+
+        assert any(name in plan for name in CART_INDEXES), plan
+
+    def test_open_line_lookup_uses_index(self, user, test_item):
+        """(user, ordered, item) lookups use the order item index"""
+        plan = open_line_plan(user, test_item)
+
+        assert 'orderitem_user_open_line_idx' in plan, plan
+
+    @pytest.mark.slow
+    def test_plans_on_million_row_dataset(self, user, test_item):
+        """Seed a million orders and lines and check plans and latency"""
+        rows = int(os.environ.get('CART_BENCHMARK_ROWS', 1000000))
+        users = rows // 10
+        User.objects.bulk_create(
+            [User(username=f'cart-bench-{n}') for n in range(users)], batch_size=5000)
+        user_ids = list(User.objects.exclude(pk=user.pk).values_list('pk', flat=True))
+        items = [test_item] + [
+            Item.objects.create(title=f'Bench {n}', price=1, category='S', label='P',
+                                slug=f'cart-bench-{n}', description='Bench', image='b.jpg')
+            for n in range(9)
+        ]
+        now = timezone.now()
+        # every seeded user has placed orders and one open cart
+        Order.objects.bulk_create(
+            [Order(user_id=user_ids[n % users], ordered=n >= users, ordered_date=now)
+             for n in range(rows)], batch_size=5000)
+        OrderItem.objects.bulk_create(
+            [OrderItem(user_id=user_ids[n % users], item=items[n % len(items)],
+                       ordered=n >= users) for n in range(rows)], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        order_plan = open_order_plan(user_ids[-1])
+        line_plan = open_line_plan(user_ids[-1], test_item)
+
+        started = time.perf_counter()
+        for user_id in user_ids[:1000]:
+            Order.objects.filter(user_id=user_id, ordered=False).first()
+            OrderItem.objects.filter(user_id=user_id, ordered=False, item=test_item).exists()
+        lookup_us = (time.perf_counter() - started) / 1000 * 1e6
+
+        assert any(name in order_plan for name in CART_INDEXES), order_plan
+        assert 'orderitem_user_open_line_idx' in line_plan, line_plan
+        print(f'\n{rows} orders and lines: cart + line lookup {lookup_us:.0f} us\n'
+              f'{order_plan}\n{line_plan}')
@@ -0,0 +1,130 @@
+"""Tests for the memoized single-query cart summary"""
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.template import Context, Template
+from django.utils import timezone
+from rest_framework import status
+from core.models import Coupon, Item, Order, OrderItem
+
+User = get_user_model()
+
+
+@pytest.fixture
+def cart(user):
+    """An open order with two lines worth 44.98 + 3 x 10.00"""
+    order = Order.objects.create(user=user, ordered_date=timezone.now())
+    shirt = Item.objects.create(
+        title='Summary Shirt', price=29.99, discount_price=22.49, category='S',
+        label='P', slug='summary-shirt', description='Test', image='test.jpg')
+    hat = Item.objects.create(
+        title='Summary Hat', price=10.00, category='S', label='P',
+        slug='summary-hat', description='Test', image='test.jpg')
+    order.items.add(
+        OrderItem.objects.create(user=user, item=shirt, quantity=2),
+        OrderItem.objects.create(user=user, item=hat, quantity=3),
+    )
+    order.update_summary()
+    return order
+
+
+def fresh_user(user):
+    """A new instance, as Django builds for each request"""
+    return User.objects.get(pk=user.pk)
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCartSummary:
+    """Order.objects.cart_summary counts and totals the cart in one query"""
+
+    def test_summary_is_one_query(self, user, cart, django_assert_num_queries):
+        """Count, subtotal and coupon total come from one single-row query"""
+        cart.coupon = Coupon.objects.create(
+            code='SUMMARY10', amount=0, discount_type='percentage', discount_value=10)
+        cart.save()
+        cart.update_summary()
+        user = fresh_user(user)
+
+        with django_assert_num_queries(1):
+            summary = Order.objects.cart_summary(user)
+
+        assert summary == {
+            'item_count': 2,
+            'subtotal': Decimal('74.98'),
+            'total': Decimal('67.48'),
+        }
+
+    def test_summary_is_memoized_per_user_instance(self, user, cart, django_assert_num_queries):
+        """Repeated uses within a request never query again"""
+        user = fresh_user(user)
+        Order.objects.cart_summary(user)
+
+        with django_assert_num_queries(0):
+            for _ in range(5):
+                Order.objects.cart_summary(user)
+
+    def test_changing_the_cart_makes_the_memo_stale(self, user, cart):
+        """A cart changed after the summary was read is read again"""
+        user = fresh_user(user)
+        Order.objects.cart_summary(user)
+
+        cart.items.first().delete()
+        cart.update_summary()
+
+        assert Order.objects.cart_summary(user)['item_count'] == 1
+
+    def test_empty_summaries(self, user, django_assert_num_queries):
+        """No cart, or no user, gives a zero summary"""
+        assert Order.objects.cart_summary(fresh_user(user))['item_count'] == 0
+
+        with django_assert_num_queries(0):
+            summary = Order.objects.cart_summary(AnonymousUser())
+
+        assert summary['total'] == Decimal('0.00')
+
+    def test_template_filters_share_one_query(self, user, cart, django_assert_num_queries):
+        """A page header using both filters repeatedly costs one query"""
+        template = Template(
+            '{% load cart_template_tags %}'
+            '{{ user|cart_item_count }} {{ user|cart_total }} {{ user|cart_item_count }}')
+        user = fresh_user(user)
+
+        with django_assert_num_queries(1):
+            rendered = template.render(Context({'user': user}))
+
+        assert rendered == '2 74.98 2'
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCartSummaryAPI:
+    """GET /api/cart-summary/"""
+
+    def test_cart_summary(self, authenticated_client, cart):
+        response = authenticated_client.get('/api/cart-summary/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {
+            'item_count': 2,
+            'subtotal': Decimal('74.98'),
+            'total': Decimal('74.98'),
+        }
+
+    def test_cart_summary_follows_cart_changes(self, authenticated_client, cart):
+        """The client keeps one user instance across requests"""
+        authenticated_client.get('/api/cart-summary/')
+
+        authenticated_client.post('/api/cart/batch/', {
+            'operations': [{'slug': 'summary-hat', 'quantity': -3}]}, format='json')
+        response = authenticated_client.get('/api/cart-summary/')
+
+        assert response.data['item_count'] == 1
+        assert response.data['subtotal'] == Decimal('44.98')
+
+    def test_cart_summary_requires_login(self, api_client):
+        response = api_client.get('/api/cart-summary/')
+
+        assert response.status_code in [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN]
@@ -0,0 +1,77 @@
+"""Tests for the precomputed country list response"""
+import gzip
+import json
+from unittest.mock import patch
+
+import pytest
+from django_countries import countries
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+
+@pytest.mark.api
+class TestCountryList:
+    """/api/countries/ serves prebuilt bytes that clients revalidate"""
+
+    def test_body_is_the_country_list(self, api_client):
+        response = api_client.get('/api/countries/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/json'
+        assert response.content == JSONRenderer().render(countries)
+        assert json.loads(response.content)['US'] == 'United States of America'
+
+    def test_gzip_when_accepted(self, api_client):
+        response = api_client.get('/api/countries/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        assert response['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.content) == JSONRenderer().render(countries)
+        assert len(response.content) < len(gzip.decompress(response.content)) / 2
+        assert 'Accept-Encoding' in response['Vary']
+
+    @pytest.mark.parametrize('accept_encoding,gzipped', [
+        ('gzip;q=0.5, identity', True),
+        ('*', True),
+        ('gzip;q=0, deflate', False),
+        ('gzip; q=0.0', False),
+        ('*;q=0', False),
+        ('*, gzip;q=0', False),
+        ('x-gzipped', False),
+    ])
+    def test_gzip_honours_q_values(self, api_client, accept_encoding, gzipped):
+        response = api_client.get('/api/countries/', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+        assert (response.get('Content-Encoding') == 'gzip') is gzipped
+
+    def test_cache_headers(self, api_client, settings):
+        settings.COUNTRY_LIST_MAX_AGE = 600
+        plain = api_client.get('/api/countries/')
+        gzipped = api_client.get('/api/countries/', HTTP_ACCEPT_ENCODING='gzip')
+
+        assert plain['Cache-Control'] == 'public, max-age=600'
+        assert plain['ETag'].startswith('"') and plain['ETag'] != gzipped['ETag']
+
+    def test_matching_etag_is_not_modified(self, api_client):
+        etag = api_client.get('/api/countries/')['ETag']
+
+        response = api_client.get('/api/countries/', HTTP_IF_NONE_MATCH=f'"stale", {etag}')
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b''
+        assert response['ETag'] == etag
+
+    def test_other_encodings_etag_is_sent_again(self, api_client):
+        etag = api_client.get('/api/countries/')['ETag']
+
+        response = api_client.get('/api/countries/', HTTP_IF_NONE_MATCH=etag,
+                                  HTTP_ACCEPT_ENCODING='gzip')
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_rendered_once(self, api_client):
+        api_client.get('/api/countries/')
+
+        with patch.object(JSONRenderer, 'render') as render:
+            api_client.get('/api/countries/')
+
+        render.assert_not_called()
@@ -0,0 +1,108 @@
+"""Tests for bulk coupon generation"""
+import os
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from core.models import COUPON_CODE_ALPHABET, Coupon
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestGenerateCoupons:
+    """Coupon.objects.generate creates unique codes in chunks"""
+
+    def test_generates_unique_codes(self):
+        """Every code is new, prefixed and drawn from the alphabet"""
+        codes = Coupon.objects.generate(
+            250, prefix='sale', length=8, batch_size=100,
+            discount_type='percentage', discount_value=15, max_uses=1)
+
+        assert len(codes) == len(set(codes)) == 250
+        assert Coupon.objects.count() == 250
+        for code in codes:
+            assert code.startswith('SALE')
+            assert len(code) == 12
+            assert set(code[4:]) <= set(COUPON_CODE_ALPHABET)
+        coupon = Coupon.objects.get_by_code(codes[0])
+        assert coupon.discount_type == 'percentage'
+        assert coupon.discount_value == 15
+        assert coupon.max_uses == 1
+
+    def test_inserts_in_chunks(self, django_assert_num_queries):
+        """One collision check and one INSERT per chunk"""
+        with django_assert_num_queries(3 * 2):
+            Coupon.objects.generate(30, batch_size=10, discount_value=5)
+
+    def test_redraws_existing_codes(self, monkeypatch):
+        """Codes already in the table are drawn again, not inserted"""
+        Coupon.objects.create(code='TAKEN', amount=0)
+        draws = iter(['TAKEN', 'FRESH', 'NEW'])
+        monkeypatch.setattr('core.models.get_random_string', lambda *args: next(draws))
+
+        codes = Coupon.objects.generate(2, length=5, discount_value=5)
+
+        assert sorted(codes) == ['FRESH', 'NEW']
+        assert Coupon.objects.count() == 3
+
+    def test_code_must_fit_column(self):
+        """Prefix and random part together fit the code column"""
+        with pytest.raises(ValueError):
+            Coupon.objects.generate(1, prefix='SPRINGSALE', length=10)
+
+    def test_code_space_must_be_large_enough(self):
+        """Too few random characters for the count are refused"""
+        with pytest.raises(ValueError):
+            Coupon.objects.generate(1000, length=2)
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestGenerateCouponsCommand:
+    """The generate_coupons management command"""
+
+    def test_command_creates_coupons(self, tmp_path):
+        """Options map onto the coupons and codes can be written out"""
+        output = tmp_path / 'codes.txt'
+        out = StringIO()
+
+        call_command(
+            'generate_coupons', '50',
+            '--discount-type', 'fixed', '--discount-value', '7.50',
+            '--minimum-order-amount', '20', '--max-uses', '3',
+            '--expiry-date', '2030-01-31', '--prefix', 'WIN',
+            '--output', str(output), stdout=out)
+
+        codes = output.read_text().split()
+        assert len(codes) == 50
+        assert 'Generated 50 coupons' in out.getvalue()
+        assert 'codes/sec' in out.getvalue()
+        coupon = Coupon.objects.get(code=codes[0])
+        assert coupon.discount_value == Decimal('7.50')
+        assert coupon.minimum_order_amount == 20
+        assert coupon.max_uses == 3
+        assert timezone.localtime(coupon.expiry_date).date().isoformat() == '2030-01-31'
+
+    def test_command_rejects_oversized_codes(self):
+        """Invalid code settings are reported as command errors"""
+        with pytest.raises(CommandError):
+            call_command('generate_coupons', '1', '--discount-value', '5',
+                         '--prefix', 'TOOLONGPREFIX', stdout=StringIO())
+        assert not Coupon.objects.exists()
+
+    @pytest.mark.slow
+    def test_generation_throughput(self):
+        """Report codes/sec for a campaign-sized batch"""
+        count = int(os.environ.get('COUPON_GENERATION_COUNT', 100000))
+        out = StringIO()
+
+        call_command('generate_coupons', str(count), '--discount-value', '5',
+                     '--expiry-date', (timezone.now() + timedelta(days=30)).date().isoformat(),
+                     stdout=out)
+
+        assert Coupon.objects.count() == count
+        print('\n' + out.getvalue().strip())
@@ -0,0 +1,189 @@
+"""Tests for the indexed, cached coupon code lookup"""
+import os
+import time
+from datetime import timedelta
+
+import pytest
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.utils import timezone
+from rest_framework import status
+from core import cache
+from core.models import Coupon, Order, coupon_cache
+
+
+def create_coupon(code='LOOKUP10', **kwargs):
+    kwargs.setdefault('discount_type', 'percentage')
+    kwargs.setdefault('discount_value', 10)
+    return Coupon.objects.create(code=code, amount=0, **kwargs)
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCouponCode:
+    """Codes are unique and stored upper-cased"""
+
+    def test_code_is_normalized_on_save(self):
+        """Whitespace is stripped and the code upper-cased"""
+        coupon = create_coupon(code='  summer10 ')
+
+        coupon.refresh_from_db()
+        assert coupon.code == 'SUMMER10'
+
+    def test_code_is_unique_ignoring_case(self):
+        """Two coupons cannot share a code in any case"""
+        create_coupon(code='SUMMER10')
+
+        with pytest.raises(IntegrityError):
+            create_coupon(code='summer10')
+
+    def test_lookup_uses_code_index(self):
+        """The code lookup is an index search, not a table scan"""
+        plan = Coupon.objects.filter(code='SUMMER10').explain()
+
+        if connection.vendor == 'sqlite':
+            assert 'USING INDEX' in plan
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCouponCache:
+    """get_by_code serves repeat lookups from the in-process cache"""
+
+    def test_repeat_lookup_is_free(self, django_assert_num_queries):
+        """Only the first lookup of a code reads the database"""
+        coupon = create_coupon()
+
+        with django_assert_num_queries(1):
+            first = Coupon.objects.get_by_code('lookup10')
+            second = Coupon.objects.get_by_code('LOOKUP10 ')
+
+        assert first == second == coupon
+        assert second.discount_value == 10
+        assert not second._state.adding
+
+    def test_unknown_code_raises(self):
+        """Unknown codes raise DoesNotExist and are not cached"""
+        with pytest.raises(Coupon.DoesNotExist):
+            Coupon.objects.get_by_code('MISSING')
+
+        assert 'MISSING' not in coupon_cache
+
+    def test_save_invalidates(self):
+        """Saving a coupon drops its cached copy"""
+        coupon = create_coupon()
+        Coupon.objects.get_by_code('LOOKUP10')
+
+        coupon.discount_value = 25
+        coupon.save()
+
+        assert Coupon.objects.get_by_code('LOOKUP10').discount_value == 25
+
+    def test_rename_invalidates_old_code(self):
+        """The old code stops resolving once a coupon is renamed"""
+        Coupon.objects.get_by_code(create_coupon().code)
+        coupon = Coupon.objects.get(code='LOOKUP10')
+
+        coupon.code = 'RENAMED'
+        coupon.save()
+
+        with pytest.raises(Coupon.DoesNotExist):
+            Coupon.objects.get_by_code('LOOKUP10')
+
+    def test_delete_invalidates(self):
+        """A deleted coupon is no longer served"""
+        coupon = create_coupon()
+        Coupon.objects.get_by_code('LOOKUP10')
+
+        coupon.delete()
+
+        with pytest.raises(Coupon.DoesNotExist):
+            Coupon.objects.get_by_code('LOOKUP10')
+
+    def test_entries_expire(self, monkeypatch):
+        """Queryset updates send no signal, so they show once the entry expires"""
+        now = [100.0]
+        monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+        coupon = create_coupon()
+        Coupon.objects.get_by_code('LOOKUP10')
+        Coupon.objects.filter(pk=coupon.pk).update(discount_value=25)
+
+        assert Coupon.objects.get_by_code('LOOKUP10').discount_value == 10
+        now[0] += settings.COUPON_CACHE_TTL
+        assert Coupon.objects.get_by_code('LOOKUP10').discount_value == 25
+
+    def test_redeem_invalidates(self):
+        """Usage counted by redeem() is visible to the next lookup"""
+        coupon = create_coupon(max_uses=1)
+        assert Coupon.objects.get_by_code('LOOKUP10').can_be_used()
+
+        coupon.redeem()
+
+        assert not Coupon.objects.get_by_code('LOOKUP10').can_be_used()
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestApplyCoupon:
+    """Applying a coupon checks its validity first"""
+
+    @pytest.fixture
+    def order(self, user, test_item, create_order):
+        return create_order(user, [(test_item, 1)])
+
+    def apply(self, client, code):
+        return client.post('/api/add-coupon/', {'code': code}, format='json')
+
+    def test_code_is_case_insensitive(self, authenticated_client, order):
+        """Customers can type the code in any case"""
+        coupon = create_coupon()
+
+        response = self.apply(authenticated_client, 'lookup10')
+
+        assert response.status_code == status.HTTP_200_OK
+        order.refresh_from_db()
+        assert order.coupon == coupon
+
+    @pytest.mark.parametrize('kwargs,message', [
+        ({'expiry_date': timezone.now() - timedelta(days=1)}, 'Coupon has expired'),
+        ({'max_uses': 1, 'current_uses': 1}, 'Coupon has reached maximum uses'),
+        ({'minimum_order_amount': 1000}, 'Order does not meet minimum amount'),
+    ])
+    def test_invalid_coupon_is_refused(self, authenticated_client, order, kwargs, message):
+        """Expired, used up or below-minimum coupons are not applied"""
+        create_coupon(**kwargs)
+
+        response = self.apply(authenticated_client, 'LOOKUP10')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == message
+        order.refresh_from_db()
+        assert order.coupon is None
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCouponLookupBenchmark:
+
+    @pytest.mark.slow
+    def test_lookup_with_many_coupons(self):
+        """Report cold and cached lookup latency on a large coupon table"""
+        rows = int(os.environ.get('COUPON_BENCHMARK_ROWS', 500000))
+        Coupon.objects.bulk_create(
+            [Coupon(code=f'BENCH{n:09d}', amount=0) for n in range(rows)],
+            batch_size=5000)
+        codes = [f'BENCH{n:09d}' for n in range(0, rows, max(rows // 1000, 1))]
+
+        started = time.perf_counter()
+        for code in codes:
+            Coupon.objects.get_by_code(code)
+        cold_us = (time.perf_counter() - started) / len(codes) * 1e6
+
+        started = time.perf_counter()
+        for code in codes:
+            Coupon.objects.get_by_code(code)
+        cached_us = (time.perf_counter() - started) / len(codes) * 1e6
+
+        assert cached_us < cold_us
+        print(f'\n{rows} coupons: indexed lookup {cold_us:.0f} us, '
+              f'cached lookup {cached_us:.0f} us')
@@ -0,0 +1,215 @@
+"""Tests for atomic coupon redemption"""
+import os
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+import stripe
+from rest_framework import status
+from django.utils import timezone
+from core.models import Coupon
+
+
+def create_coupon(code='REDEEM', max_uses=None, **kwargs):
+    return Coupon.objects.create(
+        code=code, amount=0, discount_type='percentage', discount_value=10,
+        max_uses=max_uses, **kwargs)
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestCouponRedeem:
+    """Coupon.redeem is a conditional UPDATE"""
+
+    def test_redeem_is_one_update(self, django_assert_num_queries):
+        """Redemption is one UPDATE plus the refresh of the counter"""
+        coupon = create_coupon(max_uses=2)
+
+        with django_assert_num_queries(2):
+            assert coupon.redeem() is True
+
+        assert coupon.current_uses == 1
+
+    def test_redeem_stops_at_limit(self):
+        """Once max_uses is reached redemption fails without writing"""
+        coupon = create_coupon(max_uses=2)
+
+        assert coupon.redeem() is True
+        assert coupon.redeem() is True
+        assert coupon.redeem() is False
+
+        coupon.refresh_from_db()
+        assert coupon.current_uses == 2
+
+    def test_redeem_ignores_stale_instance(self):
+        """The limit is checked against the database, not the instance"""
+        coupon = create_coupon(max_uses=1)
+        stale = Coupon.objects.get(pk=coupon.pk)
+        coupon.redeem()
+
+        assert stale.current_uses == 0
+        assert stale.redeem() is False
+
+    def test_unlimited_coupon(self):
+        """A coupon without max_uses can always be redeemed"""
+        coupon = create_coupon()
+
+        for _ in range(5):
+            assert coupon.redeem() is True
+        assert coupon.current_uses == 5
+
+    def test_expired_coupon_cannot_be_redeemed(self):
+        """Expiry is part of the UPDATE condition"""
+        coupon = create_coupon(expiry_date=timezone.now() - timedelta(days=1))
+
+        assert coupon.redeem() is False
+        coupon.refresh_from_db()
+        assert coupon.current_uses == 0
+
+    def test_release_gives_redemption_back(self):
+        """A released redemption can be taken again"""
+        coupon = create_coupon(max_uses=1)
+        coupon.redeem()
+
+        coupon.release()
+
+        assert coupon.current_uses == 0
+        assert coupon.redeem() is True
+
+    def test_increment_usage_only_touches_counter(self):
+        """Other columns changed elsewhere are not overwritten"""
+        coupon = create_coupon()
+        Coupon.objects.filter(pk=coupon.pk).update(discount_value=50)
+
+        coupon.increment_usage()
+
+        coupon.refresh_from_db()
+        assert coupon.current_uses == 1
+        assert coupon.discount_value == 50
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCheckoutRedemption:
+    """Checkout redeems the order's coupon before charging"""
+
+    def checkout(self, client, shipping, billing):
+        return client.post('/api/checkout/', {
+            'stripeToken': 'tok_visa',
+            'selectedShippingAddress': shipping.id,
+            'selectedBillingAddress': billing.id
+        }, format='json')
+
+    @patch('stripe.Charge.create')
+    @patch('stripe.Customer.create')
+    def test_checkout_redeems_coupon(
+        self, mock_customer, mock_charge, authenticated_client, user,
+        test_item, test_address, test_billing_address, create_order
+    ):
+        """A successful checkout uses up one redemption"""
+        mock_charge.return_value = {'id': 'ch_redeem'}
+        mock_customer.return_value = {'id': 'cus_redeem'}
+        coupon = create_coupon(max_uses=1)
+        create_order(user, [(test_item, 1)], coupon=coupon)
+
+        response = self.checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_200_OK
+        coupon.refresh_from_db()
+        assert coupon.current_uses == 1
+
+    @patch('stripe.Charge.create')
+    @patch('stripe.Customer.create')
+    def test_exhausted_coupon_is_not_charged(
+        self, mock_customer, mock_charge, authenticated_client, user,
+        test_item, test_address, test_billing_address, create_order
+    ):
+        """No charge is made once the coupon has run out"""
+        mock_customer.return_value = {'id': 'cus_redeem'}
+        coupon = create_coupon(max_uses=1, current_uses=1)
+        order = create_order(user, [(test_item, 1)], coupon=coupon)
+
+        response = self.checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not mock_charge.called
+        order.refresh_from_db()
+        assert not order.ordered
+
+    @patch('stripe.Charge.create')
+    @patch('stripe.Customer.create')
+    def test_failed_charge_releases_coupon(
+        self, mock_customer, mock_charge, authenticated_client, user,
+        test_item, test_address, test_billing_address, create_order
+    ):
+        """A declined card gives the redemption back"""
+        mock_customer.return_value = {'id': 'cus_redeem'}
+        mock_charge.side_effect = stripe.error.CardError(
+            'Your card was declined', None, 'card_declined',
+            json_body={'error': {'message': 'Your card was declined'}})
+        coupon = create_coupon(max_uses=1)
+        create_order(user, [(test_item, 1)], coupon=coupon)
+
+        response = self.checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        coupon.refresh_from_db()
+        assert coupon.current_uses == 0
+
+
+@pytest.mark.unit
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentRedemption:
+    """Many threads redeeming the same coupon never exceed max_uses"""
+
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 10
+    MAX_USES = 25
+
+    @pytest.fixture
+    def redeem_concurrently(self, run_concurrently, retry_locked):
+        def redeem(threads, attempts, max_uses):
+            coupon = create_coupon(max_uses=max_uses)
+            redeemed = []
+            refused = []
+
+            def customer():
+                copy = retry_locked(lambda: Coupon.objects.get(pk=coupon.pk))
+                for _ in range(attempts):
+                    if retry_locked(copy.redeem):
+                        redeemed.append(1)
+                    else:
+                        refused.append(1)
+
+            started = time.perf_counter()
+            run_concurrently(customer, threads)
+            elapsed = time.perf_counter() - started
+
+            coupon.refresh_from_db()
+            return coupon, len(redeemed), len(refused), elapsed
+        return redeem
+
+    def test_no_over_redemption(self, redeem_concurrently):
+        """Exactly max_uses redemptions succeed"""
+        coupon, redeemed, refused, _ = redeem_concurrently(
+            self.THREADS, self.ATTEMPTS_PER_THREAD, self.MAX_USES)
+
+        assert redeemed == self.MAX_USES
+        assert refused == self.THREADS * self.ATTEMPTS_PER_THREAD - self.MAX_USES
+        assert coupon.current_uses == self.MAX_USES
+
+    @pytest.mark.slow
+    def test_redemption_benchmark(self, redeem_concurrently):
+        """Report redemption throughput under high concurrency"""
+        threads = int(os.environ.get('REDEMPTION_BENCHMARK_THREADS', 32))
+        attempts = int(os.environ.get('REDEMPTION_BENCHMARK_ATTEMPTS', 100))
+        max_uses = threads * attempts // 2
+
+        coupon, redeemed, _, elapsed = redeem_concurrently(threads, attempts, max_uses)
+
+        assert redeemed == max_uses
+        assert coupon.current_uses == max_uses
+        print(f'\n{threads} threads x {attempts} attempts: '
+              f'{threads * attempts / elapsed:.0f} redemptions/s, '
+              f'{redeemed} redeemed of {max_uses} allowed')
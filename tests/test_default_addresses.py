@@ -0,0 +1,152 @@
+"""Tests for the cached default address lookup used by checkout"""
+import pytest
+from django.conf import settings
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.db import connection
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from core import cache, views
+from core.models import Address, Order
+
+
+def address_queries(captured):
+    return [q['sql'] for q in captured.captured_queries if 'core_address' in q['sql']]
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestGetDefaults:
+    """Address.objects.get_defaults answers both types from one cached query"""
+
+    def test_one_query_then_cached(self, user, test_address, test_billing_address,
+                                   django_assert_num_queries):
+        with django_assert_num_queries(1):
+            defaults = Address.objects.get_defaults(user)
+        with django_assert_num_queries(0):
+            again = Address.objects.get_defaults(user)
+
+        assert defaults == again == {'S': test_address, 'B': test_billing_address}
+        assert defaults['S'] is not again['S']
+
+    def test_missing_type_is_left_out(self, user, test_address):
+        Address.objects.create(user=user, street_address='1 Other Road', apartment_address='',
+                               country='US', zip='1', address_type='B')
+
+        assert Address.objects.get_defaults(user) == {'S': test_address}
+
+    def test_oldest_default_wins(self, user, test_address):
+        Address.objects.create(user=user, street_address='2 Newer Road', apartment_address='',
+                               country='US', zip='2', address_type='S', default=True)
+
+        assert Address.objects.get_defaults(user)['S'] == test_address
+
+    def test_saving_a_default_invalidates(self, user, test_address):
+        Address.objects.get_defaults(user)
+        billing = Address.objects.create(user=user, street_address='3 Bill Street',
+                                          apartment_address='', country='US', zip='3',
+                                          address_type='B')
+        billing.default = True
+        billing.save()
+
+        assert Address.objects.get_defaults(user)['B'] == billing
+
+        test_address.default = False
+        test_address.save()
+
+        assert 'S' not in Address.objects.get_defaults(user)
+
+    def test_deleting_invalidates(self, user, test_address):
+        Address.objects.get_defaults(user)
+        test_address.delete()
+
+        assert Address.objects.get_defaults(user) == {}
+
+    def test_entries_expire(self, user, test_address, monkeypatch):
+        """Changes made by other processes send no signal here"""
+        now = [100.0]
+        monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+        Address.objects.get_defaults(user)
+        Address.objects.filter(pk=test_address.pk).update(default=False)
+
+        assert Address.objects.get_defaults(user)['S'] == test_address
+        now[0] += settings.ADDRESS_CACHE_TTL
+        assert Address.objects.get_defaults(user) == {}
+
+    def test_defaults_are_per_user(self, user, test_address, django_user_model):
+        other = django_user_model.objects.create_user(username='defaults-other', password='x')
+        Address.objects.get_defaults(user)
+
+        assert Address.objects.get_defaults(other) == {}
+
+    def test_lookup_uses_index(self, user):
+        plan = Address.objects.filter(user=user, default=True,
+                                      address_type__in=['B', 'S']).explain()
+
+        assert 'address_user_type_default_idx' in plan, plan
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCheckoutUsesDefaults:
+    """Both checkout flows read default addresses through get_defaults"""
+
+    @pytest.fixture
+    def cart(self, user, test_item, create_order):
+        return create_order(user, [(test_item, 1)])
+
+    def test_template_checkout_renders_defaults_with_one_query(self, rf, user, cart, test_address,
+                                                               test_billing_address, monkeypatch):
+        """core.urls is not mounted and there are no templates, so capture the context"""
+        rendered = {}
+        monkeypatch.setattr(views, 'render', lambda request, template, context: (
+            rendered.update(context) or HttpResponse()))
+        request = rf.get('/checkout/')
+        request.user = user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+
+        with CaptureQueriesContext(connection) as captured:
+            views.CheckoutView.as_view()(request)
+
+        assert rendered['default_shipping_address'] == test_address
+        assert rendered['default_billing_address'] == test_billing_address
+        assert len(address_queries(captured)) == 1
+
+    def test_api_checkout_with_default_ids_skips_address_queries(
+            self, fake_gateway, authenticated_client, user, cart, test_address, test_billing_address):
+        Address.objects.get_defaults(user)
+
+        with CaptureQueriesContext(connection) as captured:
+            response = authenticated_client.post('/api/checkout/', {
+                'stripeToken': 'tok_visa',
+                'selectedShippingAddress': test_address.id,
+                'selectedBillingAddress': test_billing_address.id,
+            }, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not [sql for sql in address_queries(captured) if sql.startswith('SELECT')]
+
+    def test_api_checkout_falls_back_to_defaults(self, fake_gateway, authenticated_client, cart,
+                                                 test_address, test_billing_address):
+        response = authenticated_client.post('/api/checkout/', {'stripeToken': 'tok_visa'}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        order = Order.objects.get(pk=cart.pk)
+        assert (order.shipping_address, order.billing_address) == (test_address, test_billing_address)
+
+    def test_api_checkout_rejects_other_users_addresses(self, fake_gateway, authenticated_client, cart,
+                                                        test_address, django_user_model):
+        other = django_user_model.objects.create_user(username='checkout-other', password='x')
+        theirs = Address.objects.create(user=other, street_address='4 Their Lane', apartment_address='',
+                                        country='US', zip='4', address_type='B', default=True)
+
+        response = authenticated_client.post('/api/checkout/', {
+            'stripeToken': 'tok_visa',
+            'selectedShippingAddress': test_address.id,
+            'selectedBillingAddress': theirs.id,
+        }, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'Please select a billing and shipping address'
+        assert not fake_gateway.charges
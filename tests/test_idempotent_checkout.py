@@ -0,0 +1,131 @@
+"""Tests for Idempotency-Key support on checkout"""
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+from core.models import IdempotencyKey, Order, Payment
+
+
+@pytest.fixture
+def cart(user, test_item, create_order):
+    return create_order(user, [(test_item, 1)])
+
+
+def checkout(client, shipping, billing, key=None, token='tok_visa'):
+    headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+    return client.post('/api/checkout/', {
+        'stripeToken': token,
+        'selectedShippingAddress': shipping.id,
+        'selectedBillingAddress': billing.id
+    }, format='json', **headers)
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestIdempotentCheckout:
+    """A retried checkout is answered from the stored response"""
+
+    def test_retry_does_not_charge_again(self, fake_gateway, authenticated_client, cart,
+                                         test_address, test_billing_address,
+                                         django_assert_num_queries):
+        first = checkout(authenticated_client, test_address, test_billing_address, key='retry-1')
+
+        # the key lookup is the only query
+        with django_assert_num_queries(1):
+            again = checkout(authenticated_client, test_address, test_billing_address, key='retry-1')
+
+        assert first.status_code == again.status_code == status.HTTP_200_OK
+        assert len(fake_gateway.charges) == 1
+        assert Payment.objects.count() == 1
+
+    def test_failures_are_replayed(self, fake_gateway, authenticated_client, cart,
+                                   test_address, test_billing_address):
+        fake_gateway.failure_rate = 1
+        first = checkout(authenticated_client, test_address, test_billing_address, key='declined')
+        fake_gateway.failure_rate = 0
+
+        again = checkout(authenticated_client, test_address, test_billing_address, key='declined')
+
+        assert first.status_code == again.status_code == status.HTTP_400_BAD_REQUEST
+        assert again.data == {'message': 'Your card was declined'}
+        assert not fake_gateway.charges
+
+    def test_new_key_checks_out_again(self, fake_gateway, authenticated_client, cart,
+                                      test_address, test_billing_address):
+        fake_gateway.failure_rate = 1
+        checkout(authenticated_client, test_address, test_billing_address, key='attempt-1')
+        fake_gateway.failure_rate = 0
+
+        response = checkout(authenticated_client, test_address, test_billing_address, key='attempt-2')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert Order.objects.get(pk=cart.pk).ordered
+
+    def test_key_reused_for_other_request(self, fake_gateway, authenticated_client, cart,
+                                          test_address, test_billing_address):
+        checkout(authenticated_client, test_address, test_billing_address, key='reused')
+
+        response = checkout(authenticated_client, test_address, test_billing_address,
+                            key='reused', token='tok_other')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'Idempotency-Key was used for a different request'
+
+    def test_in_progress_key_conflicts(self, fake_gateway, authenticated_client, user, cart,
+                                       test_address, test_billing_address):
+        body = {'stripeToken': 'tok_visa', 'selectedShippingAddress': test_address.id,
+                'selectedBillingAddress': test_billing_address.id}
+        IdempotencyKey.objects.create(user=user, key='busy', request_hash=IdempotencyKey.hash_request(body))
+
+        response = checkout(authenticated_client, test_address, test_billing_address, key='busy')
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert not fake_gateway.charges
+
+    def test_keys_are_per_user(self, fake_gateway, authenticated_client, cart, test_address,
+                               test_billing_address, django_user_model):
+        other = django_user_model.objects.create_user(username='idem-other', password='x')
+        IdempotencyKey.objects.create(user=other, key='shared', request_hash='x',
+                                      status_code=200, response_body=None)
+
+        response = checkout(authenticated_client, test_address, test_billing_address, key='shared')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(fake_gateway.charges) == 1
+
+    def test_crash_frees_the_key(self, fake_gateway, authenticated_client, cart,
+                                 test_address, test_billing_address):
+        with patch('core.api.views.PaymentView.checkout', side_effect=RuntimeError):
+            with pytest.raises(RuntimeError):
+                checkout(authenticated_client, test_address, test_billing_address, key='crash')
+
+        assert not IdempotencyKey.objects.exists()
+        response = checkout(authenticated_client, test_address, test_billing_address, key='crash')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_lookup_uses_unique_index(self, user):
+        """SQLite names the constraint's index sqlite_autoindex_*"""
+        plan = IdempotencyKey.objects.filter(user=user, key='k').explain()
+
+        assert 'USING INDEX' in plan and 'SCAN' not in plan, plan
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestClearIdempotencyKeys:
+    """clear_idempotency_keys drops records past the retry window"""
+
+    def test_old_keys_are_deleted(self, user):
+        old = IdempotencyKey.objects.create(user=user, key='old', request_hash='x')
+        IdempotencyKey.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(hours=25))
+        IdempotencyKey.objects.create(user=user, key='new', request_hash='x')
+        out = StringIO()
+
+        call_command('clear_idempotency_keys', '--batch-size', '1', stdout=out)
+
+        assert 'Deleted 1 idempotency keys' in out.getvalue()
+        assert list(IdempotencyKey.objects.values_list('key', flat=True)) == ['new']
@@ -0,0 +1,61 @@
+"""Tests for the integer-cents Money value type"""
+from decimal import Decimal
+
+import pytest
+from core.money import Money
+from core.models import Coupon
+
+
+@pytest.mark.unit
+class TestMoney:
+    """Money keeps amounts as whole cents"""
+
+    @pytest.mark.parametrize('amount,cents', [
+        (24.99, 2499),
+        (Decimal('49.98'), 4998),
+        ('0.10', 10),
+        (3, 300),
+        (0.1 + 0.2, 30),
+        (Decimal('0.005'), 1),
+        (None, 0),
+    ])
+    def test_from_amount(self, amount, cents):
+        """Floats, Decimals, ints and strings become exact cents"""
+        assert Money.from_amount(amount).cents == cents
+
+    def test_arithmetic_is_integer(self):
+        """Sums and products stay exact where floats drift"""
+        total = sum((Money.from_amount(0.1) * 3, Money.from_amount(0.2) * 7), Money())
+
+        assert total == Money(170)
+        assert total.to_decimal() == Decimal('1.70')
+        assert (total - Money.from_amount('0.70')).to_decimal() == Decimal('1.00')
+
+    def test_percentage_rounds_half_up(self):
+        """Percentages round half up to the cent"""
+        assert Money.from_amount('49.98').percentage(10) == Money(500)
+        assert Money.from_amount('99.99').percentage(Decimal('12.5')) == Money(1250)
+
+    def test_comparisons(self):
+        """Money orders and compares by cents"""
+        assert Money(100) > Money(99)
+        assert Money(0) < Money(1)
+        assert not Money()
+        assert str(Money(-150)) == '-1.50'
+
+
+@pytest.mark.unit
+class TestCouponMoney:
+    """Coupon discounts are computed in cents"""
+
+    def test_percentage_discount_in_cents(self):
+        """A percentage discount is rounded to the cent"""
+        coupon = Coupon(code='PCT', amount=0, discount_type='percentage', discount_value=10)
+
+        assert coupon.calculate_discount(Decimal('49.98')) == Decimal('5.00')
+
+    def test_fixed_discount_capped_at_total(self):
+        """A fixed discount never exceeds the order total"""
+        coupon = Coupon(code='FIX', amount=0, discount_type='fixed', discount_value=25)
+
+        assert coupon.calculate_discount_money(Money(1999)) == Money(1999)
@@ -0,0 +1,107 @@
+"""Tests for Order.finalize and its use in the payment views"""
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from rest_framework import status
+from core.models import Item, Order, OrderItem, Payment, StockReservation
+
+
+@pytest.fixture
+def fill_cart(user, create_item, create_cart):
+    """fill_cart(lines) puts two held units each of final-0, final-1, ... in the cart"""
+    def fill(lines):
+        items = [create_item(f'final-{n}', 10, price=3) for n in range(lines)]
+        return create_cart(user, [(item, 2) for item in items])
+    return fill
+
+
+def checkout(client, shipping, billing):
+    return client.post('/api/checkout/', {
+        'stripeToken': 'tok_visa',
+        'selectedShippingAddress': shipping.id,
+        'selectedBillingAddress': billing.id
+    }, format='json')
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestFinalize:
+    """Order.finalize places a paid cart in one transaction"""
+
+    def test_places_order(self, fill_cart, user, test_address, test_billing_address):
+        order = fill_cart(3)
+
+        payment = order.finalize(
+            'ch_final', Decimal('18.00'), billing_address=test_billing_address,
+            shipping_address=test_address, ref_code='ref-final')
+
+        order = Order.objects.get(pk=order.pk)
+        assert order.ordered and order.payment == payment
+        assert (order.billing_address, order.shipping_address) == (test_billing_address, test_address)
+        assert order.ref_code == 'ref-final'
+        assert (payment.stripe_charge_id, payment.amount, payment.user) == ('ch_final', Decimal('18.00'), user)
+        assert not order.items.filter(ordered=False).exists()
+        assert set(Item.objects.values_list('stock_quantity', flat=True)) == {8}
+        assert not StockReservation.objects.exists()
+
+    def test_short_stock_changes_nothing(self, fill_cart):
+        order = fill_cart(2)
+        Item.objects.filter(slug='final-1').update(stock_quantity=1)
+
+        with pytest.raises(ValueError, match='Insufficient stock'):
+            order.finalize('ch_short', Decimal('12.00'))
+
+        assert not Order.objects.get(pk=order.pk).ordered
+        assert not Payment.objects.exists()
+        assert not OrderItem.objects.filter(ordered=True).exists()
+        assert StockReservation.objects.count() == 2
+        assert Item.objects.get(slug='final-0').stock_quantity == 10
+
+    @pytest.mark.parametrize('lines', [1, 10, 100])
+    def test_fixed_statements(self, fill_cart, lines, django_assert_num_queries):
+        """Line read, stock UPDATE, payment INSERT, line UPDATE, hold
+        DELETE, order UPDATE and two savepoint pairs"""
+        order = fill_cart(lines)
+
+        with django_assert_num_queries(10):
+            order.finalize('ch_count', Decimal('1.00'))
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCheckoutFinalize:
+    """The API payment view finalizes through Order.finalize"""
+
+    @patch('stripe.Refund.create')
+    @patch('stripe.Charge.create')
+    @patch('stripe.Customer.create')
+    def test_checkout_takes_stock(self, mock_customer, mock_charge, mock_refund,
+                                  authenticated_client, fill_cart, test_address,
+                                  test_billing_address):
+        mock_customer.return_value = {'id': 'cus_final'}
+        mock_charge.return_value = {'id': 'ch_final'}
+        fill_cart(2)
+
+        response = checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(Item.objects.values_list('stock_quantity', flat=True)) == {8}
+        assert not mock_refund.called
+
+    @patch('stripe.Refund.create')
+    @patch('stripe.Charge.create')
+    @patch('stripe.Customer.create')
+    def test_stock_gone_after_charge_is_refunded(self, mock_customer, mock_charge, mock_refund,
+                                                 authenticated_client, fill_cart, test_address,
+                                                 test_billing_address):
+        mock_customer.return_value = {'id': 'cus_final'}
+        mock_charge.return_value = {'id': 'ch_refund'}
+        order = fill_cart(1)
+        Item.objects.update(stock_quantity=1)
+
+        response = checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        mock_refund.assert_called_once_with(charge='ch_refund')
+        assert not Order.objects.get(pk=order.pk).ordered
@@ -0,0 +1,192 @@
+"""Tests for the denormalized cart summary columns on Order"""
+from importlib import import_module
+from io import StringIO
+
+import pytest
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from core.models import Coupon, Item, Order, OrderItem
+
+
+def assert_summary_matches_lines(order):
+    """The stored columns equal a fresh computation from the lines"""
+    stored = Order.objects.values(
+        'item_count', 'subtotal_cents', 'discount_cents').get(pk=order.pk)
+    order = Order.objects.get(pk=order.pk)
+    assert stored['item_count'] == order.items.count()
+    assert stored['subtotal_cents'] == order.get_subtotal_money().cents
+    assert stored['subtotal_cents'] - stored['discount_cents'] == order.get_total_money().cents
+
+
+@pytest.fixture
+def order(user, create_order):
+    return create_order(user)
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestSummaryMaintenance:
+    """Model cart methods keep the summary columns in step"""
+
+    def test_add_to_cart(self, create_item, order):
+        shirt = create_item('col-shirt', price=29.99, discount_price=24.99)
+        hat = create_item('col-hat', price=10)
+
+        order.add_to_cart(shirt, quantity=2)
+        order.add_to_cart(hat)
+        order.add_to_cart(hat, quantity=2)
+
+        assert order.item_count == 2
+        assert order.subtotal_cents == 2 * 2499 + 3 * 1000
+        assert_summary_matches_lines(order)
+
+    def test_remove_from_cart(self, create_item, order):
+        shirt = create_item('col-shirt', price=29.99)
+        order.add_to_cart(shirt)
+        order.add_to_cart(create_item('col-hat', price=10))
+
+        order.remove_from_cart(shirt)
+
+        assert order.item_count == 1
+        assert order.subtotal_cents == 1000
+        assert_summary_matches_lines(order)
+
+    def test_clear_cart(self, create_item, order):
+        order.add_to_cart(create_item('col-shirt', price=29.99))
+
+        order.clear_cart()
+
+        assert (order.item_count, order.subtotal_cents, order.discount_cents) == (0, 0, 0)
+        assert_summary_matches_lines(order)
+
+    def test_discount_follows_coupon(self, create_item, order):
+        """A fixed coupon larger than the cart discounts the whole subtotal"""
+        order.coupon = Coupon.objects.create(
+            code='COLFIX', amount=0, discount_type='fixed', discount_value=50)
+        order.save()
+        order.add_to_cart(create_item('col-shirt', price=29.99))
+
+        assert order.discount_cents == 2999
+        assert order.get_summary()['total'] == 0
+
+    def test_update_summary_is_two_queries(self, create_item, order, django_assert_num_queries):
+        """One aggregate over the lines and one UPDATE"""
+        order.add_to_cart(create_item('col-shirt', price=29.99))
+
+        with django_assert_num_queries(2):
+            order.update_summary()
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestSummaryMaintenanceAPI:
+    """The API cart views keep the summary columns in step"""
+
+    def test_add_to_cart_view(self, create_item, authenticated_client, user):
+        create_item('api-shirt', price=15)
+
+        response = authenticated_client.post('/api/add-to-cart/', {'slug': 'api-shirt'}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        order = Order.objects.get(user=user, ordered=False)
+        assert (order.item_count, order.subtotal_cents) == (1, 1500)
+
+    def test_quantity_update_and_delete_views(self, create_item, authenticated_client, order):
+        order.add_to_cart(create_item('api-shirt', price=15), quantity=3)
+        order.add_to_cart(create_item('api-hat', price=5))
+
+        response = authenticated_client.post(
+            '/api/order-item/update-quantity/', {'slug': 'api-shirt'}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        order.refresh_from_db()
+        assert order.subtotal_cents == 2 * 1500 + 500
+
+        line = order.items.get(item__slug='api-hat')
+        response = authenticated_client.delete(f'/api/order-items/{line.pk}/delete/')
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        order.refresh_from_db()
+        assert (order.item_count, order.subtotal_cents) == (1, 3000)
+
+    def test_add_coupon_view(self, create_item, authenticated_client, order):
+        order.add_to_cart(create_item('api-shirt', price=20))
+        Coupon.objects.create(code='APICOL', amount=0, discount_type='percentage', discount_value=25)
+
+        response = authenticated_client.post('/api/add-coupon/', {'code': 'APICOL'}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        order.refresh_from_db()
+        assert order.discount_cents == 500
+        assert_summary_matches_lines(order)
+
+    def test_add_coupon_view_writes_only_the_coupon(self, create_item, authenticated_client, order):
+        """A stale in-memory order must not write its summary columns back"""
+        order.add_to_cart(create_item('api-shirt', price=20))
+        Coupon.objects.create(code='APICOL', amount=0, discount_type='fixed', discount_value=5)
+
+        with CaptureQueriesContext(connection) as captured:
+            authenticated_client.post('/api/add-coupon/', {'code': 'APICOL'}, format='json')
+
+        coupon_updates = [q['sql'] for q in captured.captured_queries
+                          if q['sql'].startswith('UPDATE "core_order"') and '"coupon_id"' in q['sql']]
+        assert len(coupon_updates) == 1
+        assert '"item_count"' not in coupon_updates[0]
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestReconcileSummaries:
+    """reconcile_cart_summaries repairs drifted columns in bulk"""
+
+    def test_reconcile_fixes_drift(self, create_item, order, user, django_assert_max_num_queries):
+        """Drift from direct writes and price changes is found and fixed"""
+        shirt = create_item('drift-shirt', price=10)
+        order.add_to_cart(shirt, quantity=2)
+        Item.objects.filter(pk=shirt.pk).update(price=12)
+        placed = Order.objects.create(user=user, ordered=True, ordered_date=timezone.now())
+        placed.items.add(OrderItem.objects.create(user=user, item=shirt, ordered=True))
+
+        # one read and one bulk UPDATE for the batch, one empty read
+        with django_assert_max_num_queries(4):
+            checked, drifted = Order.objects.filter(ordered=False).reconcile_summaries()
+
+        assert (checked, drifted) == (1, 1)
+        order.refresh_from_db()
+        assert order.subtotal_cents == 2400
+        placed.refresh_from_db()
+        assert placed.subtotal_cents == 0
+
+    def test_migration_backfills_existing_orders(self, create_item, order, user):
+        order.add_to_cart(create_item('backfill-shirt', price=10), quantity=3)
+        order.coupon = Coupon.objects.create(
+            code='BACKFILL', amount=0, discount_type='percentage', discount_value=10)
+        order.save(update_fields=['coupon'])
+        placed = Order.objects.create(user=user, ordered=True, ordered_date=timezone.now())
+        placed.items.add(OrderItem.objects.create(
+            user=user, item=create_item('backfill-hat', price=5), ordered=True))
+        Order.objects.update(item_count=0, subtotal_cents=0, discount_cents=0)
+
+        import_module('core.migrations.0013_order_cart_summary').backfill_summaries(apps, None)
+
+        assert Order.objects.get(pk=order.pk).discount_cents == 300
+        assert_summary_matches_lines(order)
+        assert_summary_matches_lines(placed)
+
+    def test_command_reports_drift(self, create_item, order):
+        order.add_to_cart(create_item('drift-shirt', price=10))
+        Order.objects.filter(pk=order.pk).update(item_count=7)
+        out = StringIO()
+
+        call_command('reconcile_cart_summaries', '--dry-run', stdout=out)
+        assert 'Checked 1 orders' in out.getvalue()
+        assert 'found 1 with drifted summaries' in out.getvalue()
+        order.refresh_from_db()
+        assert order.item_count == 7
+
+        call_command('reconcile_cart_summaries', '--all', '--batch-size', '1', stdout=out)
+        assert 'fixed 1 with drifted summaries' in out.getvalue()
+        order.refresh_from_db()
+        assert order.item_count == 1
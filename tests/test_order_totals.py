@@ -0,0 +1,98 @@
+"""Tests for database-aggregated order subtotals and totals"""
+from decimal import Decimal
+from itertools import count
+
+import pytest
+from core.models import Order, Coupon
+
+
+@pytest.fixture
+def priced_order(user, create_item, create_order):
+    """priced_order(lines, **fields) makes an order of (price, discount_price, quantity) lines"""
+    slugs = count()
+
+    def create(lines, **fields):
+        return create_order(user, [
+            (create_item(f'total-product-{next(slugs)}', price=price, discount_price=discount_price),
+             quantity)
+            for price, discount_price, quantity in lines
+        ], **fields)
+    return create
+
+
+def python_subtotal(order):
+    """Reference subtotal computed line by line in Python"""
+    total = Decimal('0')
+    for order_item in order.items.all():
+        total += Decimal(str(order_item.get_final_price()))
+    return total.quantize(Decimal('0.01'))
+
+
+CARTS = [
+    [],
+    [(29.99, 24.99, 2)],
+    [(0.1, None, 3), (0.2, None, 7)],
+    [(19.99, 0.0, 3), (5.55, 4.45, 11), (100.0, None, 1)],
+    [(9.99, 7.77, 13)] * 6,
+]
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestOrderSubtotalAggregation:
+    """Order subtotals summed by the database"""
+
+    @pytest.mark.parametrize('lines', CARTS)
+    def test_aggregate_matches_python(self, priced_order, lines):
+        """Aggregate, annotated and prefetched subtotals round identically"""
+        order = priced_order(lines)
+        expected = python_subtotal(order)
+
+        assert Order.objects.get(pk=order.pk).get_subtotal() == expected
+        assert Order.objects.with_totals().get(pk=order.pk).get_subtotal() == expected
+        assert Order.objects.with_cart_graph().get(pk=order.pk).get_subtotal() == expected
+
+    def test_subtotal_is_one_query(self, priced_order, django_assert_num_queries):
+        """Unannotated subtotal is a single aggregate query"""
+        order = priced_order(CARTS[3])
+        order = Order.objects.get(pk=order.pk)
+
+        with django_assert_num_queries(1):
+            assert order.get_subtotal() == Decimal('208.92')
+
+    def test_zero_discount_price_means_no_discount(self, priced_order):
+        """A discount price of 0 falls back to the regular price"""
+        order = priced_order([(19.99, 0.0, 2)])
+
+        assert Order.objects.with_totals().get(pk=order.pk).get_subtotal() == Decimal('39.98')
+
+    def test_empty_order_subtotal(self, priced_order):
+        """An order without lines has a zero subtotal"""
+        order = priced_order([])
+
+        assert order.get_subtotal() == Decimal('0.00')
+        assert Order.objects.with_totals().get(pk=order.pk).subtotal == 0
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestOrderTotalsAnnotation:
+    """Lists of orders carry their totals without per-order queries"""
+
+    def test_order_list_totals_in_one_query(self, priced_order, django_assert_num_queries):
+        """Totals for a whole list come from one annotated query"""
+        coupon = Coupon.objects.create(
+            code='LIST10', amount=0, discount_type='percentage', discount_value=10)
+        orders = [priced_order(CARTS[n], ordered=True) for n in range(1, 5)]
+        orders[0].coupon = coupon
+        orders[0].save()
+        expected = {order.pk: order.get_total() for order in orders}
+
+        with django_assert_num_queries(1):
+            totals = {
+                order.pk: order.get_total()
+                for order in Order.objects.with_totals().select_related('coupon')
+            }
+
+        assert totals == expected
+        assert totals[orders[0].pk] == Decimal('44.98')
@@ -0,0 +1,252 @@
+"""Tests for the payment gateway interface, its fake and a checkout load test"""
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+import stripe
+from django.contrib.messages.storage.fallback import FallbackStorage
+from rest_framework import status
+from core.gateways import FakeGateway, PaymentError, StripeGateway, get_gateway
+from core.models import Coupon, Item, Order, OrderItem, Payment, UserProfile
+from core.views import PaymentView
+
+
+def open_cart(user, item):
+    """The user's cart, holding one unit of ``item``"""
+    order, _ = Order.objects.get_or_create_cart(user)
+    if not order.items.exists():
+        order.items.add(OrderItem.objects.create(user=user, item=item))
+    return order
+
+
+def checkout(client, shipping, billing, token='tok_visa'):
+    return client.post('/api/checkout/', {
+        'stripeToken': token,
+        'selectedShippingAddress': shipping.id,
+        'selectedBillingAddress': billing.id
+    }, format='json')
+
+
+def run_checkouts(client, user, shipping, billing, count):
+    """Place ``count`` checkouts through the API view
+
+    Returns the number placed and declined, and the seconds spent in
+    the view, leaving out building each cart.
+    """
+    item = Item.objects.create(
+        title='Load', price=10, category='S', label='P', slug='load',
+        description='Test', image='test.jpg', stock_quantity=count)
+    placed = declined = 0
+    elapsed = 0.0
+    for _ in range(count):
+        open_cart(user, item)
+        started = time.perf_counter()
+        response = checkout(client, shipping, billing)
+        elapsed += time.perf_counter() - started
+        if response.status_code == status.HTTP_200_OK:
+            placed += 1
+        else:
+            assert response.data['message'] == 'Your card was declined'
+            declined += 1
+    return placed, declined, elapsed
+
+
+@pytest.mark.unit
+class TestFakeGateway:
+    """FakeGateway behaves like a card processor in memory"""
+
+    def test_charge_and_refund(self):
+        gateway = FakeGateway()
+
+        charge_id = gateway.charge(1250, source='tok_visa')
+        gateway.refund(charge_id)
+
+        assert gateway.charges[charge_id]['amount'] == 1250
+        assert gateway.refunds == [charge_id]
+
+    def test_declines(self):
+        gateway = FakeGateway(failure_rate=0.5, seed=7)
+        outcomes = []
+        for _ in range(200):
+            try:
+                gateway.charge(100, source='tok_visa')
+                outcomes.append(True)
+            except PaymentError:
+                outcomes.append(False)
+
+        assert 70 < outcomes.count(False) < 130
+        with pytest.raises(PaymentError, match='declined'):
+            FakeGateway().charge(100, source=FakeGateway.DECLINED_TOKEN)
+
+    def test_latency(self):
+        gateway = FakeGateway(latency=0.02)
+
+        started = time.perf_counter()
+        gateway.charge(100, source='tok_visa')
+
+        assert time.perf_counter() - started >= 0.02
+
+    def test_customers_and_cards(self):
+        gateway = FakeGateway()
+        customer_id = gateway.create_customer('load@example.com')
+        gateway.save_card(customer_id, 'tok_visa')
+
+        assert gateway.list_cards(customer_id)[0]['last4'] == '4242'
+        assert gateway.charges[gateway.charge(100, customer=customer_id)]['customer'] == customer_id
+        with pytest.raises(PaymentError):
+            gateway.charge(100, customer='cus_unknown')
+
+    def test_settings_choose_the_gateway(self, settings):
+        assert isinstance(get_gateway(), StripeGateway)
+
+        settings.PAYMENT_GATEWAY = 'core.gateways.FakeGateway'
+        settings.PAYMENT_GATEWAY_OPTIONS = {'latency': 0.5}
+
+        assert get_gateway().latency == 0.5
+        assert get_gateway() is get_gateway()
+
+
+@pytest.mark.unit
+class TestStripeGateway:
+    """StripeGateway turns Stripe failures into PaymentError"""
+
+    @patch('stripe.Charge.create')
+    def test_charge_returns_id(self, mock_charge):
+        mock_charge.return_value = {'id': 'ch_real'}
+
+        assert StripeGateway().charge(500, source='tok_visa') == 'ch_real'
+        mock_charge.assert_called_once_with(amount=500, currency='usd', source='tok_visa')
+
+    @patch('stripe.Charge.create')
+    def test_idempotency_key_is_sent(self, mock_charge):
+        mock_charge.return_value = {'id': 'ch_real'}
+
+        StripeGateway().charge(500, customer='cus_1', idempotency_key='payment-job-1')
+
+        mock_charge.assert_called_once_with(
+            amount=500, currency='usd', customer='cus_1', idempotency_key='payment-job-1')
+
+    @pytest.mark.parametrize('error,message', [
+        (stripe.error.CardError('Declined', 'card', 'card_declined'), 'Your card was declined'),
+        (stripe.error.CardError('Declined', 'card', 'expired_card',
+                                json_body={'error': {'message': 'Your card has expired.'}}),
+         'Your card has expired.'),
+        (stripe.error.RateLimitError('Slow down'), 'Rate limit error'),
+        (stripe.error.APIConnectionError('Offline'), 'Network error'),
+    ])
+    @patch('stripe.Charge.create')
+    def test_errors_become_payment_errors(self, mock_charge, error, message):
+        mock_charge.side_effect = error
+
+        with pytest.raises(PaymentError, match=message):
+            StripeGateway().charge(500, source='tok_visa')
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestViewsUseGateway:
+    """Both payment views charge through the configured gateway"""
+
+    def test_api_checkout(self, fake_gateway, authenticated_client, user, test_item,
+                          test_address, test_billing_address):
+        order = open_cart(user, test_item)
+
+        response = checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_200_OK
+        charge_id = Payment.objects.get().stripe_charge_id
+        assert fake_gateway.charges[charge_id]['amount'] == 2499
+        assert Order.objects.get(pk=order.pk).ordered
+        assert not fake_gateway.customers
+        assert not UserProfile.objects.get(user=user).stripe_customer_id
+
+    def test_api_decline_releases_coupon(self, fake_gateway, authenticated_client, user, test_item,
+                                         test_address, test_billing_address):
+        order = open_cart(user, test_item)
+        order.coupon = Coupon.objects.create(
+            code='GATEWAY', amount=0, discount_type='fixed', discount_value=5, max_uses=1)
+        order.save()
+
+        response = checkout(authenticated_client, test_address, test_billing_address,
+                            token=FakeGateway.DECLINED_TOKEN)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'Your card was declined'
+        assert Coupon.objects.get(code='GATEWAY').current_uses == 0
+
+    def test_template_checkout_saves_card(self, fake_gateway, rf, user, test_item):
+        """core.urls is not mounted, so the view is called directly"""
+        order = open_cart(user, test_item)
+        request = rf.post('/payment/stripe/', {'stripeToken': 'tok_visa', 'save': 'on'})
+        request.user = user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+
+        response = PaymentView.as_view()(request, payment_option='stripe')
+
+        assert response.status_code == 302
+        customer_id = UserProfile.objects.get(user=user).stripe_customer_id
+        assert fake_gateway.customers[customer_id]['cards'][0]['token'] == 'tok_visa'
+        charge = fake_gateway.charges[Payment.objects.get().stripe_charge_id]
+        assert charge['customer'] == customer_id
+        assert Order.objects.get(pk=order.pk).ordered
+
+    def test_template_customer_error_releases_coupon(self, fake_gateway, rf, user, test_item):
+        """A gateway error while saving the card is reported, not raised"""
+        order = open_cart(user, test_item)
+        order.coupon = Coupon.objects.create(
+            code='SAVEFAIL', amount=0, discount_type='fixed', discount_value=5, max_uses=1)
+        order.save()
+        UserProfile.objects.filter(user=user).update(stripe_customer_id='cus_unknown')
+        request = rf.post('/payment/stripe/', {'stripeToken': 'tok_visa', 'save': 'on'})
+        request.user = user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+
+        response = PaymentView.as_view()(request, payment_option='stripe')
+
+        assert response.status_code == 302
+        assert [str(m) for m in request._messages] == ['Invalid parameters']
+        assert Coupon.objects.get(code='SAVEFAIL').current_uses == 0
+        assert not fake_gateway.charges
+        assert not Order.objects.get(pk=order.pk).ordered
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCheckoutLoad:
+    """Drive many checkouts through the real API view against FakeGateway"""
+
+    def test_declines_leave_cart_for_retry(self, settings, authenticated_client, user,
+                                           test_address, test_billing_address):
+        settings.PAYMENT_GATEWAY = 'core.gateways.FakeGateway'
+        settings.PAYMENT_GATEWAY_OPTIONS = {'failure_rate': 0.3, 'seed': 1}
+
+        placed, declined, _ = run_checkouts(
+            authenticated_client, user, test_address, test_billing_address, 30)
+
+        assert placed + declined == 30 and declined
+        assert Order.objects.filter(user=user, ordered=True).count() == placed
+        assert len(get_gateway().charges) == placed
+
+    @pytest.mark.slow
+    def test_checkout_throughput(self, settings, authenticated_client, user,
+                                 test_address, test_billing_address):
+        """Checkouts per minute with the processor taken out of the picture"""
+        count = int(os.environ.get('CHECKOUT_LOAD_COUNT', 2000))
+        settings.PAYMENT_GATEWAY = 'core.gateways.FakeGateway'
+        settings.PAYMENT_GATEWAY_OPTIONS = {
+            'latency': float(os.environ.get('CHECKOUT_LOAD_LATENCY', 0)),
+            'failure_rate': float(os.environ.get('CHECKOUT_LOAD_FAILURE_RATE', 0.05)),
+            'seed': 1,
+        }
+
+        placed, declined, elapsed = run_checkouts(
+            authenticated_client, user, test_address, test_billing_address, count)
+
+        per_minute = count / elapsed * 60
+        print(f'\n{count} checkouts ({placed} placed, {declined} declined) in '
+              f'{elapsed:.1f}s: {per_minute:.0f} checkouts/min')
+        assert placed + declined == count
+        assert per_minute > 1000
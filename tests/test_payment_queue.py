@@ -0,0 +1,228 @@
+"""Tests for queued checkouts and the payment worker"""
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import OperationalError
+from django.utils import timezone
+from rest_framework import status
+from core.models import Coupon, Item, Order, PaymentJob, UserProfile
+
+
+@pytest.fixture
+def queue_enabled(settings):
+    settings.PAYMENT_QUEUE_ENABLED = True
+
+
+@pytest.fixture
+def cart(user):
+    item = Item.objects.create(
+        title='Queued', price=12, category='S', label='P', slug='queued',
+        description='Test', image='test.jpg', stock_quantity=5)
+    order = Order.objects.create(user=user, ordered_date=timezone.now())
+    order.add_to_cart(item, quantity=2)
+    return order
+
+
+def checkout(client, shipping, billing):
+    return client.post('/api/checkout/', {
+        'stripeToken': 'tok_visa',
+        'selectedShippingAddress': shipping.id,
+        'selectedBillingAddress': billing.id
+    }, format='json')
+
+
+def run_worker():
+    out = StringIO()
+    call_command('process_payment_jobs', stdout=out)
+    return out.getvalue()
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestQueuedCheckout:
+    """With the queue enabled, checkout only records a job"""
+
+    def test_checkout_returns_pending_job(self, queue_enabled, fake_gateway, authenticated_client,
+                                          cart, test_address, test_billing_address):
+        response = checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert response.data['status'] == PaymentJob.PENDING
+        job = PaymentJob.objects.get(pk=response.data['id'])
+        assert (job.order, job.amount_cents, job.stripe_token) == (cart, 2400, 'tok_visa')
+        assert not fake_gateway.charges
+        assert not Order.objects.get(pk=cart.pk).ordered
+
+    def test_worker_charges_and_client_sees_success(self, queue_enabled, fake_gateway, authenticated_client,
+                                                    cart, test_address, test_billing_address):
+        job_id = checkout(authenticated_client, test_address, test_billing_address).data['id']
+
+        assert 'Processed 1 payment jobs (1 succeeded, 0 failed, 0 to reconcile)' in run_worker()
+
+        response = authenticated_client.get(f'/api/payment-jobs/{job_id}/')
+        assert response.data == {'id': job_id, 'status': 'succeeded', 'message': ''}
+        assert fake_gateway.charges == {'ch_fake_1': {
+            'amount': 2400, 'source': 'tok_visa', 'customer': None,
+            'description': f'Charge for {cart.user.email}'}}
+        order = Order.objects.get(pk=cart.pk)
+        assert order.ordered
+        assert order.payment.stripe_charge_id == 'ch_fake_1'
+        assert (order.billing_address, order.shipping_address) == (test_billing_address, test_address)
+        assert Item.objects.get(slug='queued').stock_quantity == 3
+
+    def test_declined_card_fails_job_and_releases_coupon(self, queue_enabled, fake_gateway, authenticated_client,
+                                                         cart, test_address, test_billing_address):
+        cart.coupon = Coupon.objects.create(
+            code='QUEUED', amount=0, discount_type='fixed', discount_value=4, max_uses=1)
+        cart.save()
+        fake_gateway.failure_rate = 1
+
+        job_id = checkout(authenticated_client, test_address, test_billing_address).data['id']
+        assert Coupon.objects.get(code='QUEUED').current_uses == 1
+        run_worker()
+
+        response = authenticated_client.get(f'/api/payment-jobs/{job_id}/')
+        assert response.data['status'] == 'failed'
+        assert response.data['message'] == 'Your card was declined'
+        assert Coupon.objects.get(code='QUEUED').current_uses == 0
+        assert not Order.objects.get(pk=cart.pk).ordered
+
+    def test_stock_gone_before_worker_is_refunded(self, queue_enabled, fake_gateway, authenticated_client,
+                                                  cart, test_address, test_billing_address):
+        checkout(authenticated_client, test_address, test_billing_address)
+        Item.objects.update(stock_quantity=1)
+
+        assert '1 failed' in run_worker()
+
+        job = PaymentJob.objects.get()
+        assert job.message.startswith('Insufficient stock')
+        assert fake_gateway.refunds == [job.stripe_charge_id] == ['ch_fake_1']
+
+    def test_cart_changed_before_worker_is_not_charged(self, queue_enabled, fake_gateway,
+                                                       authenticated_client, cart,
+                                                       test_address, test_billing_address):
+        job_id = checkout(authenticated_client, test_address, test_billing_address).data['id']
+        cart.add_to_cart(Item.objects.get(slug='queued'))
+
+        assert '1 failed' in run_worker()
+
+        response = authenticated_client.get(f'/api/payment-jobs/{job_id}/')
+        assert response.data['message'] == 'Your cart changed after checkout. Please check out again.'
+        assert not fake_gateway.charges
+        assert not Order.objects.get(pk=cart.pk).ordered
+
+    def test_one_active_job_per_order(self, queue_enabled, fake_gateway, authenticated_client,
+                                      cart, test_address, test_billing_address):
+        checkout(authenticated_client, test_address, test_billing_address)
+
+        response = checkout(authenticated_client, test_address, test_billing_address)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'A payment for this order is already in progress'
+        assert PaymentJob.objects.count() == 1
+
+    def test_jobs_are_private(self, queue_enabled, fake_gateway, authenticated_client, api_client,
+                              cart, test_address, test_billing_address, django_user_model):
+        job_id = checkout(authenticated_client, test_address, test_billing_address).data['id']
+        other = django_user_model.objects.create_user(username='queue-other', password='x')
+        api_client.force_authenticate(other)
+
+        assert api_client.get(f'/api/payment-jobs/{job_id}/').status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestWorker:
+    """process_payment_jobs claims jobs oldest first"""
+
+    def test_claim_takes_each_job_once(self, cart):
+        first = cart.enqueue_payment(stripe_token='tok_1')
+
+        assert PaymentJob.objects.claim_next() == first
+        assert PaymentJob.objects.claim_next() is None
+        first.refresh_from_db()
+        assert (first.status, first.attempts) == (PaymentJob.PROCESSING, 1)
+
+    def test_stale_processing_job_is_reclaimed(self, cart, settings):
+        settings.PAYMENT_JOB_LEASE = 60
+        job = cart.enqueue_payment(stripe_token='tok_1')
+        PaymentJob.objects.claim_next()
+
+        assert PaymentJob.objects.claim_next() is None
+
+        PaymentJob.objects.filter(pk=job.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=61))
+        assert PaymentJob.objects.claim_next() == job
+        assert PaymentJob.objects.get(pk=job.pk).attempts == 2
+
+    def test_attempts_are_capped(self, fake_gateway, cart, settings):
+        settings.PAYMENT_JOB_MAX_ATTEMPTS = 2
+        cart.coupon = Coupon.objects.create(
+            code='RETRIED', amount=0, discount_type='fixed', discount_value=4, max_uses=1)
+        cart.save()
+        job = cart.enqueue_payment(stripe_token='tok_1')
+        PaymentJob.objects.filter(pk=job.pk).update(attempts=2)
+
+        assert '1 failed' in run_worker()
+        assert not fake_gateway.charges
+        assert Coupon.objects.get(code='RETRIED').current_uses == 0
+
+    @pytest.mark.parametrize('ordered,status', [
+        (True, PaymentJob.SUCCEEDED), (False, PaymentJob.RECONCILE)])
+    def test_reclaimed_job_with_charge_is_not_charged_again(self, fake_gateway, cart,
+                                                            ordered, status):
+        job = cart.enqueue_payment(stripe_token='tok_1')
+        PaymentJob.objects.filter(pk=job.pk).update(stripe_charge_id='ch_earlier')
+        Order.objects.filter(pk=cart.pk).update(ordered=ordered)
+
+        run_worker()
+
+        job.refresh_from_db()
+        assert (job.status, job.stripe_charge_id) == (status, 'ch_earlier')
+        assert not fake_gateway.charges
+
+    def test_charge_is_idempotent_per_job(self, fake_gateway):
+        first = fake_gateway.charge(100, source='tok_1', idempotency_key='payment-job-1')
+
+        assert fake_gateway.charge(100, source='tok_1', idempotency_key='payment-job-1') == first
+        assert len(fake_gateway.charges) == 1
+
+    def test_saved_card_is_charged_through_customer(self, fake_gateway, cart, user):
+        cart.enqueue_payment(stripe_token='tok_save', save_card=True)
+
+        run_worker()
+
+        customer_id = UserProfile.objects.get(user=user).stripe_customer_id
+        assert [card['token'] for card in fake_gateway.customers[customer_id]['cards']] == ['tok_save']
+        assert fake_gateway.charges[PaymentJob.objects.get().stripe_charge_id]['customer'] == customer_id
+
+    def test_unexpected_error_refunds_charge(self, fake_gateway, cart, monkeypatch):
+        cart.coupon = Coupon.objects.create(
+            code='CRASH', amount=0, discount_type='fixed', discount_value=4, max_uses=1)
+        cart.save()
+        cart.enqueue_payment(stripe_token='tok_1')
+
+        def crash(*args, **kwargs):
+            raise OperationalError('database is locked')
+        monkeypatch.setattr(Order, 'finalize', crash)
+
+        assert '1 failed' in run_worker()
+        job = PaymentJob.objects.get()
+        assert (job.status, job.stripe_charge_id) == (PaymentJob.FAILED, 'ch_fake_1')
+        assert fake_gateway.refunds == ['ch_fake_1']
+        assert Coupon.objects.get(code='CRASH').current_uses == 0
+
+    def test_failed_refund_needs_reconciliation(self, fake_gateway, cart, monkeypatch):
+        cart.enqueue_payment(stripe_token='tok_1')
+        monkeypatch.setattr(Order, 'finalize', lambda *args, **kwargs: 1 / 0)
+        monkeypatch.setattr(fake_gateway, 'refund', lambda charge_id: 1 / 0)
+        err = StringIO()
+
+        call_command('process_payment_jobs', stdout=StringIO(), stderr=err)
+
+        job = PaymentJob.objects.get()
+        assert (job.status, job.stripe_charge_id) == (PaymentJob.RECONCILE, 'ch_fake_1')
+        assert 'needs reconciliation: charge ch_fake_1' in err.getvalue()
+        assert not Order.objects.get(pk=cart.pk).ordered
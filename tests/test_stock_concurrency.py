@@ -0,0 +1,149 @@
+"""Tests for atomic stock decrements under concurrent checkouts"""
+import threading
+
+import pytest
+from django.contrib.auth import get_user_model
+from core.models import Item
+
+User = get_user_model()
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestAtomicStockDecrement:
+    """Item.reduce_stock is a conditional UPDATE"""
+
+    def test_reduce_stock_is_one_update(self, create_item, django_assert_num_queries):
+        """Decrement is one UPDATE plus the refresh of the instance"""
+        item = create_item('single-update', 5)
+
+        with django_assert_num_queries(2):
+            item.reduce_stock(2)
+
+        assert item.stock_quantity == 3
+
+    def test_reduce_stock_ignores_stale_instance(self, create_item):
+        """The check uses the database value, not the in-memory one"""
+        item = create_item('stale-instance', 5)
+        stale = Item.objects.get(pk=item.pk)
+        item.reduce_stock(4)
+
+        with pytest.raises(ValueError):
+            stale.reduce_stock(4)
+        stale.refresh_from_db()
+        assert stale.stock_quantity == 1
+
+    def test_reduce_stock_only_touches_stock(self, create_item):
+        """Other columns changed elsewhere are not overwritten"""
+        item = create_item('only-stock', 5)
+        Item.objects.filter(pk=item.pk).update(title='Renamed')
+
+        item.reduce_stock(1)
+
+        item.refresh_from_db()
+        assert item.title == 'Renamed'
+        assert item.stock_quantity == 4
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestOrderStockReduction:
+    """Order.reduce_stock takes stock for every line at once"""
+
+    def test_reduces_every_line(self, user, create_item, create_order,
+                                django_assert_max_num_queries):
+        """One read of the lines and one UPDATE for all items"""
+        shirt = create_item('bulk-shirt', 10)
+        hat = create_item('bulk-hat', 3)
+        order = create_order(user, [(shirt, 2), (shirt, 5), (hat, 3)])
+
+        # read lines, UPDATE, plus the savepoint around the UPDATE
+        with django_assert_max_num_queries(4):
+            order.reduce_stock()
+
+        shirt.refresh_from_db()
+        hat.refresh_from_db()
+        assert shirt.stock_quantity == 3
+        assert hat.stock_quantity == 0
+
+    def test_all_or_nothing(self, user, create_item, create_order):
+        """A single short item leaves every item untouched"""
+        shirt = create_item('partial-shirt', 10)
+        hat = create_item('partial-hat', 1)
+        order = create_order(user, [(shirt, 2), (hat, 2)])
+
+        with pytest.raises(ValueError):
+            order.reduce_stock()
+
+        shirt.refresh_from_db()
+        hat.refresh_from_db()
+        assert shirt.stock_quantity == 10
+        assert hat.stock_quantity == 1
+
+    def test_empty_order(self, user, create_order, django_assert_num_queries):
+        """An empty order only reads its lines"""
+        order = create_order(user)
+        with django_assert_num_queries(1):
+            order.reduce_stock()
+
+
+@pytest.mark.unit
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentStockDecrement:
+    """Many threads buying the same item never oversell it"""
+
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 10
+    STOCK = 25
+
+    def test_no_oversell_under_contention(self, create_item, run_concurrently, retry_locked):
+        """Exactly the available stock is sold, no more"""
+        item = create_item('contended', self.STOCK)
+        sold = []
+        refused = []
+
+        def buyer():
+            copy = retry_locked(lambda: Item.objects.get(pk=item.pk))
+            for _ in range(self.ATTEMPTS_PER_THREAD):
+                try:
+                    retry_locked(lambda: copy.reduce_stock(1))
+                    sold.append(1)
+                except ValueError:
+                    refused.append(1)
+
+        run_concurrently(buyer, self.THREADS)
+
+        item.refresh_from_db()
+        assert len(sold) == self.STOCK
+        assert len(refused) == self.THREADS * self.ATTEMPTS_PER_THREAD - self.STOCK
+        assert item.stock_quantity == 0
+
+    def test_concurrent_orders_no_oversell(self, create_item, create_order, run_concurrently,
+                                           retry_locked):
+        """Whole orders competing for the same items never oversell"""
+        shirt = create_item('contended-shirt', 9)
+        hat = create_item('contended-hat', 6)
+        orders = []
+        for n in range(self.THREADS):
+            user = User.objects.create_user(username=f'buyer{n}', password='testpass123')
+            orders.append(create_order(user, [(shirt, 3), (hat, 2)]))
+        pending = list(orders)
+        completed = []
+        lock = threading.Lock()
+
+        def checkout():
+            with lock:
+                order = pending.pop()
+            try:
+                retry_locked(order.reduce_stock)
+                completed.append(order)
+            except ValueError:
+                pass
+
+        run_concurrently(checkout, self.THREADS)
+
+        shirt.refresh_from_db()
+        hat.refresh_from_db()
+        assert len(completed) == 3
+        assert shirt.stock_quantity == 0
+        assert hat.stock_quantity == 0
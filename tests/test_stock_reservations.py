@@ -0,0 +1,253 @@
+"""Tests for cart stock reservations and the expired-reservation sweeper"""
+import os
+import time
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.management import call_command
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework import status
+from core import views
+from core.models import Order, OrderItem, StockReservation
+
+User = get_user_model()
+
+# core.urls is not mounted in home.urls; the cart views redirect into it
+urlpatterns = [path('', include('core.urls'))]
+
+
+def seed_reservations(item, count, expires_at, batch_size=5000):
+    """Bulk insert ``count`` reservations on throwaway order items"""
+    user, _ = User.objects.get_or_create(username='reservation-seed')
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        last_pk = OrderItem.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        OrderItem.objects.bulk_create([
+            OrderItem(user=user, item=item) for _ in range(size)
+        ])
+        order_item_ids = OrderItem.objects.filter(pk__gt=last_pk).values_list('pk', flat=True)
+        StockReservation.objects.bulk_create([
+            StockReservation(item=item, order_item_id=pk, quantity=1, expires_at=expires_at)
+            for pk in order_item_ids
+        ])
+        created += size
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestStockReservations:
+    """Adding to a cart holds the units for a limited time"""
+
+    def test_add_to_cart_holds_stock(self, create_item, create_order):
+        """The line's quantity is reserved and no longer available"""
+        item = create_item('reserved-item', 10)
+        order = create_order(User.objects.create_user(username='holder'))
+
+        order.add_to_cart(item, quantity=3)
+        order.add_to_cart(item, quantity=2)
+
+        reservation = StockReservation.objects.get(item=item)
+        assert reservation.quantity == 5
+        assert reservation.order_item == order.items.get()
+        assert reservation.expires_at > timezone.now()
+        assert item.get_available_quantity() == 5
+        assert item.stock_quantity == 10
+
+    def test_held_stock_cannot_be_claimed_twice(self, create_item, create_order):
+        """A second cart cannot take units held by the first"""
+        item = create_item('reserved-item', 4)
+        create_order(User.objects.create_user(username='first')).add_to_cart(item, quantity=3)
+        second = create_order(User.objects.create_user(username='second'))
+
+        with pytest.raises(ValueError, match='Insufficient stock available. Only 1 in stock.'):
+            second.add_to_cart(item, quantity=2)
+
+        second.add_to_cart(item, quantity=1)
+        assert item.get_available_quantity() == 0
+
+    def test_expired_holds_are_ignored(self, create_item, create_order):
+        """Once a hold expires its units are available again"""
+        item = create_item('reserved-item', 4)
+        create_order(User.objects.create_user(username='first')).add_to_cart(item, quantity=4)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        assert item.get_available_quantity() == 4
+        create_order(User.objects.create_user(username='second')).add_to_cart(item, quantity=4)
+
+    def test_removing_line_releases_hold(self, create_item, create_order):
+        """Removing the item from the cart drops its reservation"""
+        item = create_item('reserved-item', 4)
+        order = create_order(User.objects.create_user(username='remover'))
+        order.add_to_cart(item, quantity=4)
+
+        order.remove_from_cart(item)
+
+        assert not StockReservation.objects.exists()
+        assert item.get_available_quantity() == 4
+
+    def test_removing_one_shrinks_hold(self, create_item, create_order):
+        """Each unit taken off shrinks the hold; the last deletes the line"""
+        item = create_item('reserved-item', 4)
+        order = create_order(User.objects.create_user(username='remover'))
+        order.add_to_cart(item, quantity=2)
+
+        order.remove_single_from_cart(order.items.get())
+        assert StockReservation.objects.get().quantity == 1
+
+        order.remove_single_from_cart(order.items.get())
+        assert not OrderItem.objects.exists()
+        assert not StockReservation.objects.exists()
+
+    def test_lapsed_line_is_checked_in_full(self, create_item, create_order):
+        """A line whose hold expired needs stock for its whole quantity again"""
+        item = create_item('reserved-item', 5)
+        first = create_order(User.objects.create_user(username='first'))
+        first.add_to_cart(item, quantity=4)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        create_order(User.objects.create_user(username='second')).add_to_cart(item, quantity=3)
+
+        with pytest.raises(ValueError, match='Only 2 in stock.'):
+            first.add_to_cart(item)
+        with pytest.raises(ValueError, match='Only 2 in stock.'):
+            first.remove_single_from_cart(first.items.get())
+
+        assert item.get_available_quantity() == 2
+
+    def test_available_read_uses_covering_index(self, create_item):
+        """Summing active holds reads the (item, expires_at, quantity) index"""
+        item = create_item('reserved-item', 10)
+
+        plan = StockReservation.objects.active().filter(
+            item=item).values_list('quantity').explain()
+
+        assert 'reservation_item_active_idx' in plan
+
+
+@pytest.fixture
+def item(create_item):
+    return create_item('reserved-item', 2)
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestApiCartViewsHoldStock:
+    """The API cart views keep the line's hold in step with its quantity"""
+
+    def test_add_holds_and_checks_stock(self, authenticated_client, item):
+        for _ in range(2):
+            response = authenticated_client.post(
+                '/api/add-to-cart/', {'slug': item.slug}, format='json')
+            assert response.status_code == status.HTTP_200_OK
+        assert StockReservation.objects.get().quantity == 2
+
+        response = authenticated_client.post('/api/add-to-cart/', {'slug': item.slug}, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'Insufficient stock available for Reserved-Item. Only 0 in stock.'
+        assert OrderItem.objects.get().quantity == 2
+
+    def test_decrement_shrinks_then_deletes(self, authenticated_client, user, item, create_cart):
+        create_cart(user, [(item, 2)])
+
+        authenticated_client.post('/api/order-item/update-quantity/', {'slug': item.slug}, format='json')
+        assert StockReservation.objects.get().quantity == 1
+
+        authenticated_client.post('/api/order-item/update-quantity/', {'slug': item.slug}, format='json')
+        assert not OrderItem.objects.exists()
+        assert not StockReservation.objects.exists()
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+@pytest.mark.urls(__name__)
+class TestTemplateCartViewsHoldStock:
+    """The template cart views keep the line's hold in step with its quantity"""
+
+    def call_view(self, view, rf, user, item):
+        request = rf.get(f'/{item.slug}/')
+        request.user = user
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        view(request, slug=item.slug)
+        return [str(message) for message in get_messages(request)]
+
+    def test_add_holds_and_checks_stock(self, rf, user, item):
+        for _ in range(2):
+            self.call_view(views.add_to_cart, rf, user, item)
+        assert StockReservation.objects.get().quantity == 2
+
+        messages = self.call_view(views.add_to_cart, rf, user, item)
+
+        assert messages == ['Insufficient stock available. Only 0 in stock.']
+        assert Order.objects.get(user=user).items.get().quantity == 2
+
+    @pytest.mark.parametrize('view', [views.remove_from_cart, views.remove_single_item_from_cart])
+    def test_removal_deletes_the_line(self, rf, user, item, create_cart, view):
+        create_cart(user, [(item, 1)])
+
+        self.call_view(view, rf, user, item)
+
+        assert not OrderItem.objects.exists()
+        assert not StockReservation.objects.exists()
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestReservationSweeper:
+    """Expired reservations are released in batches"""
+
+    def test_release_expired_in_batches(self, create_item, django_assert_max_num_queries):
+        """Only expired rows go, a bounded batch per DELETE"""
+        item = create_item('reserved-item', 10)
+        seed_reservations(item, 25, timezone.now() - timedelta(minutes=1))
+        seed_reservations(item, 5, timezone.now() + timedelta(minutes=10))
+
+        # three batches of (select ids, delete) and a final empty select,
+        # each delete wrapped in a savepoint
+        with django_assert_max_num_queries(3 * 4 + 1):
+            released = StockReservation.objects.release_expired(batch_size=10)
+
+        assert released == 25
+        assert StockReservation.objects.count() == 5
+        assert not StockReservation.objects.expired().exists()
+
+    def test_sweeper_command(self, create_item):
+        """The management command reports what it released"""
+        item = create_item('reserved-item', 10)
+        seed_reservations(item, 3, timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+
+        call_command('release_expired_reservations', '--batch-size', '2', stdout=out)
+
+        assert 'Released 3 expired reservations' in out.getvalue()
+        assert not StockReservation.objects.exists()
+
+    @pytest.mark.slow
+    def test_available_read_with_millions_of_reservations(self, create_item):
+        """Report read and sweep latency on a large reservation table"""
+        rows = int(os.environ.get('RESERVATION_BENCHMARK_ROWS', 1000000))
+        hot = create_item('hot-item', stock=rows)
+        other = create_item('other-item', stock=rows)
+        seed_reservations(other, rows // 2, timezone.now() - timedelta(minutes=1))
+        seed_reservations(other, rows // 2, timezone.now() + timedelta(minutes=10))
+        seed_reservations(hot, 100, timezone.now() + timedelta(minutes=10))
+
+        started = time.perf_counter()
+        for _ in range(100):
+            available = hot.get_available_quantity()
+        read_ms = (time.perf_counter() - started) * 10
+
+        started = time.perf_counter()
+        released = StockReservation.objects.release_expired(batch_size=10000)
+        sweep_s = time.perf_counter() - started
+
+        assert available == rows - 100
+        assert released == rows // 2
+        print(f'\n{rows} reservations: available read {read_ms:.3f} ms, '
+              f'sweep of {released} rows {sweep_s:.2f} s')
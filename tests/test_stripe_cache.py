@@ -0,0 +1,127 @@
+"""Tests for the cached Stripe customer and default card lookups"""
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.utils import timezone
+from rest_framework import status
+from core import cache
+from core.cache import LRUCache
+from core.models import Order, OrderItem, UserProfile
+from core.payments import get_customer, get_default_card, save_card
+
+CARD = {'id': 'card_1', 'object': 'card', 'brand': 'Visa', 'last4': '4242',
+        'exp_month': 12, 'exp_year': 2030, 'fingerprint': 'secret'}
+
+
+def make_customer(customer_id='cus_cached'):
+    customer = MagicMock()
+    customer.__getitem__.side_effect = {'id': customer_id}.__getitem__
+    return customer
+
+
+@pytest.mark.unit
+class TestTTL:
+    """LRUCache entries expire ttl seconds after being set"""
+
+    def test_entries_expire(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+        lru = LRUCache(maxsize=4, ttl=60)
+        lru.set('a', None)
+
+        now[0] += 59
+        assert lru.get('a', 'missing') is None
+        now[0] += 1
+        assert lru.get('a', 'missing') == 'missing'
+        assert 'a' not in lru
+
+    def test_expired_entries_are_not_contained(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+        lru = LRUCache(maxsize=4, ttl=60)
+        lru.set('a', 1)
+
+        assert 'a' in lru
+        now[0] += 60
+        assert 'a' not in lru
+
+    def test_no_ttl_never_expires(self, monkeypatch):
+        lru = LRUCache(maxsize=4)
+        lru.set('a', 1)
+        monkeypatch.setattr(cache.time, 'monotonic', lambda: 1e12)
+
+        assert lru.get('a') == 1
+
+
+@pytest.mark.unit
+class TestCustomerCache:
+    """Customer and card lookups reach Stripe once per TTL"""
+
+    @patch('stripe.Customer.retrieve')
+    def test_customer_is_cached(self, mock_retrieve):
+        mock_retrieve.return_value = make_customer()
+
+        assert get_customer('cus_cached') is get_customer('cus_cached')
+        mock_retrieve.assert_called_once_with('cus_cached')
+
+    @patch('stripe.Customer.list_sources')
+    def test_default_card_keeps_display_fields(self, mock_list):
+        mock_list.return_value = {'data': [CARD]}
+
+        for _ in range(3):
+            card = get_default_card('cus_cached')
+
+        assert card == {'id': 'card_1', 'brand': 'Visa', 'last4': '4242',
+                        'exp_month': 12, 'exp_year': 2030}
+        mock_list.assert_called_once_with('cus_cached', limit=3, object='card')
+
+    @patch('stripe.Customer.list_sources')
+    def test_no_card_is_cached_too(self, mock_list):
+        mock_list.return_value = {'data': []}
+
+        assert get_default_card('cus_cached') is None
+        assert get_default_card('cus_cached') is None
+        assert mock_list.call_count == 1
+
+    @patch('stripe.Customer.create_source')
+    @patch('stripe.Customer.list_sources')
+    @patch('stripe.Customer.retrieve')
+    def test_saving_a_card_invalidates(self, mock_retrieve, mock_list, mock_create_source):
+        mock_retrieve.return_value = make_customer()
+        mock_list.return_value = {'data': []}
+        get_default_card('cus_cached')
+        get_customer('cus_cached')
+
+        save_card('cus_cached', 'tok_new')
+        mock_list.return_value = {'data': [CARD]}
+
+        mock_create_source.assert_called_once_with('cus_cached', source='tok_new')
+        assert get_default_card('cus_cached')['last4'] == '4242'
+        get_customer('cus_cached')
+        assert mock_retrieve.call_count == 2
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestTokenCheckout:
+    """API checkouts charge the token without retrieving the customer"""
+
+    @patch('stripe.Charge.create')
+    @patch('stripe.Customer.retrieve')
+    def test_customer_not_retrieved(self, mock_retrieve, mock_charge, authenticated_client,
+                                    user, test_item, test_address, test_billing_address):
+        mock_retrieve.return_value = make_customer()
+        mock_charge.return_value = {'id': 'ch_cached'}
+        UserProfile.objects.filter(user=user).update(stripe_customer_id='cus_cached')
+
+        for _ in range(2):
+            order = Order.objects.create(user=user, ordered_date=timezone.now())
+            order.items.add(OrderItem.objects.create(user=user, item=test_item))
+            response = authenticated_client.post('/api/checkout/', {
+                'stripeToken': 'tok_visa',
+                'selectedShippingAddress': test_address.id,
+                'selectedBillingAddress': test_billing_address.id
+            }, format='json')
+            assert response.status_code == status.HTTP_200_OK
+
+        mock_retrieve.assert_not_called()
@@ -0,0 +1,222 @@
+"""Tests for variation signatures on order items"""
+import pytest
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework import status
+from core import views
+from core.models import ItemVariation, Order, OrderItem, Variation
+
+# core.urls is not mounted in home.urls; the cart views redirect into it
+urlpatterns = [path('', include('core.urls'))]
+
+
+@pytest.fixture
+def shirt_options(test_item):
+    """Size and colour variations with two values each"""
+    size = Variation.objects.create(item=test_item, name='Size')
+    colour = Variation.objects.create(item=test_item, name='Colour')
+    return {
+        'small': ItemVariation.objects.create(variation=size, value='S').pk,
+        'large': ItemVariation.objects.create(variation=size, value='L').pk,
+        'red': ItemVariation.objects.create(variation=colour, value='Red').pk,
+        'blue': ItemVariation.objects.create(variation=colour, value='Blue').pk,
+    }
+
+
+def call_view(view, rf, user, item):
+    request = rf.get(f'/{item.slug}/')
+    request.user = user
+    request.session = {}
+    request._messages = FallbackStorage(request)
+    return view(request, slug=item.slug)
+
+
+def add(client, item, variations):
+    return client.post('/api/add-to-cart/', {
+        'slug': item.slug, 'variations': variations}, format='json')
+
+
+@pytest.mark.unit
+class TestSignature:
+    """make_variation_signature is canonical"""
+
+    def test_order_and_duplicates_do_not_matter(self):
+        assert (OrderItem.make_variation_signature([7, 3, 12])
+                == OrderItem.make_variation_signature(['12', 3, 7, 7]))
+
+    def test_no_variations_is_empty(self):
+        assert OrderItem.make_variation_signature([]) == ''
+
+    def test_subset_differs(self):
+        assert (OrderItem.make_variation_signature([3, 7])
+                != OrderItem.make_variation_signature([3, 7, 12]))
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+class TestVariationValidation:
+    """Item.get_variation_error checks the choice in one query"""
+
+    def test_one_value_per_variation(self, test_item, shirt_options, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            error = test_item.get_variation_error([shirt_options['small'], shirt_options['red']])
+
+        assert error is None
+
+    @pytest.mark.parametrize('picked,message', [
+        (['small'], 'Please specify the required variation types'),
+        (['small', 'large', 'red'], 'Invalid variations for this item'),
+    ])
+    def test_bad_choices(self, test_item, shirt_options, picked, message):
+        assert test_item.get_variation_error([shirt_options[p] for p in picked]) == message
+
+    def test_other_items_values_are_refused(self, test_item, test_items, shirt_options):
+        other = Variation.objects.create(item=test_items[0], name='Size')
+        foreign = ItemVariation.objects.create(variation=other, value='XL').pk
+
+        error = test_item.get_variation_error(
+            [shirt_options['small'], shirt_options['red'], foreign])
+
+        assert error == 'Invalid variations for this item'
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestAddToCartWithVariations:
+    """Matching lines are found by signature"""
+
+    def test_same_choice_merges_in_any_order(self, authenticated_client, user, test_item, shirt_options):
+        first = add(authenticated_client, test_item, [shirt_options['small'], shirt_options['red']])
+        second = add(authenticated_client, test_item, [shirt_options['red'], shirt_options['small']])
+
+        assert first.status_code == second.status_code == status.HTTP_200_OK
+        line = OrderItem.objects.get(user=user, ordered=False)
+        assert line.quantity == 2
+        assert line.variation_signature == OrderItem.make_variation_signature(
+            [shirt_options['small'], shirt_options['red']])
+        assert set(line.item_variations.values_list('pk', flat=True)) == {
+            shirt_options['small'], shirt_options['red']}
+
+    def test_different_choice_is_a_new_line(self, authenticated_client, user, test_item, shirt_options):
+        add(authenticated_client, test_item, [shirt_options['small'], shirt_options['red']])
+        add(authenticated_client, test_item, [shirt_options['small'], shirt_options['blue']])
+
+        assert OrderItem.objects.filter(user=user, ordered=False).count() == 2
+
+    def test_invalid_choice_is_refused(self, authenticated_client, test_item, shirt_options):
+        response = add(authenticated_client, test_item, [shirt_options['small']])
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['message'] == 'Please specify the required variation types'
+        assert not OrderItem.objects.exists()
+
+    def test_repeat_add_is_constant_queries(self, authenticated_client, test_item, shirt_options,
+                                            django_assert_max_num_queries):
+        """Merging into an existing line does not grow with dimensions"""
+        picked = [shirt_options['small'], shirt_options['red']]
+        add(authenticated_client, test_item, picked)
+
+        # session + user, item, validation, cart; then the batch: item
+        # lock, validation, lines, active holds, line update, m2m add,
+        # hold delete and insert, summary aggregate and update; savepoints
+        with django_assert_max_num_queries(17):
+            response = add(authenticated_client, test_item, picked)
+
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_line_lookup_uses_signature_index(self, user, test_item):
+        plan = OrderItem.objects.filter(
+            user=user, ordered=False, item=test_item,
+            variation_signature=OrderItem.make_variation_signature([1, 2])).explain()
+
+        assert 'orderitem_user_open_line_idx' in plan
+
+
+@pytest.mark.api
+@pytest.mark.django_db
+class TestCartLineMatching:
+    """The API cart views only match lines on the cart, by signature"""
+
+    @pytest.fixture
+    def cart(self, user, test_item, shirt_options, create_order):
+        order = create_order(user)
+        for colour, quantity in [('red', 2), ('blue', 3)]:
+            line = OrderItem.objects.create(user=user, item=test_item, quantity=quantity)
+            line.set_variations([shirt_options['small'], shirt_options[colour]])
+            order.items.add(line)
+        return order
+
+    def quantities(self, order, shirt_options):
+        return {
+            colour: order.items.get(item_variations=shirt_options[colour]).quantity
+            for colour in ['red', 'blue']
+        }
+
+    def test_add_skips_lines_outside_the_cart(self, authenticated_client, user, test_item, shirt_options, cart):
+        picked = [shirt_options['large'], shirt_options['red']]
+        orphan = OrderItem.objects.create(user=user, item=test_item, quantity=5)
+        orphan.set_variations(picked)
+
+        add(authenticated_client, test_item, picked)
+
+        orphan.refresh_from_db()
+        assert orphan.quantity == 5
+        assert cart.items.get(variation_signature=orphan.variation_signature).quantity == 1
+
+    def test_decrement_matches_the_variations(self, authenticated_client, test_item, shirt_options, cart):
+        for colour in ['blue', 'red']:
+            response = authenticated_client.post('/api/order-item/update-quantity/', {
+                'slug': test_item.slug,
+                'variations': [shirt_options[colour], shirt_options['small']],
+            }, format='json')
+            assert response.status_code == status.HTTP_200_OK
+
+        assert self.quantities(cart, shirt_options) == {'red': 1, 'blue': 2}
+
+    def test_decrement_skips_lines_outside_the_cart(self, authenticated_client, user, test_item, cart):
+        orphan = OrderItem.objects.create(user=user, item=test_item, quantity=5)
+        line = OrderItem.objects.create(user=user, item=test_item, quantity=2)
+        cart.items.add(line)
+
+        authenticated_client.post('/api/order-item/update-quantity/', {
+            'slug': test_item.slug}, format='json')
+
+        orphan.refresh_from_db()
+        line.refresh_from_db()
+        assert (orphan.quantity, line.quantity) == (5, 1)
+
+
+@pytest.mark.unit
+@pytest.mark.django_db
+@pytest.mark.urls(__name__)
+class TestTemplateCartViewsBesideVariationLines:
+    """The template cart views only touch the line without variations"""
+
+    @pytest.fixture
+    def cart(self, user, test_item, shirt_options):
+        order = Order.objects.create(user=user, ordered_date=timezone.now())
+        line = OrderItem.objects.create(user=user, item=test_item)
+        line.set_variations([shirt_options['small'], shirt_options['red']])
+        order.items.add(line)
+        return order
+
+    def test_add_to_cart_adds_a_plain_line(self, rf, user, test_item, cart):
+        call_view(views.add_to_cart, rf, user, test_item)
+
+        plain = cart.items.get(variation_signature='')
+        assert plain.quantity == 1
+        assert cart.items.count() == 2
+        assert cart.items.exclude(pk=plain.pk).get().quantity == 1
+
+    def test_remove_from_cart_keeps_the_variation_line(self, rf, user, test_item, cart):
+        cart.items.add(OrderItem.objects.create(user=user, item=test_item))
+
+        call_view(views.remove_from_cart, rf, user, test_item)
+
+        assert cart.items.get().variation_signature != ''
+
+    def test_remove_without_a_plain_line(self, rf, user, test_item, cart):
+        call_view(views.remove_single_item_from_cart, rf, user, test_item)
+
+        assert cart.items.count() == 1